@@ -0,0 +1,62 @@
+"""Пропускная способность записи в базу при одновременной работе многих пользователей.
+
+Сравнивает обычный режим (коммит на каждую операцию) и групповой коммит
+(DB_GROUP_COMMIT). Запуск из корня проекта:
+
+    python -m benchmarks.db_write_benchmark --users 32 --operations 50
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+from src.config import settings
+from src.database.database import Database
+
+
+def run(group_commit: bool, users: int, operations: int, synchronous: str) -> float:
+    """Возвращает число операций записи в секунду"""
+    settings.DB_GROUP_COMMIT = group_commit
+    settings.DB_SYNCHRONOUS = synchronous
+    with tempfile.TemporaryDirectory() as directory:
+        settings.DATABASE_PATH = os.path.join(directory, 'bench.db')
+        db = Database()
+        start_barrier = threading.Barrier(users + 1)
+
+        def user(chat_id: int):
+            start_barrier.wait()
+            for i in range(operations):
+                db.add_event(chat_id, f"Контакт {i}", datetime.date(2000, i % 12 + 1, i % 28 + 1))
+                db.update_notification_settings(chat_id, 'birthday', notify_on_day=i % 2)
+
+        threads = [threading.Thread(target=user, args=(chat_id,)) for chat_id in range(1, users + 1)]
+        for thread in threads:
+            thread.start()
+        start_barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        commits = db.batcher.stats['commits'] if db.batcher else users * operations * 2
+        db.close()
+    total = users * operations * 2
+    print(f"{'group commit' if group_commit else 'commit per write':<18} {total / elapsed:>10.1f} writes/s "
+          f"{elapsed:>8.2f} s  commits={commits}")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--operations', type=int, default=50)
+    parser.add_argument('--synchronous', default='FULL', help="PRAGMA synchronous (FULL - fsync на коммит)")
+    args = parser.parse_args()
+
+    run(False, args.users, args.operations, args.synchronous)
+    run(True, args.users, args.operations, args.synchronous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Стоимость маршрутизации одного обновления: цепочка предикатов telebot против Router.
+
+Маршруты берутся из настоящих Handlers, сами обработчики заменяются пустыми.
+Запуск из корня проекта:
+
+    python -m benchmarks.dispatch_benchmark --updates 20000
+"""
+import argparse
+import time
+from typing import Callable, List
+from telebot import TeleBot, types
+from src.config import settings
+from src.database.database import Database
+from src.handlers.callbacks import encode_callback
+from src.handlers.handlers import Handlers
+from src.handlers.router import Router
+from src.services.job_services import AIJobExecutor
+
+TOKEN = "123456:BENCHMARK"
+
+
+def noop(*args):
+    pass
+
+
+def load_routes() -> Router:
+    """Маршрутизатор с маршрутами бота и пустыми обработчиками"""
+    settings.DATABASE_PATH = ':memory:'
+    bot = TeleBot(TOKEN, threaded=False)
+    ai_jobs = AIJobExecutor(bot, workers=1)
+    handlers = Handlers(bot, Database(), None, ai_jobs=ai_jobs)
+    handlers.setup_handlers()
+    ai_jobs.shutdown()
+
+    router = Router()
+    for command in handlers.router.commands:
+        router.command(command)(noop)
+    for text in handlers.router.texts:
+        router.message(text)(noop)
+    for data in handlers.router.callbacks:
+        router.callback(data)(noop)
+    for prefix in handlers.router.callback_prefixes:
+        router.callback_prefix(prefix)(noop)
+    router.fallback(noop)
+    return router
+
+
+def linear_bot(router: Router) -> TeleBot:
+    """Бот с прежней регистрацией: по обработчику с предикатом на каждый маршрут"""
+    bot = TeleBot(TOKEN, threaded=False)
+    for command in router.commands:
+        bot.register_message_handler(noop, commands=[command])
+    for text in router.texts:
+        bot.register_message_handler(noop, func=lambda message, text=text: message.text == text)
+    for data in router.callbacks:
+        bot.register_callback_query_handler(noop, func=lambda call, data=data: call.data == data)
+    for prefix in router.callback_prefixes:
+        bot.register_callback_query_handler(noop, func=lambda call, prefix=prefix: call.data.startswith(prefix))
+    bot.register_callback_query_handler(noop, func=lambda call: True)
+    return bot
+
+
+def router_bot(router: Router) -> TeleBot:
+    bot = TeleBot(TOKEN, threaded=False)
+    router.register(bot)
+    return bot
+
+
+def make_updates(router: Router, count: int) -> List[types.Update]:
+    user = {"id": 1, "is_bot": False, "first_name": "Bench"}
+    chat = {"id": 1, "type": "private"}
+    texts = ['/start'] + list(router.texts)
+    callbacks = list(router.callbacks) + [
+        encode_callback('profile', 'birthday', 42),
+        encode_callback('page', 'holiday', 3),
+        'toggle_notification_birthday_notify_on_day',
+        'reminder_hour_9',
+    ]
+    updates = []
+    for i in range(count):
+        if i % 2:
+            message = {"message_id": i, "date": 0, "chat": chat, "from": user, "text": texts[i % len(texts)]}
+            updates.append(types.Update.de_json({"update_id": i, "message": message}))
+        else:
+            message = {"message_id": i, "date": 0, "chat": chat, "text": "menu"}
+            call = {"id": str(i), "chat_instance": "1", "from": user, "message": message,
+                    "data": callbacks[i % len(callbacks)]}
+            updates.append(types.Update.de_json({"update_id": i, "callback_query": call}))
+    return updates
+
+
+def measure(process: Callable[[List[types.Update]], None], updates: List[types.Update], rounds: int) -> float:
+    """Лучшее из rounds время обработки одного обновления в микросекундах"""
+    best = float('inf')
+    for _ in range(rounds):
+        started = time.perf_counter()
+        process(updates)
+        best = min(best, time.perf_counter() - started)
+    return best / len(updates) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    router = load_routes()
+    updates = make_updates(router, args.updates)
+    print(f"маршрутов: {len(router.commands) + len(router.texts)} сообщений, "
+          f"{len(router.callbacks) + len(router.callback_prefixes)} callback")
+
+    linear = linear_bot(router)
+    routed = router_bot(router)
+    results = [
+        ('telebot, предикаты', measure(linear.process_new_updates, updates, args.rounds)),
+        ('telebot, Router', measure(routed.process_new_updates, updates, args.rounds)),
+    ]
+
+    # Только выбор обработчика, без накладных расходов telebot на обновление
+    predicates = [(handler['filters']['func'], handler) for handler in linear.callback_query_handlers]
+    calls = [update.callback_query for update in updates if update.callback_query]
+
+    def scan(_):
+        for call in calls:
+            next(handler for func, handler in predicates if func(call))
+
+    def lookup(_):
+        for call in calls:
+            router.resolve_callback(call)
+
+    results += [
+        ('выбор callback, предикаты', measure(scan, calls, args.rounds)),
+        ('выбор callback, Router', measure(lookup, calls, args.rounds)),
+    ]
+    for name, micros in results:
+        print(f"{name:<28} {micros:>8.2f} мкс/обновление")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""Задержка обработчиков бота под нагрузкой без токена и сети.
+
+Для каждого виртуального пользователя строится сценарий из обновлений Telegram,
+который проходит по всем путям меню Handlers.setup_handlers: списки и страницы,
+профиль события, добавление, изменение даты, заметка и удаление, генерация
+поздравления и идей подарков (с сохранением, повтором, отменой и ручным вводом),
+личные и глобальные праздники, импорт и экспорт файлов, настройки уведомлений,
+время напоминаний и часовой пояс. Сценарии воспроизводятся параллельно против
+бота-заглушки (каждый вызов API и скачивание файла ждут --api-ms) и временной
+базы; AIService заменён заглушкой с задержкой --ai-ms. Запуск из корня проекта:
+
+    python -m benchmarks.handler_benchmark --users 200 --concurrency 16 --api-ms 20 --ai-ms 500
+
+Для каждого шага печатаются p50/p95/p99 времени обработки обновления. Перед
+кнопкой "Использовать" пользователь ждёт окончания своей генерации, как в
+настоящем диалоге; это ожидание в замер не входит. Если обработчик где-то ждёт
+генерацию синхронно, это видно по задержке порядка --ai-ms. Если обработчик
+записал в журнал ошибку, отчёт не печатается: время пути с исключением не
+годится для сравнения.
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from telebot import TeleBot, types
+from benchmarks.reminder_benchmark import populate
+from src.config import settings
+from src.database.database import Database
+from src.handlers import handlers as handlers_module
+from src.handlers.callbacks import encode_callback
+from src.handlers.handlers import Handlers
+from src.services.job_services import AIJobExecutor
+
+TOKEN = "123456:BENCHMARK"
+# Методы Bot API, которые вызывают обработчики
+API_METHODS = ('send_message', 'edit_message_text', 'answer_callback_query', 'delete_message',
+               'send_chat_action', 'send_document')
+# Позиция chat_id среди позиционных аргументов, если он не передан по имени
+CHAT_ID_POSITIONS = {'edit_message_text': 1, 'answer_callback_query': None}
+
+
+class StubAIService:
+    """Заглушка AIService: отвечает через latency секунд, потоковые методы отдают текст по частям"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def generate(self, name: str) -> str:
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return f"Поздравляю, {name}! Счастья, здоровья и удачи."
+
+    def generate_congratulation(self, name: str, info: str, use_cache: bool = True) -> str:
+        return self.generate(name)
+
+    def generate_gift_ideas(self, name: str, info: str, use_cache: bool = True) -> str:
+        return self.generate(name)
+
+    def stream(self, name: str) -> Iterator[str]:
+        text = self.generate(name)
+        for start in range(0, len(text), 16):
+            yield text[start:start + 16]
+
+    def stream_congratulation(self, name: str, info: str, use_cache: bool = True) -> Iterator[str]:
+        return self.stream(name)
+
+    def stream_gift_ideas(self, name: str, info: str, use_cache: bool = True) -> Iterator[str]:
+        return self.stream(name)
+
+
+def stub_api(bot: TeleBot, latency: float) -> Dict[str, int]:
+    """Заменяет методы Bot API заглушками с задержкой; возвращает счётчики вызовов"""
+    calls = {name: 0 for name in API_METHODS}
+    lock = threading.Lock()
+
+    def make(name):
+        position = CHAT_ID_POSITIONS.get(name, 0)
+
+        def method(*args, **kwargs):
+            chat_id = kwargs.get('chat_id')
+            if chat_id is None and position is not None and len(args) > position:
+                chat_id = args[position]
+            with lock:
+                calls[name] += 1
+                message_id = sum(calls.values())
+            time.sleep(latency)
+            if name in ('send_message', 'edit_message_text', 'send_document'):
+                chat = types.Chat(chat_id if isinstance(chat_id, int) else 0, 'private')
+                return types.Message(message_id, None, 0, chat, 'text', {}, '')
+            return True
+        return method
+
+    for name in API_METHODS:
+        setattr(bot, name, make(name))
+    return calls
+
+
+def stub_download(latency: float):
+    """Заглушка download_document: через latency секунд отдаёт CSV с тремя днями рождения"""
+    def download(bot: TeleBot, file_id: str) -> io.BytesIO:
+        time.sleep(latency)
+        rows = ''.join(f"Импорт {file_id} {number},{number + 10:02d}.04\n" for number in range(3))
+        return io.BytesIO(rows.encode('utf-8'))
+    return download
+
+
+class ErrorCollector(logging.Handler):
+    """Запоминает записи журнала уровня ERROR и выше"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+
+def make_message(chat_id: int, text: str, message_id: int) -> types.Update:
+    return types.Update.de_json({
+        'update_id': message_id,
+        'message': {
+            'message_id': message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'text': text,
+        }
+    })
+
+
+def make_callback(chat_id: int, data: str, message_id: int) -> types.Update:
+    return types.Update.de_json({
+        'update_id': message_id,
+        'callback_query': {
+            'id': str(message_id), 'chat_instance': str(chat_id), 'data': data,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {
+                'message_id': message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': 'menu',
+            },
+        }
+    })
+
+
+def make_document(chat_id: int, file_name: str, message_id: int) -> types.Update:
+    return types.Update.de_json({
+        'update_id': message_id,
+        'message': {
+            'message_id': message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'document': {'file_id': f"{chat_id}-{message_id}", 'file_unique_id': f"{chat_id}-{message_id}",
+                         'file_name': file_name, 'file_size': 100},
+        }
+    })
+
+
+# Шаг без обновления: пользователь ждёт окончания своей генерации
+WAIT = 'wait'
+
+
+def scenario(chat_id: int, event_id: int, victim_id: int, holiday_id: Optional[int],
+             round_number: int) -> List[Tuple[str, Optional[types.Update]]]:
+    """Шаги одного пользователя: (название шага, обновление или None для ожидания генерации).
+
+    victim_id - день рождения, который удаляется в этом повторе; holiday_id - личный
+    праздник чата для профиля, если он есть.
+    """
+    day = f"{round_number % 28 + 1:02d}"
+    steps = [
+        ('/start', 'message', '/start'),
+        ('информация о боте', 'message', 'Информация о боте'),
+        ('меню дней рождения', 'message', 'Дни рождения'),
+        ('список', 'message', 'Список дней рождения'),
+        ('страница списка', 'callback', encode_callback('page', 'birthday', 1)),
+        ('профиль', 'callback', encode_callback('profile', 'birthday', event_id)),
+        ('к списку', 'callback', encode_callback('list', 'birthday')),
+        ('добавление: начало', 'message', 'Добавить день рождения'),
+        ('добавление: ввод', 'message', f"Гость {chat_id}-{round_number} {day}.03"),
+        ('изменение даты: начало', 'callback', encode_callback('edit', 'birthday', event_id)),
+        ('изменение даты: ввод', 'message', f"{day}.05"),
+        ('заметка: начало', 'callback', encode_callback('add_note', 'birthday', event_id)),
+        ('заметка: ввод', 'message', "Любит настольные игры"),
+        ('удаление: подтверждение', 'callback', encode_callback('delete', 'birthday', victim_id)),
+        ('удаление: выполнение', 'callback', encode_callback('confirm_delete', 'birthday', victim_id)),
+        ('поздравление: меню', 'callback', encode_callback('add_wish', 'birthday', event_id)),
+        ('поздравление: начало', 'callback', encode_callback('generate_wish', 'birthday', event_id)),
+        ('поздравление: ввод', 'message', "Коллега, любит горы"),
+        ('поздравление: ожидание', WAIT, None),
+        ('поздравление: сохранить', 'callback', encode_callback('use_wish', 'birthday', event_id)),
+        ('поздравление: другое', 'callback', encode_callback('regenerate_wish', 'birthday', event_id)),
+        ('поздравление: вручную', 'callback', encode_callback('manual_wish', 'birthday', event_id)),
+        ('поздравление: ручной ввод', 'message', "С днём рождения, коллега!"),
+        ('подарки: меню', 'callback', encode_callback('add_gift', 'birthday', event_id)),
+        ('подарки: начало', 'callback', encode_callback('generate_gift', 'birthday', event_id)),
+        ('подарки: ввод', 'message', "Любит горы и походы"),
+        ('подарки: ожидание', WAIT, None),
+        ('подарки: сохранить', 'callback', encode_callback('use_gift', 'birthday', event_id)),
+        ('подарки: другие', 'callback', encode_callback('regenerate_gift', 'birthday', event_id)),
+        ('подарки: ввод повтора', 'message', "Любит горы и походы"),
+        ('отмена генерации', 'callback', 'cancel_generation'),
+        ('подарки: ожидание отмены', WAIT, None),
+        ('подарки: вручную', 'callback', encode_callback('manual_gift', 'birthday', event_id)),
+        ('подарки: ручной ввод', 'message', "Термос, карта, рюкзак"),
+        ('импорт: начало', 'message', 'Импорт контактов'),
+        ('импорт: файл', 'document', 'contacts.csv'),
+        ('экспорт: меню', 'message', 'Экспорт контактов'),
+        ('экспорт: CSV', 'callback', 'export_csv'),
+        ('экспорт: vCard', 'callback', 'export_vcard'),
+        ('экспорт: iCalendar', 'callback', 'export_ics'),
+        ('меню праздников', 'message', 'Праздники'),
+        ('добавление праздника: начало', 'message', 'Добавить праздник'),
+        ('добавление праздника: ввод', 'message', f"Праздник {chat_id}-{round_number} {day}.06"),
+        ('личные праздники', 'message', 'Список личных праздников'),
+        ('глобальные праздники', 'message', 'Список глобальных праздников'),
+        ('меню настроек', 'message', 'Настройка уведомлений'),
+        ('настройки дней рождения', 'message', 'Уведомления о днях рождения'),
+        ('настройки личных праздников', 'message', 'Уведомления о личных праздниках'),
+        ('настройки глобальных праздников', 'message', 'Уведомления о глобальных праздниках'),
+        ('переключение уведомления', 'callback', 'toggle_notification_birthday_notify_one_week_before'),
+        ('время уведомлений', 'message', 'Время уведомлений'),
+        ('выбор часа', 'callback', f"reminder_hour_{8 + round_number % 3}"),
+        ('часовой пояс: начало', 'callback', 'reminder_timezone'),
+        ('часовой пояс: ввод', 'message', 'Europe/Moscow'),
+        ('назад', 'message', 'Назад'),
+    ]
+    if holiday_id is not None:
+        steps.insert(steps.index(('личные праздники', 'message', 'Список личных праздников')) + 1,
+                     ('профиль праздника', 'callback', encode_callback('profile', 'holiday', holiday_id)))
+    makers = {'message': make_message, 'callback': make_callback, 'document': make_document}
+    updates = []
+    for number, (label, kind, payload) in enumerate(steps, 1):
+        message_id = round_number * 1000 + number
+        updates.append((label, None if kind == WAIT else makers[kind](chat_id, payload, message_id)))
+    return updates
+
+
+def wait_for_jobs(ai_jobs: AIJobExecutor, user_id: int, timeout: float = 60.0):
+    """Ждёт, пока у пользователя не останется задач генерации"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with ai_jobs.lock:
+            if not ai_jobs.jobs.get(user_id):
+                return
+        time.sleep(0.005)
+    logging.error(f"Генерация пользователя {user_id} не завершилась за {timeout:g} с")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=3, help="повторов сценария каждым пользователем")
+    parser.add_argument('--concurrency', type=int, default=8, help="одновременно обрабатываемых пользователей")
+    parser.add_argument('--api-ms', type=float, default=0.0, help="задержка каждого вызова Bot API")
+    parser.add_argument('--ai-ms', type=float, default=500.0, help="задержка генерации AI")
+    parser.add_argument('--events', type=int, default=30, help="событий в каждом чате до начала")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings.DATABASE_PATH = os.path.join(directory, 'bench.db')
+        db = Database()
+        populate(db, args.users, args.events, seed=1)
+        birthday_ids: Dict[int, List[int]] = {}
+        for chat_id, event_id in db.conn.execute('SELECT chat_id, id FROM birthdays ORDER BY chat_id, id'):
+            birthday_ids.setdefault(chat_id, []).append(event_id)
+        holiday_ids = dict(db.conn.execute('SELECT chat_id, MIN(id) FROM holidays GROUP BY chat_id').fetchall())
+
+        bot = TeleBot(TOKEN, threaded=False)
+        api_calls = stub_api(bot, args.api_ms / 1000)
+        handlers_module.download_document = stub_download(args.api_ms / 1000)
+        ai_service = StubAIService(args.ai_ms / 1000)
+        ai_jobs = AIJobExecutor(bot)
+        handlers = Handlers(bot, db, ai_service, ai_jobs=ai_jobs)
+        handlers.setup_handlers()
+
+        # Первый день рождения чата редактируется, остальные по одному удаляются в каждом повторе
+        scripts = {chat_id: [step for round_number in range(args.rounds)
+                             for step in scenario(chat_id, ids[0], ids[1 + round_number % (len(ids) - 1)],
+                                                  holiday_ids.get(chat_id), round_number)]
+                   for chat_id, ids in birthday_ids.items() if len(ids) > 1}
+        latencies: Dict[str, List[float]] = {}
+        lock = threading.Lock()
+
+        def replay(chat_id: int):
+            # Шаги одного пользователя идут по порядку, как в настоящем диалоге
+            for label, update in scripts[chat_id]:
+                if update is None:
+                    wait_for_jobs(ai_jobs, chat_id)
+                    continue
+                started = time.perf_counter()
+                try:
+                    bot.process_new_updates([update])
+                except Exception:
+                    logging.exception(f"Шаг '{label}' чата {chat_id} завершился исключением")
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.setdefault(label, []).append(elapsed)
+
+        errors = ErrorCollector()
+        logging.getLogger().addHandler(errors)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(replay, scripts))
+        elapsed = time.perf_counter() - started
+        ai_jobs.executor.shutdown(wait=True)
+        logging.getLogger().removeHandler(errors)
+        db.close()
+
+    if errors.records:
+        for record in errors.records[:10]:
+            print(f"{record.levelname}: {record.getMessage()}")
+        parser.exit(1, f"Обработчики записали ошибок: {len(errors.records)}; замер недействителен\n")
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} обновлений за {elapsed:.2f} с ({total / elapsed:.0f}/с), "
+          f"пользователей {args.users}, параллельно {args.concurrency}, "
+          f"Bot API {args.api_ms:g} мс, AI {args.ai_ms:g} мс")
+    print(f"{'шаг':<32} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    for label, values in latencies.items():
+        print(f"{label:<32} {len(values):>6} {percentile(values, 0.5) * 1000:>9.2f} "
+              f"{percentile(values, 0.95) * 1000:>9.2f} {percentile(values, 0.99) * 1000:>9.2f} "
+              f"{max(values) * 1000:>9.2f}")
+    everything = [value for values in latencies.values() for value in values]
+    print(f"{'все шаги':<32} {len(everything):>6} {percentile(everything, 0.5) * 1000:>9.2f} "
+          f"{percentile(everything, 0.95) * 1000:>9.2f} {percentile(everything, 0.99) * 1000:>9.2f} "
+          f"{max(everything) * 1000:>9.2f}")
+    print(f"Вызовы Bot API: {api_calls}; генераций AI: {ai_service.calls}")
+
+
+if __name__ == '__main__':
+    main()
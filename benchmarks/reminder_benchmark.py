@@ -0,0 +1,282 @@
+"""Нагрузочный тест ночной рассылки напоминаний на синтетических данных.
+
+Заполняет схему Database N чатами по M событий с реалистичным распределением
+дат, затем выполняет ReminderService.run_day с ботом-заглушкой, который только
+запоминает отправки. Дата, зерно генератора и размеры фиксированы, поэтому
+результаты разных коммитов можно сравнивать. Запуск из корня проекта:
+
+    python -m benchmarks.reminder_benchmark --chats 5000 --events 20 --json before.json
+    python -m benchmarks.reminder_benchmark --chats 5000 --events 20 --compare before.json
+
+Показатели: время проверок, число SQL-запросов, шаги виртуальной машины SQLite
+(sqlite3 не даёт счётчик прочитанных строк, поэтому число выполненных
+инструкций используется как его детерминированная замена), запросы с полным
+просмотром таблицы, пиковая память Python и отправки в секунду. Строки
+executemany считаются отдельными запросами.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+from telebot import types
+from src.config import settings
+from src.database.database import Database
+from src.services.reminder_services import ReminderService
+
+# Доля рождений по месяцам (летний и осенний пик, как в статистике рождаемости)
+MONTH_WEIGHTS = [7.8, 7.3, 8.2, 8.0, 8.4, 8.3, 8.9, 9.0, 8.8, 8.6, 8.1, 8.6]
+DAYS_IN_MONTH = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+HOLIDAY_NAMES = ["Годовщина свадьбы", "День знакомства", "Новоселье", "День компании", "Юбилей"]
+# Каждый PROGRESS_STEP инструкций виртуальной машины SQLite увеличивает счётчик
+PROGRESS_STEP = 100
+
+
+class QueryCounter:
+    """Счётчики SQL, общие для соединений всех потоков"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.vm_steps = 0
+        self.statements: Dict[str, int] = {}
+
+    def trace(self, statement: str):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.queries += 1
+            # Для поиска полных просмотров нужны только чтения
+            if statement.lstrip()[:6].upper() == 'SELECT':
+                self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def progress(self) -> int:
+        if self.enabled:
+            self.vm_steps += PROGRESS_STEP
+        return 0
+
+
+class TracedDatabase(Database):
+    """Database, каждое соединение которой считает запросы и шаги виртуальной машины"""
+
+    def __init__(self, counter: QueryCounter):
+        self.counter = counter
+        super().__init__()
+
+    def get_db_connection(self, readonly: bool = False) -> sqlite3.Connection:
+        conn = super().get_db_connection(readonly)
+        conn.set_trace_callback(self.counter.trace)
+        conn.set_progress_handler(self.counter.progress, PROGRESS_STEP)
+        return conn
+
+
+class RecordingBot:
+    """Заглушка TeleBot: запоминает отправленные сообщения вместо обращения к Telegram"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent: List[int] = []
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> types.Message:
+        with self.lock:
+            self.sent.append(chat_id)
+            message_id = len(self.sent)
+        return types.Message(message_id, None, 0, types.Chat(chat_id, 'private'), 'text', {}, '')
+
+
+def random_date(rng: random.Random) -> datetime.date:
+    month = rng.choices(range(1, 13), MONTH_WEIGHTS)[0]
+    day = rng.randint(1, DAYS_IN_MONTH[month - 1])
+    # 29 февраля рождаются примерно вчетверо реже, чем в другие дни
+    if month == 2 and day == 29 and rng.random() > 0.25:
+        day = 28
+    year = rng.randint(1950, 2015) if rng.random() < 0.7 else 2000
+    if month == 2 and day == 29:
+        year = 2000
+    return datetime.date(year, month, day)
+
+
+def populate(db: Database, chats: int, events: int, seed: int):
+    """Заполняет базу чатами, днями рождения, личными праздниками и настройками уведомлений.
+
+    Около 85% событий чата - дни рождения; часть событий с заметками и
+    поздравлениями; у 15% чатов отключена часть уведомлений.
+    """
+    rng = random.Random(seed)
+    birthdays, holidays, notification_settings = [], [], []
+    for chat_id in range(1, chats + 1):
+        for index in range(events):
+            date = random_date(rng)
+            notes = "Любит книги и путешествия" if rng.random() < 0.3 else ''
+            if rng.random() < 0.85:
+                wishes = "С днём рождения!" if rng.random() < 0.2 else ''
+                birthdays.append((chat_id, f"Контакт {index}", date.isoformat(), notes, wishes,
+                                  Database.month_day_key(date)))
+            else:
+                holidays.append((chat_id, f"{rng.choice(HOLIDAY_NAMES)} {index}", date.isoformat(), notes,
+                                 Database.month_day_key(date)))
+        for event_type in ('birthday', 'holiday', 'global_holiday'):
+            flags = [1, 1, 1] if rng.random() > 0.15 else [rng.randint(0, 1) for _ in range(3)]
+            notification_settings.append((chat_id, event_type, *flags))
+
+    def operation(conn):
+        conn.executemany('''
+            INSERT OR IGNORE INTO birthdays (chat_id, name, date, notes, wishes, month_day)
+            VALUES (?, ?, ?, ?, ?, ?)''', birthdays)
+        conn.executemany('''
+            INSERT OR IGNORE INTO holidays (chat_id, name, date, notes, month_day)
+            VALUES (?, ?, ?, ?, ?)''', holidays)
+        conn.executemany('''
+            INSERT OR IGNORE INTO notification_settings
+            (chat_id, event_type, notify_on_day, notify_one_day_before, notify_one_week_before)
+            VALUES (?, ?, ?, ?, ?)''', notification_settings)
+
+    db.write(operation)
+    db.conn.execute('ANALYZE')
+
+
+def full_scans(db: Database, statements: Dict[str, int]) -> List[str]:
+    """Запросы, план которых просматривает таблицу целиком без индекса"""
+    scans = []
+    for statement in statements:
+        try:
+            plan = db.read_conn.execute(f'EXPLAIN QUERY PLAN {statement}').fetchall()
+        except sqlite3.Error:
+            continue
+        details = [row[-1] for row in plan]
+        if any(detail.startswith('SCAN ') and 'INDEX' not in detail for detail in details):
+            scans.append(' '.join(statement.split())[:120])
+    return scans
+
+
+def run_once(db: Database, counter: QueryCounter, day: datetime.date, track_memory: bool) -> Dict:
+    """Одна рассылка за day с чистым журналом отправок"""
+    db.write(lambda conn: conn.execute('DELETE FROM reminder_deliveries'))
+    bot = RecordingBot()
+    service = ReminderService(bot, db)
+
+    phases: Dict[str, float] = {}
+    for name in ('check_global_holidays', 'check_personal_events'):
+        method = getattr(service, name)
+
+        def timed(*args, method=method, name=name, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                phases[name] = time.perf_counter() - started
+        setattr(service, name, timed)
+
+    counter.reset()
+    if track_memory:
+        tracemalloc.start()
+    # Счётчики запросов сами выделяют память, поэтому в замере памяти отключены
+    counter.enabled = not track_memory
+    started = time.perf_counter()
+    service.run_day(day)
+    elapsed = time.perf_counter() - started
+    counter.enabled = False
+    peak = 0
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'wall_s': elapsed,
+        'global_holidays_s': phases.get('check_global_holidays', 0.0),
+        'personal_events_s': phases.get('check_personal_events', 0.0),
+        'queries': counter.queries,
+        'vm_steps': counter.vm_steps,
+        'full_scans': full_scans(db, counter.statements),
+        'peak_memory_kb': peak // 1024,
+        'sends': len(bot.sent),
+        'sends_per_s': len(bot.sent) / elapsed if elapsed else 0.0,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict, baseline: Optional[Dict]):
+    metrics = [
+        ('wall_s', 'время run_day, с'),
+        ('global_holidays_s', '  глобальные праздники, с'),
+        ('personal_events_s', '  личные события, с'),
+        ('queries', 'SQL-запросов'),
+        ('vm_steps', 'шагов VM SQLite'),
+        ('peak_memory_kb', 'пиковая память, КБ'),
+        ('sends', 'отправлено'),
+        ('sends_per_s', 'отправок в секунду'),
+    ]
+    for key, title in metrics:
+        value = results[key]
+        line = f"{title:<28} {value:>14.3f}" if isinstance(value, float) else f"{title:<28} {value:>14}"
+        if baseline and baseline.get(key):
+            line += f"   {(value - baseline[key]) / baseline[key] * 100:+7.1f}% (было {baseline[key]:.6g})"
+        print(line)
+    for statement in results['full_scans']:
+        print(f"полный просмотр: {statement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=20, help="событий на чат")
+    parser.add_argument('--date', default='2024-12-31', help="день рассылки (по умолчанию канун Нового года)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="запусков для замера времени (берётся лучший)")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--compare', help="сравнить с результатами из файла")
+    args = parser.parse_args()
+    day = datetime.date.fromisoformat(args.date)
+
+    counter = QueryCounter()
+    with tempfile.TemporaryDirectory() as directory:
+        settings.DATABASE_PATH = os.path.join(directory, 'bench.db')
+        settings.PREGENERATE_DAYS = 0
+        db = TracedDatabase(counter)
+        started = time.perf_counter()
+        populate(db, args.chats, args.events, args.seed)
+        print(f"Сгенерировано {args.chats} чатов x {args.events} событий за {time.perf_counter() - started:.1f} с")
+
+        # Время без tracemalloc, память - отдельным запуском
+        runs = [run_once(db, counter, day, track_memory=False) for _ in range(max(args.repeat, 1))]
+        results = min(runs, key=lambda run: run['wall_s'])
+        results['peak_memory_kb'] = run_once(db, counter, day, track_memory=True)['peak_memory_kb']
+        db.close()
+
+    results['params'] = {'chats': args.chats, 'events': args.events, 'date': args.date, 'seed': args.seed}
+    results['commit'] = git_commit()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('params') != results['params']:
+            print(f"Внимание: параметры отличаются от {args.compare}: {baseline.get('params')}")
+        print(f"Сравнение с {baseline.get('commit') or args.compare}")
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Сравнение пропускной способности long polling и вебхука на локальном фейковом Telegram API.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.webhook_benchmark --updates 2000 --chats 100 --handler-ms 5
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+import requests
+from telebot import TeleBot, apihelper
+from src.services.webhook_services import WebhookServer
+
+TOKEN = "123456:BENCHMARK"
+
+
+def make_update(update_id: int, chat_id: int) -> Dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": str(update_id)
+        }
+    }
+
+
+class FakeTelegram:
+    """Минимальная имитация Bot API: отдаёт обновления в getUpdates и принимает sendMessage"""
+
+    def __init__(self, updates: List[Dict]):
+        self.updates = updates
+        self.sent = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.make_request_handler())
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        apihelper.API_URL = f"http://127.0.0.1:{self.httpd.server_address[1]}/bot{{0}}/{{1}}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        apihelper.API_URL = None
+
+    def handle(self, method: str, params: Dict[str, str]):
+        if method == 'getMe':
+            return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == 'getUpdates':
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 100))
+            return [u for u in self.updates[max(offset - 1, 0):] if u['update_id'] >= offset][:limit]
+        if method == 'sendMessage':
+            with self.lock:
+                self.sent += 1
+            return {
+                "message_id": self.sent,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get('chat_id', 0)), "type": "private"},
+                "text": params.get('text', '')
+            }
+        return True
+
+    def make_request_handler(self):
+        fake = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    params.update({k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()})
+                body = json.dumps({"ok": True, "result": fake.handle(url.path.rsplit('/', 1)[-1], params)})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body.encode())))
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
+
+
+class Recorder:
+    """Регистрирует обработчик-нагрузку и проверяет порядок сообщений внутри чата"""
+
+    def __init__(self, bot: TeleBot, total: int, handler_ms: float):
+        self.total = total
+        self.processed = 0
+        self.out_of_order = 0
+        self.last_seen: Dict[int, int] = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+        @bot.message_handler(func=lambda message: True)
+        def handle(message):
+            time.sleep(handler_ms / 1000)
+            bot.send_message(message.chat.id, "ok")
+            with self.lock:
+                if self.last_seen.get(message.chat.id, 0) > message.message_id:
+                    self.out_of_order += 1
+                self.last_seen[message.chat.id] = message.message_id
+                self.processed += 1
+                if self.processed >= self.total:
+                    self.done.set()
+
+
+def run_polling(updates: List[Dict], handler_ms: float) -> Dict:
+    fake = FakeTelegram(updates)
+    fake.start()
+    bot = TeleBot(TOKEN)
+    recorder = Recorder(bot, len(updates), handler_ms)
+    started = time.perf_counter()
+    thread = threading.Thread(target=bot.polling, kwargs={'none_stop': True, 'interval': 0}, daemon=True)
+    thread.start()
+    recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    bot.stop_polling()
+    fake.stop()
+    return {'mode': 'polling', 'seconds': elapsed, 'out_of_order': recorder.out_of_order}
+
+
+def run_webhook(updates: List[Dict], handler_ms: float, workers: int, concurrency: int) -> Dict:
+    fake = FakeTelegram([])
+    fake.start()
+    bot = TeleBot(TOKEN, threaded=False)
+    recorder = Recorder(bot, len(updates), handler_ms)
+    server = WebhookServer(bot, host='127.0.0.1', port=0, path='/webhook', secret='', workers=workers)
+    server.start()
+    url = f"http://127.0.0.1:{server.server_port}/webhook"
+
+    # Telegram не отправляет следующее обновление чата, пока не получит ответ на предыдущее
+    by_chat: Dict[int, List[Dict]] = {}
+    for update in updates:
+        by_chat.setdefault(update['message']['chat']['id'], []).append(update)
+
+    def deliver(chat_updates: List[Dict]):
+        with requests.Session() as session:
+            for update in chat_updates:
+                session.post(url, json=update)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(deliver, by_chat.values()))
+    recorder.done.wait()
+    elapsed = time.perf_counter() - started
+    server.stop()
+    fake.stop()
+    return {'mode': f'webhook ({workers} workers)', 'seconds': elapsed, 'out_of_order': recorder.out_of_order}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--handler-ms', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    updates = [make_update(i + 1, i % args.chats + 1) for i in range(args.updates)]
+    results = [
+        run_polling(updates, args.handler_ms),
+        run_webhook(updates, args.handler_ms, args.workers, args.concurrency)
+    ]
+    for result in results:
+        print(f"{result['mode']:<22} {args.updates / result['seconds']:>10.1f} updates/s "
+              f"{result['seconds']:>8.2f} s  out_of_order={result['out_of_order']}")
+
+
+if __name__ == '__main__':
+    main()
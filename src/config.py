@@ -1,3 +1,4 @@
+from typing import List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,11 +7,119 @@ class Settings(BaseSettings):
     в файле .env в корне проекта или через переменные окружения."""
 
     LOG_LEVEL: str = "INFO"
+    # Журнал: json - одна запись JSON на строку, text - прежний текстовый формат
+    LOG_FORMAT: str = "json"
+    # Записи сверх этого числа в очереди журнала отбрасываются
+    LOG_QUEUE_SIZE: int = 10000
+    # Доля сохраняемых записей уровня DEBUG
+    LOG_DEBUG_SAMPLE_RATE: float = 0.01
     TELEGRAM_TOKEN: str = ""
     DATABASE_PATH: str = ""
     API_URL: str = ""
     API_KEY: str = ""
 
+    # Параметры соединений SQLite
+    DB_BUSY_TIMEOUT: float = 5.0
+    DB_SYNCHRONOUS: str = "NORMAL"
+    DB_CACHE_SIZE_KB: int = 16384
+    DB_MMAP_SIZE: int = 268435456
+    # Групповой коммит записей из разных потоков
+    DB_GROUP_COMMIT: bool = False
+    DB_GROUP_COMMIT_INTERVAL_MS: float = 2.0
+    DB_GROUP_COMMIT_MAX_BATCH: int = 100
+    # Время жизни настроек уведомлений в кэше процесса: изменения с других реплик видны не позже
+    SETTINGS_CACHE_TTL: float = 30.0
+
+    # Режим получения обновлений: "polling" или "webhook"
+    BOT_MODE: str = "polling"
+    WEBHOOK_URL: str = ""
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8443
+    WEBHOOK_PATH: str = "/webhook"
+    WEBHOOK_SECRET: str = ""
+    WEBHOOK_WORKERS: int = 8
+    WEBHOOK_QUEUE_SIZE: int = 1000
+
+    # Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_ENABLED: bool = False
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 9090
+
+    # Профилирование по запросу: команда /profile от PROFILE_ADMIN_IDS или сигнал SIGUSR1
+    PROFILE_ENABLED: bool = False
+    PROFILE_ADMIN_IDS: List[int] = []
+    PROFILE_DIR: str = "profiles"
+    PROFILE_SECONDS: int = 30
+    PROFILE_MAX_SECONDS: int = 300
+    PROFILE_SAMPLE_INTERVAL: float = 0.01
+    # Обработчики дольше порога пишутся в журнал со стеком; 0 отключает
+    PROFILE_SLOW_HANDLER_MS: int = 2000
+
+    # Кэш ответов модели; при пустом AI_CACHE_PATH хранится только в памяти
+    AI_CACHE_SIZE: int = 1000
+    AI_CACHE_TTL: int = 86400
+    AI_CACHE_PATH: str = ""
+
+    # HTTP-клиент API модели
+    AI_POOL_SIZE: int = 10
+    AI_CONNECT_TIMEOUT: float = 5.0
+    AI_READ_TIMEOUT: float = 90.0
+    AI_MAX_RETRIES: int = 2
+    AI_BACKOFF_BASE: float = 0.5
+    AI_BACKOFF_MAX: float = 8.0
+    AI_BREAKER_THRESHOLD: int = 5
+    AI_BREAKER_RESET: float = 60.0
+
+    # Фоновые задачи генерации
+    AI_JOB_WORKERS: int = 8
+    AI_JOB_QUEUE_SIZE: int = 100
+    AI_JOB_PER_USER: int = 1
+
+    # Потоковый вывод ответа модели с редактированием сообщения
+    AI_STREAMING: bool = True
+    AI_STREAM_EDIT_INTERVAL: float = 1.5
+
+    # Заблаговременная генерация поздравлений; 0 отключает
+    PREGENERATE_DAYS: int = 0
+    PREGENERATE_CONCURRENCY: int = 4
+
+    # Очередь исходящих сообщений
+    DISPATCHER_WORKERS: int = 4
+    DISPATCHER_GLOBAL_RATE: float = 30.0
+    DISPATCHER_PER_CHAT_RATE: float = 1.0
+    DISPATCHER_MAX_RETRIES: int = 3
+    DISPATCHER_QUEUE_SIZE: int = 10000
+
+    # Планировщик напоминаний для нескольких реплик: шарды чатов, аренда и догоняющий запуск
+    SCHEDULER_SHARDS: int = 1
+    SCHEDULER_LEASE_TTL: float = 180.0
+    SCHEDULER_POLL_INTERVAL: float = 60.0
+    SCHEDULER_MAX_CATCHUP_DAYS: int = 2
+
+    # Состояние диалогов: memory - в памяти процесса, sqlite - в базе (переживает перезапуск)
+    STATE_BACKEND: str = "memory"
+    STATE_TTL: int = 3600
+    STATE_MAX_SIZE: int = 10000
+
+    # Импорт контактов из CSV, vCard и iCalendar
+    IMPORT_MAX_FILE_SIZE: int = 20 * 1024 * 1024
+    IMPORT_MAX_ROWS: int = 50000
+    IMPORT_MAX_ERRORS: int = 20
+    IMPORT_MAX_NAME_LENGTH: int = 100
+
+    # Число событий на одной странице списка
+    EVENTS_PAGE_SIZE: int = 10
+
+    # Журнал отправленных напоминаний
+    DELIVERY_BATCH_SIZE: int = 100
+    DELIVERY_RETENTION_DAYS: int = 30
+    # Сколько секунд ждать результатов отправок за день, прежде чем отложить день на повтор
+    DELIVERY_WAIT_TIMEOUT: float = 600.0
+
+    # Часовой пояс и час напоминаний для чатов, которые их не настроили
+    DEFAULT_TIMEZONE: str = "Europe/Moscow"
+    DEFAULT_REMINDER_HOUR: int = 9
+
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", case_sensitive=True
     )
@@ -1,17 +1,206 @@
 import sqlite3
 import datetime
-from typing import Dict, List, Optional, Tuple
+import logging
+import pathlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from src.config import settings
+from src.services.metrics_services import DB_SECONDS, metrics
+
+
+class WriteBatcher:
+    """Групповой коммит: операции записи из разных потоков выполняются одной транзакцией.
+
+    Поток записи забирает из очереди всё накопившееся (ждёт ещё не дольше interval
+    секунд и не больше max_batch операций), выполняет каждую операцию в своей
+    точке сохранения и фиксирует пакет одним COMMIT. Future операции завершается
+    только после фиксации, поэтому подтверждение остаётся надёжным.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], interval: float, max_batch: int):
+        self.connect = connect
+        self.interval = interval
+        self.max_batch = max_batch
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="db-writer", daemon=True)
+        self.stats = {'operations': 0, 'commits': 0}
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def submit(self, operation: Callable[[sqlite3.Connection], Any]) -> Future:
+        future = Future()
+        self.queue.put((operation, future))
+        return future
+
+    def run(self):
+        conn = self.connect()
+        conn.isolation_level = None
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.flush(conn, batch)
+        conn.close()
+
+    def flush(self, conn: sqlite3.Connection, batch: List[Tuple[Callable, Future]]):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, future in batch:
+                conn.execute('SAVEPOINT operation')
+                try:
+                    results.append((future, operation(conn), None))
+                    conn.execute('RELEASE operation')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO operation')
+                    conn.execute('RELEASE operation')
+                    results.append((future, None, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats['operations'] += len(batch)
+        self.stats['commits'] += 1
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
 
 
 class Database:
-    """Класс для работы с базой данных бота"""
+    """Класс для работы с базой данных бота.
+
+    Каждый поток получает собственное соединение (self.conn), база работает в режиме
+    WAL, поэтому чтение не блокирует запись. Ночная проверка напоминаний читает
+    через отдельное соединение только для чтения (self.read_conn).
+
+    Настройки уведомлений кэшируются в памяти битовой маской на (chat_id, event_type)
+    на SETTINGS_CACHE_TTL секунд, чтобы изменения с других реплик были видны. Запись
+    настроек через этот объект обновляет кэш сразу и увеличивает settings_generation:
+    прочитанное до записи значение в кэш уже не попадёт.
+    """
+
+    SETTING_BITS = {
+        'notify_on_day': 1,
+        'notify_one_day_before': 2,
+        'notify_one_week_before': 4
+    }
+    SETTINGS_MISSING = -1
+
+    # Методы, время которых учитывается в метрике bot_db_query_seconds
+    TIMED_METHODS = (
+        'init_notification_settings', 'get_notification_settings', 'get_all_notification_settings',
+        'update_notification_settings', 'add_event', 'add_events', 'get_event', 'get_event_by_id',
+        'get_events_page', 'update_event', 'update_event_by_id', 'delete_event', 'delete_event_by_id',
+        'get_due_events', 'get_birthdays_without_wishes', 'save_draft_wishes', 'clear_draft_wishes',
+        'get_chat_ids', 'get_chat_preferences', 'set_chat_preferences', 'get_reminder_slots',
+        'get_delivered', 'record_deliveries', 'prune_deliveries', 'start_reminder_run',
+        'finish_reminder_run', 'get_conversation_state', 'set_conversation_state',
+        'update_conversation_state', 'delete_conversation_state', 'acquire_lease', 'heartbeat', 'get_watermark', 'set_watermark',
+        'init_watermarks', 'get_global_holidays',
+    )
+
     def __init__(self):
-        self.conn = self.get_db_connection()
+        self.path = settings.DATABASE_PATH
+        self.local = threading.local()
+        self.connections: Dict[Tuple[int, bool], sqlite3.Connection] = {}
+        self.connections_lock = threading.Lock()
+        # (chat_id, event_type) -> (маска, момент истечения по time.monotonic)
+        self.settings_cache: Dict[Tuple[int, str], Tuple[int, float]] = {}
+        self.settings_generation = 0
+        # Чаты, для которых строки настроек по умолчанию уже добавлены
+        self.initialized_chats: set = set()
+        self.settings_lock = threading.Lock()
+        # Временная база и база в памяти существуют только внутри одного соединения
+        self.shared_conn = self.get_db_connection() if self.path in ('', ':memory:') else None
         self.init_db()
 
-    def get_db_connection(self):
-        return sqlite3.connect(settings.DATABASE_PATH, check_same_thread=False)
+        self.batcher = None
+        if settings.DB_GROUP_COMMIT and self.shared_conn is None:
+            self.batcher = WriteBatcher(
+                self.get_db_connection,
+                settings.DB_GROUP_COMMIT_INTERVAL_MS / 1000,
+                settings.DB_GROUP_COMMIT_MAX_BATCH
+            )
+            self.batcher.start()
+
+        metrics.instrument(self, DB_SECONDS, 'method', self.TIMED_METHODS)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока"""
+        return self.get_thread_connection(readonly=False)
+
+    @property
+    def read_conn(self) -> sqlite3.Connection:
+        """Соединение текущего потока только для чтения"""
+        return self.get_thread_connection(readonly=True)
+
+    def get_thread_connection(self, readonly: bool) -> sqlite3.Connection:
+        if self.shared_conn is not None:
+            return self.shared_conn
+        attr = 'read_conn' if readonly else 'conn'
+        conn = getattr(self.local, attr, None)
+        if conn is None:
+            conn = self.get_db_connection(readonly)
+            setattr(self.local, attr, conn)
+            with self.connections_lock:
+                # Соединения завершившихся потоков больше никто не использует
+                alive = {thread.ident for thread in threading.enumerate()}
+                for key in [key for key in self.connections if key[0] not in alive]:
+                    self.connections.pop(key).close()
+                self.connections[(threading.get_ident(), readonly)] = conn
+        return conn
+
+    def get_db_connection(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            uri = f"{pathlib.Path(self.path).absolute().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=settings.DB_BUSY_TIMEOUT, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, timeout=settings.DB_BUSY_TIMEOUT, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={settings.DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size=-{settings.DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={settings.DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def close(self):
+        """Закрывает соединения всех потоков"""
+        if getattr(self, 'batcher', None) is not None:
+            self.batcher.stop()
+            self.batcher = None
+        with self.connections_lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections.clear()
+        if self.shared_conn is not None:
+            self.shared_conn.close()
 
     def init_db(self):
         cursor = self.conn.cursor()
@@ -26,6 +215,8 @@ class Database:
             notes TEXT DEFAULT '',
             wishes TEXT DEFAULT '',
             gifts TEXT DEFAULT '',
+            draft_wishes TEXT DEFAULT '',
+            month_day TEXT,
             UNIQUE(chat_id, name)
         )''')
 
@@ -35,6 +226,12 @@ class Database:
         except sqlite3.OperationalError:
             pass
 
+        # Черновик поздравления, заранее сгенерированный ночной проверкой
+        try:
+            cursor.execute("ALTER TABLE birthdays ADD COLUMN draft_wishes TEXT DEFAULT ''")
+        except sqlite3.OperationalError:
+            pass
+
         # Таблицы для праздников и глобальных праздников
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS holidays (
@@ -43,9 +240,22 @@ class Database:
             name TEXT,
             date TEXT,
             notes TEXT DEFAULT '',
+            month_day TEXT,
             UNIQUE(chat_id, name)
         )''')
 
+        # Ключ "ММ-ДД" для поиска событий по дате без разбора всех строк
+        for table in ('birthdays', 'holidays'):
+            try:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN month_day TEXT")
+            except sqlite3.OperationalError:
+                pass
+            cursor.execute(f"UPDATE {table} SET month_day = substr(date, 6, 5) WHERE month_day IS NULL")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_month_day ON {table} (month_day)")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_chat_month_day ON {table} (chat_id, month_day)"
+            )
+
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS global_holidays (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -67,6 +277,78 @@ class Database:
                     UNIQUE(chat_id, event_type)
                 )''')
 
+        # Часовой пояс и час доставки напоминаний; чаты без записи получают значения по умолчанию
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_preferences (
+            chat_id INTEGER PRIMARY KEY,
+            timezone TEXT NOT NULL,
+            reminder_hour INTEGER NOT NULL
+        )''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_chat_preferences_slot ON chat_preferences (timezone, reminder_hour)'
+        )
+
+        # Журнал отправленных напоминаний: одно напоминание о событии на дату и смещение
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_deliveries (
+            occurrence TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            event_name TEXT NOT NULL,
+            status TEXT NOT NULL,
+            run_id INTEGER,
+            delivered_at REAL,
+            PRIMARY KEY (occurrence, offset, chat_id, event_type, event_name)
+        )''')
+
+        # Статистика запусков рассылки
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminder_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_day TEXT NOT NULL,
+            shard TEXT,
+            slot TEXT,
+            status TEXT NOT NULL,
+            candidates INTEGER DEFAULT 0,
+            skipped INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            error TEXT,
+            started_at REAL,
+            finished_at REAL
+        )''')
+
+        # Состояние незавершённых диалогов (ConversationStore в режиме sqlite)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_conversation_state_expires ON conversation_state (expires_at)'
+        )
+
+        # Таблицы планировщика: аренда шардов, участники и отметка последнего запуска
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_members (
+            owner TEXT PRIMARY KEY,
+            heartbeat REAL
+        )''')
+
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_state (
+            name TEXT PRIMARY KEY,
+            last_run TEXT
+        )''')
 
         default_holidays = [
             ("Новый год", "01.01", "С Новым годом! 🎄✨"),
@@ -95,9 +377,45 @@ class Database:
 
         self.conn.commit()
 
+    def write(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет операцию записи и фиксирует её.
+
+        operation получает соединение и не должна сама вызывать commit. В режиме
+        группового коммита операция уходит в WriteBatcher, а метод возвращает
+        результат только после фиксации пакета.
+        """
+        return self.write_async(operation).result()
+
+    def write_async(self, operation: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Как write, но возвращает Future, который завершится после фиксации записи"""
+        if self.batcher is not None:
+            return self.batcher.submit(operation)
+
+        future = Future()
+        conn = self.conn
+        try:
+            result = operation(conn)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        return future
+
     def init_notification_settings(self, chat_id: int):
         """Инициализирует настройки уведомлений для нового чата"""
-        cursor = self.conn.cursor()
+        with self.settings_lock:
+            if chat_id in self.initialized_chats:
+                return
+
+        self.write(lambda conn: self.insert_default_settings(conn, chat_id))
+        self.remember_default_settings(chat_id)
+
+    @staticmethod
+    def insert_default_settings(conn: sqlite3.Connection, chat_id: int):
+        """Добавляет недостающие настройки уведомлений чата в текущей транзакции"""
+        cursor = conn.cursor()
         event_types = ['birthday', 'holiday', 'global_holiday']
         for event_type in event_types:
             try:
@@ -107,11 +425,66 @@ class Database:
                 ''', (chat_id, event_type))
             except sqlite3.Error:
                 pass
-        self.conn.commit()
+
+    def remember_default_settings(self, chat_id: int):
+        # INSERT OR IGNORE не меняет существующие строки, поэтому кэш остаётся верным
+        with self.settings_lock:
+            self.initialized_chats.add(chat_id)
 
     def get_notification_settings(self, chat_id: int, event_type: str) -> Optional[Dict]:
         """Получает настройки уведомлений для указанного чата и типа событий"""
-        cursor = self.conn.cursor()
+        key = (chat_id, event_type)
+        now = time.monotonic()
+        with self.settings_lock:
+            cached = self.settings_cache.get(key)
+            generation = self.settings_generation
+        if cached is not None and cached[1] > now:
+            return self.mask_to_settings(cached[0])
+
+        mask = self.settings_to_mask(self.read_notification_settings(self.conn, chat_id, event_type))
+        with self.settings_lock:
+            # Если настройки записали во время чтения, прочитанное значение могло устареть
+            if self.settings_generation == generation:
+                self.settings_cache[key] = (mask, now + settings.SETTINGS_CACHE_TTL)
+        return self.mask_to_settings(mask)
+
+    def get_all_notification_settings(self, event_type: str, shard: Optional[Tuple[int, int]] = None,
+                                      slot: Optional[Tuple[str, int]] = None) -> Dict[int, Dict]:
+        """Загружает настройки чатов шарда и слота (см. chat_filter) для типа событий одним запросом.
+
+        Читает базу напрямую, минуя кэш, и кэш не заполняет: рассылка должна видеть
+        изменения, сделанные на любой реплике.
+        """
+        condition, filter_params = self.chat_filter(shard, slot)
+        cursor = self.read_conn.execute(f'''
+            SELECT chat_id, notify_on_day, notify_one_day_before, notify_one_week_before
+            FROM notification_settings
+            WHERE event_type = ?{condition}
+        ''', [event_type] + filter_params)
+        return {
+            chat_id: {
+                'notify_on_day': on_day,
+                'notify_one_day_before': day_before,
+                'notify_one_week_before': week_before
+            }
+            for chat_id, on_day, day_before, week_before in cursor.fetchall()
+        }
+
+    @classmethod
+    def settings_to_mask(cls, settings_dict: Optional[Dict]) -> int:
+        if settings_dict is None:
+            return cls.SETTINGS_MISSING
+        return sum(bit for key, bit in cls.SETTING_BITS.items() if settings_dict.get(key))
+
+    @classmethod
+    def mask_to_settings(cls, mask: int) -> Optional[Dict]:
+        if mask == cls.SETTINGS_MISSING:
+            return None
+        return {key: 1 if mask & bit else 0 for key, bit in cls.SETTING_BITS.items()}
+
+    @staticmethod
+    def read_notification_settings(conn: sqlite3.Connection, chat_id: int, event_type: str) -> Optional[Dict]:
+        cursor = conn.cursor()
         cursor.execute('''
             SELECT notify_on_day, notify_one_day_before, notify_one_week_before
             FROM notification_settings
@@ -128,11 +501,9 @@ class Database:
 
     def update_notification_settings(self, chat_id: int, event_type: str, **kwargs) -> bool:
         """Обновляет настройки уведомлений для указанного чата и типа событий"""
-        try:
-            cursor = self.conn.cursor()
-
+        def operation(conn):
             # Получаем текущие настройки
-            current_settings = self.get_notification_settings(chat_id, event_type)
+            current_settings = self.read_notification_settings(conn, chat_id, event_type)
             if not current_settings:
                 current_settings = {
                     'notify_on_day': 1,
@@ -145,7 +516,7 @@ class Database:
                 if key in current_settings:
                     current_settings[key] = value
 
-            cursor.execute('''
+            conn.execute('''
                 INSERT OR REPLACE INTO notification_settings 
                 (chat_id, event_type, notify_on_day, notify_one_day_before, notify_one_week_before)
                 VALUES (?, ?, ?, ?, ?)
@@ -156,54 +527,113 @@ class Database:
                 current_settings['notify_one_day_before'],
                 current_settings['notify_one_week_before']
             ))
+            return current_settings
 
-            self.conn.commit()
+        try:
+            new_settings = self.write(operation)
+            with self.settings_lock:
+                self.settings_generation += 1
+                self.settings_cache[(chat_id, event_type)] = (
+                    self.settings_to_mask(new_settings), time.monotonic() + settings.SETTINGS_CACHE_TTL
+                )
             return True
         except sqlite3.Error as e:
-            print(f"Ошибка при обновлении настроек уведомлений: {e}")
+            logging.error(f"Ошибка при обновлении настроек уведомлений: {e}")
             return False
 
     def add_event(self, chat_id: int, name: str, date: datetime.date, notes: str = "",
                  wishes: str = "", event_type: str = 'birthday') -> bool:
-        try:
-            if event_type == 'birthday':
-                self.conn.execute('''
-                INSERT INTO birthdays (chat_id, name, date, notes, wishes) 
-                VALUES (?, ?, ?, ?, ?)''', (chat_id, name, date.strftime('%Y-%m-%d'), notes, wishes))
-            else:
-                self.conn.execute('''
-                INSERT INTO holidays (chat_id, name, date, notes) 
-                VALUES (?, ?, ?, ?)''', (chat_id, name, date.strftime('%Y-%m-%d'), notes))
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
+        def operation(conn):
+            try:
+                if event_type == 'birthday':
+                    conn.execute('''
+                    INSERT INTO birthdays (chat_id, name, date, notes, wishes, month_day) 
+                    VALUES (?, ?, ?, ?, ?, ?)''', (chat_id, name, date.strftime('%Y-%m-%d'), notes, wishes,
+                                                  self.month_day_key(date)))
+                else:
+                    conn.execute('''
+                    INSERT INTO holidays (chat_id, name, date, notes, month_day) 
+                    VALUES (?, ?, ?, ?, ?)''', (chat_id, name, date.strftime('%Y-%m-%d'), notes,
+                                               self.month_day_key(date)))
+                return True
+            except sqlite3.IntegrityError:
+                return False
+
+        return self.write(operation)
+
+    def add_events(self, chat_id: int, rows: Iterable, event_type: str = 'birthday') -> Tuple[int, int]:
+        """Добавляет события одной транзакцией вместе с настройками уведомлений чата.
+
+        rows - итерируемое строк с полями name, date и notes; оно читается
+        по ходу executemany, поэтому может быть генератором. Существующие имена
+        пропускаются. Возвращает число добавленных и число переданных строк.
+        """
+        table = 'birthdays' if event_type == 'birthday' else 'holidays'
+        total = 0
+
+        def params():
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield chat_id, row.name, row.date.isoformat(), row.notes, self.month_day_key(row.date)
+
+        def operation(conn):
+            cursor = conn.executemany(f'''
+                INSERT OR IGNORE INTO {table} (chat_id, name, date, notes, month_day)
+                VALUES (?, ?, ?, ?, ?)''', params())
+            added = max(cursor.rowcount, 0)
+            if added:
+                self.insert_default_settings(conn, chat_id)
+            return added
+
+        added = self.write(operation)
+        if added:
+            self.remember_default_settings(chat_id)
+        return added, total
+
+    def iter_events(self, chat_id: int, event_type: str = 'birthday') -> Iterator[Tuple[str, datetime.date, str]]:
+        """События чата по одному (имя, дата, заметка) в порядке месяца и дня, без загрузки всего списка"""
+        table = 'birthdays' if event_type == 'birthday' else 'holidays'
+        cursor = self.read_conn.execute(
+            f'SELECT name, date, notes FROM {table} WHERE chat_id = ? ORDER BY month_day, name', (chat_id,)
+        )
+        for name, date, notes in cursor:
+            yield name, datetime.date.fromisoformat(date), notes
 
     def get_event(self, chat_id: int, name: str, event_type: str = 'birthday') -> Optional[Dict]:
+        return self.read_event(event_type, 'chat_id = ? AND name = ?', (chat_id, name))
+
+    def get_event_by_id(self, chat_id: int, event_id: int, event_type: str = 'birthday') -> Optional[Dict]:
+        """Событие по первичному ключу; chat_id проверяется, чтобы чат видел только свои события"""
+        return self.read_event(event_type, 'id = ? AND chat_id = ?', (event_id, chat_id))
+
+    def read_event(self, event_type: str, condition: str, params: tuple) -> Optional[Dict]:
         table = 'birthdays' if event_type == 'birthday' else 'holidays'
         if event_type == 'birthday':
             cursor = self.conn.execute(f'''
-            SELECT name, date, notes, wishes, gifts FROM {table} 
-            WHERE chat_id = ? AND name = ?''', (chat_id, name))
+            SELECT id, name, date, notes, wishes, gifts FROM {table}
+            WHERE {condition}''', params)
             result = cursor.fetchone()
             if result:
                 return {
-                    "name": result[0],
-                    "date": datetime.datetime.strptime(result[1], '%Y-%m-%d').date(),
-                    "notes": result[2],
-                    "wishes": result[3],
-                    "gifts": result[4]
+                    "id": result[0],
+                    "name": result[1],
+                    "date": datetime.datetime.strptime(result[2], '%Y-%m-%d').date(),
+                    "notes": result[3],
+                    "wishes": result[4],
+                    "gifts": result[5]
                 }
         else:
             cursor = self.conn.execute(f'''
-            SELECT name, date, notes FROM {table} 
-            WHERE chat_id = ? AND name = ?''', (chat_id, name))
+            SELECT id, name, date, notes FROM {table}
+            WHERE {condition}''', params)
             result = cursor.fetchone()
             if result:
                 return {
-                    "name": result[0],
-                    "date": datetime.datetime.strptime(result[1], '%Y-%m-%d').date(),
-                    "notes": result[2]
+                    "id": result[0],
+                    "name": result[1],
+                    "date": datetime.datetime.strptime(result[2], '%Y-%m-%d').date(),
+                    "notes": result[3]
                 }
         return None
 
@@ -213,10 +643,43 @@ class Database:
         return {name: datetime.datetime.strptime(date, '%Y-%m-%d').date()
                 for name, date in cursor.fetchall()}
 
+    def get_events_page(self, chat_id: int, event_type: str, today: datetime.date,
+                        offset: int, limit: int) -> Tuple[List[Tuple[int, str, str]], int]:
+        """Страница событий чата, отсортированная по ближайшему наступлению.
+
+        Возвращает тройки (id, имя, "ММ-ДД") и общее число событий. События, которые в
+        этом году уже прошли, идут после остальных.
+        """
+        table = 'birthdays' if event_type == 'birthday' else 'holidays'
+        conn = self.read_conn
+        total = conn.execute(f'SELECT COUNT(*) FROM {table} WHERE chat_id = ?', (chat_id,)).fetchone()[0]
+        if not total:
+            return [], 0
+        cursor = conn.execute(f'''
+            SELECT id, name, month_day FROM {table}
+            WHERE chat_id = ?
+            ORDER BY month_day < ?, month_day, name
+            LIMIT ? OFFSET ?
+        ''', (chat_id, self.month_day_key(today), limit, offset))
+        return cursor.fetchall(), total
+
     def update_event(self, chat_id: int, name: str, date: datetime.date = None,
                      notes: str = None, wishes: str = None, gifts: str = None,
                      event_type: str = 'birthday') -> bool:
         """Обновляет данные события"""
+        return self.write_event_fields(event_type, 'chat_id = ? AND name = ?', [chat_id, name],
+                                       date=date, notes=notes, wishes=wishes, gifts=gifts)
+
+    def update_event_by_id(self, chat_id: int, event_id: int, date: datetime.date = None,
+                           notes: str = None, wishes: str = None, gifts: str = None,
+                           event_type: str = 'birthday') -> bool:
+        """Обновляет данные события по первичному ключу"""
+        return self.write_event_fields(event_type, 'id = ? AND chat_id = ?', [event_id, chat_id],
+                                       date=date, notes=notes, wishes=wishes, gifts=gifts)
+
+    def write_event_fields(self, event_type: str, condition: str, condition_params: list,
+                           date: datetime.date = None, notes: str = None, wishes: str = None,
+                           gifts: str = None) -> bool:
         try:
             updates = []
             params = []
@@ -225,6 +688,8 @@ class Database:
             if date is not None:
                 updates.append("date = ?")
                 params.append(date.strftime('%Y-%m-%d'))
+                updates.append("month_day = ?")
+                params.append(self.month_day_key(date))
 
             if notes is not None:
                 updates.append("notes = ?")
@@ -241,26 +706,336 @@ class Database:
             if not updates:
                 return False
 
-            params.extend([chat_id, name])
+            # Черновик поздравления составлен по прежним дате, заметке или без поздравления
+            if event_type == 'birthday' and (date is not None or notes is not None or wishes is not None):
+                updates.append("draft_wishes = ''")
+
+            params.extend(condition_params)
             table = 'birthdays' if event_type == 'birthday' else 'holidays'
-            query = f"UPDATE {table} SET {', '.join(updates)} WHERE chat_id = ? AND name = ?"
-            cursor = self.conn.execute(query, params)
-            self.conn.commit()
-            return cursor.rowcount > 0
+            query = f"UPDATE {table} SET {', '.join(updates)} WHERE {condition}"
+            return self.write(lambda conn: conn.execute(query, params).rowcount > 0)
         except Exception as e:
-            print(f"Ошибка при обновлении события: {e}")
+            logging.error(f"Ошибка при обновлении события: {e}")
             return False
 
     def delete_event(self, chat_id: int, name: str, event_type: str = 'birthday') -> bool:
         table = 'birthdays' if event_type == 'birthday' else 'holidays'
-        cursor = self.conn.execute(f'DELETE FROM {table} WHERE chat_id = ? AND name = ?', (chat_id, name))
-        self.conn.commit()
-        return cursor.rowcount > 0
+        return self.write(lambda conn: conn.execute(
+            f'DELETE FROM {table} WHERE chat_id = ? AND name = ?', (chat_id, name)
+        ).rowcount > 0)
+
+    def delete_event_by_id(self, chat_id: int, event_id: int, event_type: str = 'birthday') -> bool:
+        table = 'birthdays' if event_type == 'birthday' else 'holidays'
+        return self.write(lambda conn: conn.execute(
+            f'DELETE FROM {table} WHERE id = ? AND chat_id = ?', (event_id, chat_id)
+        ).rowcount > 0)
+
+    @staticmethod
+    def month_day_key(date: datetime.date) -> str:
+        """Возвращает ключ "ММ-ДД", по которому индексируются события"""
+        return date.strftime('%m-%d')
+
+    @staticmethod
+    def chat_filter(shard: Optional[Tuple[int, int]] = None,
+                    slot: Optional[Tuple[str, int]] = None) -> Tuple[str, list]:
+        """Условие выборки чатов одного шарда и одного слота доставки.
+
+        shard - (номер, число шардов), slot - (часовой пояс, час). Чаты без записи
+        в chat_preferences относятся к слоту по умолчанию.
+        """
+        condition, params = '', []
+        if shard is not None:
+            index, count = shard
+            condition += ' AND abs(chat_id) % ? = ?'
+            params += [count, index]
+        if slot is not None:
+            if slot == (settings.DEFAULT_TIMEZONE, settings.DEFAULT_REMINDER_HOUR):
+                condition += (' AND chat_id NOT IN (SELECT chat_id FROM chat_preferences'
+                              ' WHERE timezone != ? OR reminder_hour != ?)')
+            else:
+                condition += (' AND chat_id IN (SELECT chat_id FROM chat_preferences'
+                              ' WHERE timezone = ? AND reminder_hour = ?)')
+            params += list(slot)
+        return condition, params
+
+    def get_due_events(self, dates: Dict[int, datetime.date], shard: Optional[Tuple[int, int]] = None,
+                       slot: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """Возвращает все личные события, выпадающие на переданные даты.
+
+        dates сопоставляет смещение в днях (0, 1, 7) с датой. Поиск идёт по индексу
+        month_day, поэтому стоимость запроса пропорциональна числу найденных событий.
+        shard и slot ограничивают выборку частью чатов, см. chat_filter.
+        """
+        offsets = {self.month_day_key(date): offset for offset, date in dates.items()}
+        if not offsets:
+            return []
+
+        placeholders = ', '.join('?' for _ in offsets)
+        keys = list(offsets.keys())
+        condition, filter_params = self.chat_filter(shard, slot)
+        cursor = self.read_conn.execute(f'''
+            SELECT chat_id, 'birthday', name, notes, wishes, draft_wishes, month_day FROM birthdays
+            WHERE month_day IN ({placeholders}){condition}
+            UNION ALL
+            SELECT chat_id, 'holiday', name, notes, '', '', month_day FROM holidays
+            WHERE month_day IN ({placeholders}){condition}
+        ''', keys + filter_params + keys + filter_params)
+        return [{
+            "chat_id": chat_id,
+            "event_type": event_type,
+            "name": name,
+            "notes": notes,
+            "wishes": wishes,
+            "draft_wishes": draft_wishes or '',
+            "offset": offsets[month_day]
+        } for chat_id, event_type, name, notes, wishes, draft_wishes, month_day in cursor.fetchall()]
+
+    def get_birthdays_without_wishes(self, dates: List[datetime.date], shard: Optional[Tuple[int, int]] = None,
+                                     slot: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """Дни рождения на указанные даты, для которых нет ни поздравления, ни черновика"""
+        keys = [self.month_day_key(date) for date in dates]
+        if not keys:
+            return []
+        placeholders = ', '.join('?' for _ in keys)
+        condition, filter_params = self.chat_filter(shard, slot)
+        cursor = self.read_conn.execute(f'''
+            SELECT chat_id, name, notes FROM birthdays
+            WHERE month_day IN ({placeholders})
+              AND COALESCE(wishes, '') = '' AND COALESCE(draft_wishes, '') = ''{condition}
+        ''', keys + filter_params)
+        return [{"chat_id": chat_id, "name": name, "notes": notes}
+                for chat_id, name, notes in cursor.fetchall()]
+
+    def save_draft_wishes(self, chat_id: int, name: str, draft: str) -> bool:
+        """Сохраняет заранее сгенерированное поздравление"""
+        return self.write(lambda conn: conn.execute(
+            'UPDATE birthdays SET draft_wishes = ? WHERE chat_id = ? AND name = ?',
+            (draft, chat_id, name)
+        ).rowcount > 0)
+
+    def clear_draft_wishes(self, dates: List[datetime.date], shard: Optional[Tuple[int, int]] = None,
+                           slot: Optional[Tuple[str, int]] = None) -> int:
+        """Удаляет черновики поздравлений у дней рождения на указанные даты"""
+        keys = [self.month_day_key(date) for date in dates]
+        if not keys:
+            return 0
+        placeholders = ', '.join('?' for _ in keys)
+        condition, filter_params = self.chat_filter(shard, slot)
+        return self.write(lambda conn: conn.execute(f'''
+            UPDATE birthdays SET draft_wishes = ''
+            WHERE month_day IN ({placeholders}) AND COALESCE(draft_wishes, '') != ''{condition}
+        ''', keys + filter_params).rowcount)
+
+    def get_chat_ids(self, shard: Optional[Tuple[int, int]] = None,
+                     slot: Optional[Tuple[str, int]] = None) -> List[int]:
+        """Все чаты, в которых есть личные события"""
+        condition, filter_params = self.chat_filter(shard, slot)
+        cursor = self.read_conn.execute(
+            f'SELECT DISTINCT chat_id FROM birthdays WHERE 1{condition} '
+            f'UNION SELECT DISTINCT chat_id FROM holidays WHERE 1{condition}',
+            filter_params + filter_params
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_chat_preferences(self, chat_id: int) -> Dict:
+        """Часовой пояс и час доставки напоминаний для чата"""
+        row = self.read_conn.execute(
+            'SELECT timezone, reminder_hour FROM chat_preferences WHERE chat_id = ?', (chat_id,)
+        ).fetchone()
+        if not row:
+            return {'timezone': settings.DEFAULT_TIMEZONE, 'reminder_hour': settings.DEFAULT_REMINDER_HOUR}
+        return {'timezone': row[0], 'reminder_hour': row[1]}
+
+    def set_chat_preferences(self, chat_id: int, timezone: Optional[str] = None,
+                             reminder_hour: Optional[int] = None):
+        """Меняет переданные параметры доставки; остальные остаются прежними"""
+        self.write(lambda conn: conn.execute('''
+            INSERT INTO chat_preferences (chat_id, timezone, reminder_hour)
+            VALUES (?, COALESCE(?, ?), COALESCE(?, ?))
+            ON CONFLICT(chat_id) DO UPDATE SET
+                timezone = COALESCE(?, timezone), reminder_hour = COALESCE(?, reminder_hour)
+        ''', (chat_id, timezone, settings.DEFAULT_TIMEZONE, reminder_hour, settings.DEFAULT_REMINDER_HOUR,
+              timezone, reminder_hour)))
+
+    def get_reminder_slots(self) -> List[Tuple[str, int]]:
+        """Все используемые пары (часовой пояс, час), включая слот по умолчанию"""
+        cursor = self.read_conn.execute('SELECT DISTINCT timezone, reminder_hour FROM chat_preferences')
+        slots = {(row[0], row[1]) for row in cursor.fetchall()}
+        slots.add((settings.DEFAULT_TIMEZONE, settings.DEFAULT_REMINDER_HOUR))
+        return sorted(slots)
+
+    def get_delivered(self, occurrences: Dict[int, datetime.date], shard: Optional[Tuple[int, int]] = None,
+                      slot: Optional[Tuple[str, int]] = None) -> set:
+        """Уже отправленные или отвергнутые Telegram напоминания: множество
+        (chat_id, event_type, event_name, offset).
+
+        occurrences сопоставляет смещение с датой события, как в get_due_events.
+        """
+        if not occurrences:
+            return set()
+        condition, filter_params = self.chat_filter(shard, slot)
+        pairs = ' OR '.join('(occurrence = ? AND offset = ?)' for _ in occurrences)
+        params = [value for offset, date in occurrences.items() for value in (date.strftime('%Y-%m-%d'), offset)]
+        cursor = self.read_conn.execute(f'''
+            SELECT chat_id, event_type, event_name, offset FROM reminder_deliveries
+            WHERE ({pairs}) AND status IN ('sent', 'rejected'){condition}
+        ''', params + filter_params)
+        return {tuple(row) for row in cursor.fetchall()}
+
+    def record_deliveries(self, rows: List[Tuple]):
+        """Сохраняет пакет результатов отправки одним executemany.
+
+        Строка: (occurrence, offset, chat_id, event_type, event_name, status, run_id, delivered_at).
+        Успешная отправка не перезаписывается неудачной.
+        """
+        if not rows:
+            return
+        self.write(lambda conn: conn.executemany('''
+            INSERT INTO reminder_deliveries
+                (occurrence, offset, chat_id, event_type, event_name, status, run_id, delivered_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(occurrence, offset, chat_id, event_type, event_name) DO UPDATE SET
+                status = excluded.status, run_id = excluded.run_id, delivered_at = excluded.delivered_at
+            WHERE reminder_deliveries.status != 'sent'
+        ''', rows))
+
+    def prune_deliveries(self, before: datetime.date) -> int:
+        """Удаляет журнал отправок и запусков старше before"""
+        day = before.strftime('%Y-%m-%d')
+
+        def operation(conn):
+            deleted = conn.execute('DELETE FROM reminder_deliveries WHERE occurrence < ?', (day,)).rowcount
+            conn.execute('DELETE FROM reminder_runs WHERE run_day < ?', (day,))
+            return deleted
+
+        return self.write(operation)
+
+    def start_reminder_run(self, run_day: datetime.date, shard: str, slot: str) -> int:
+        return self.write(lambda conn: conn.execute('''
+            INSERT INTO reminder_runs (run_day, shard, slot, status, started_at) VALUES (?, ?, ?, 'running', ?)
+        ''', (run_day.strftime('%Y-%m-%d'), shard, slot, time.time())).lastrowid)
+
+    def finish_reminder_run(self, run_id: int, status: str, stats: Dict[str, int], error: Optional[str] = None):
+        self.write(lambda conn: conn.execute('''
+            UPDATE reminder_runs SET status = ?, candidates = ?, skipped = ?, sent = ?, failed = ?,
+                error = ?, finished_at = ?
+            WHERE id = ?
+        ''', (status, stats['candidates'], stats['skipped'], stats['sent'], stats['failed'],
+              error, time.time(), run_id)))
+
+    def get_reminder_runs(self, limit: int = 20) -> List[Dict]:
+        """Последние запуски рассылки со статистикой"""
+        cursor = self.read_conn.execute('''
+            SELECT id, run_day, shard, slot, status, candidates, skipped, sent, failed, error,
+                   started_at, finished_at
+            FROM reminder_runs ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_conversation_state(self, user_id: int) -> Optional[str]:
+        """Состояние диалога в JSON, если оно ещё не истекло"""
+        row = self.conn.execute(
+            'SELECT state FROM conversation_state WHERE user_id = ? AND expires_at > ?', (user_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_conversation_state(self, user_id: int, state: str, expires_at: float):
+        self.write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO conversation_state (user_id, state, expires_at) VALUES (?, ?, ?)',
+            (user_id, state, expires_at)
+        ))
+
+    def update_conversation_state(self, user_id: int, change: Callable[[Optional[str]], str],
+                                  expires_at: float) -> str:
+        """Читает и заменяет состояние диалога одной транзакцией записи.
+
+        change получает текущее состояние в JSON (None, если его нет или оно истекло)
+        и возвращает новое; запись другого потока между чтением и заменой невозможна.
+        """
+        def operation(conn):
+            if not conn.in_transaction:
+                # Без группового коммита блокировка записи берётся до чтения
+                conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT state FROM conversation_state WHERE user_id = ? AND expires_at > ?', (user_id, time.time())
+            ).fetchone()
+            state = change(row[0] if row else None)
+            conn.execute(
+                'INSERT OR REPLACE INTO conversation_state (user_id, state, expires_at) VALUES (?, ?, ?)',
+                (user_id, state, expires_at)
+            )
+            return state
+
+        return self.write(operation)
+
+    def delete_conversation_state(self, user_id: int):
+        self.write(lambda conn: conn.execute('DELETE FROM conversation_state WHERE user_id = ?', (user_id,)))
+
+    def prune_conversation_states(self, max_size: int) -> int:
+        """Удаляет истёкшие состояния и самые старые сверх max_size"""
+        def operation(conn):
+            deleted = conn.execute('DELETE FROM conversation_state WHERE expires_at <= ?', (time.time(),)).rowcount
+            deleted += conn.execute('''
+                DELETE FROM conversation_state WHERE user_id NOT IN (
+                    SELECT user_id FROM conversation_state ORDER BY expires_at DESC LIMIT ?
+                )''', (max_size,)).rowcount
+            return deleted
+
+        return self.write(operation)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Захватывает или продлевает аренду name, если она свободна, истекла или уже принадлежит owner"""
+        now = time.time()
+        return self.write(lambda conn: conn.execute('''
+            INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < ?
+        ''', (name, owner, now + ttl, now)).rowcount > 0)
+
+    def release_lease(self, name: str, owner: str):
+        self.write(lambda conn: conn.execute(
+            'DELETE FROM scheduler_leases WHERE name = ? AND owner = ?', (name, owner)
+        ))
+
+    def heartbeat(self, owner: str, ttl: float) -> int:
+        """Отмечает участника живым и возвращает число живых участников"""
+        now = time.time()
+
+        def operation(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO scheduler_members (owner, heartbeat) VALUES (?, ?)', (owner, now)
+            )
+            conn.execute('DELETE FROM scheduler_members WHERE heartbeat < ?', (now - ttl,))
+            return conn.execute('SELECT COUNT(*) FROM scheduler_members').fetchone()[0]
+
+        return self.write(operation)
+
+    def remove_member(self, owner: str):
+        self.write(lambda conn: conn.execute('DELETE FROM scheduler_members WHERE owner = ?', (owner,)))
+
+    def get_watermark(self, name: str) -> Optional[datetime.date]:
+        """Дата, по которую включительно задача name уже выполнена"""
+        row = self.conn.execute('SELECT last_run FROM scheduler_state WHERE name = ?', (name,)).fetchone()
+        return datetime.datetime.strptime(row[0], '%Y-%m-%d').date() if row else None
+
+    def set_watermark(self, name: str, day: datetime.date):
+        self.write(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO scheduler_state (name, last_run) VALUES (?, ?)',
+            (name, day.strftime('%Y-%m-%d'))
+        ))
+
+    def init_watermarks(self, names: List[str], day: datetime.date):
+        """Отмечает задачи names выполненными по day, если отметки у них ещё нет"""
+        self.write(lambda conn: conn.executemany(
+            'INSERT OR IGNORE INTO scheduler_state (name, last_run) VALUES (?, ?)',
+            [(name, day.strftime('%Y-%m-%d')) for name in names]
+        ))
 
     def get_global_holidays(self) -> List[Tuple[str, datetime.date, str]]:
-        cursor = self.conn.execute('SELECT name, date, description FROM global_holidays')
+        cursor = self.read_conn.execute('SELECT name, date, description FROM global_holidays')
         return [(name, datetime.datetime.strptime(date, '%d.%m').date(), desc)
                 for name, date, desc in cursor.fetchall()]
 
     def __del__(self):
-        self.conn.close()
\ No newline at end of file
+        self.close()
\ No newline at end of file
@@ -0,0 +1,48 @@
+import base64
+from typing import NamedTuple, Optional
+
+# Все закодированные callback_data начинаются с этого символа
+CALLBACK_PREFIX = '#'
+
+# Порядок менять нельзя: номер действия хранится в уже отправленных кнопках
+ACTIONS = (
+    'profile', 'list', 'page', 'edit', 'add_note', 'delete', 'confirm_delete',
+    'add_wish', 'generate_wish', 'regenerate_wish', 'use_wish', 'manual_wish',
+    'add_gift', 'generate_gift', 'regenerate_gift', 'use_gift', 'manual_gift',
+)
+EVENT_TYPES = ('birthday', 'holiday')
+
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+EVENT_TYPE_CODES = {event_type: code for code, event_type in enumerate(EVENT_TYPES)}
+
+
+class EventCallback(NamedTuple):
+    """Нажатие кнопки события: действие, тип события и число (id события или номер страницы)"""
+    action: str
+    event_type: str
+    value: int = 0
+
+
+def encode_callback(action: str, event_type: str, value: int = 0) -> str:
+    """Кодирует действие в callback_data длиной не больше 16 символов.
+
+    Байт действия, байт типа события и value в big-endian упаковываются в
+    base64url без выравнивания, поэтому длина не зависит от имени события.
+    """
+    payload = bytes((ACTION_CODES[action], EVENT_TYPE_CODES[event_type]))
+    payload += value.to_bytes(max((value.bit_length() + 7) // 8, 1), 'big')
+    return CALLBACK_PREFIX + base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_callback(data: str) -> Optional[EventCallback]:
+    """Разбирает callback_data, созданную encode_callback; None для чужих и повреждённых данных"""
+    if not data.startswith(CALLBACK_PREFIX):
+        return None
+    encoded = data[len(CALLBACK_PREFIX):]
+    try:
+        payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except ValueError:
+        return None
+    if len(payload) < 3 or payload[0] >= len(ACTIONS) or payload[1] >= len(EVENT_TYPES):
+        return None
+    return EventCallback(ACTIONS[payload[0]], EVENT_TYPES[payload[1]], int.from_bytes(payload[2:], 'big'))
@@ -1,19 +1,102 @@
 import html
-from typing import Dict, Any, Optional
+import logging
+import time
+from typing import Dict, Any, Callable, Optional
 from telebot import types, TeleBot
 import datetime
+from src.config import settings
 from src.database.database import Database
+from src.handlers.callbacks import CALLBACK_PREFIX, decode_callback, encode_callback
+from src.handlers.router import Router
 from src.services.api_services import AIService
+from src.services.import_services import (FORMATS, FileTooLargeError, detect_format, download_document,
+                                          export_events, import_events)
+from src.services.job_services import AIJobExecutor
+from src.services.profiling_services import profiler
+from src.services.scheduler_services import parse_timezone
+from src.services.state_services import ConversationStore
 
 
 class Handlers:
     """Основной класс обработчиков бота, отвечающий за взаимодействие с пользователем"""
-    def __init__(self, bot: TeleBot, db: Database, ai_service: AIService):
+    def __init__(self, bot: TeleBot, db: Database, ai_service: AIService,
+                 ai_jobs: Optional[AIJobExecutor] = None, states: Optional[ConversationStore] = None):
         """Инициализация обработчиков с зависимостями"""
         self.bot = bot
         self.db = db
         self.ai_service = ai_service
-        self.user_data: Dict[int, Dict[str, Any]] = {}
+        self.ai_jobs = ai_jobs or AIJobExecutor(bot)
+        if states is None:
+            states = ConversationStore(db if settings.STATE_BACKEND == 'sqlite' else None)
+        self.states = states
+        self.router = Router()
+
+        # Шаг диалога, ожидающий ввода -> обработчик(message, state)
+        self.steps: Dict[str, Callable[[types.Message, Dict[str, Any]], None]] = {
+            'add_event': self.process_add_event,
+            'edit_event': self.process_edit_event,
+            'add_note': self.process_add_note,
+            'wish_info': self.process_wish_info,
+            'gift_info': self.process_gift_info,
+            'add_wish': self.process_add_wish,
+            'add_gift': self.process_add_gift,
+            'timezone': self.process_timezone,
+            'import_events': self.process_import,
+        }
+
+        # Действие кнопки события -> обработчик(call, event_type, value)
+        self.event_callbacks: Dict[str, Callable[[types.CallbackQuery, str, int], None]] = {
+            'profile': self.show_event_profile,
+            'list': lambda call, event_type, _: self.back_to_event_list(call, event_type),
+            'page': self.show_event_list_page,
+            'edit': self.edit_event_start,
+            'add_note': self.add_note_start,
+            'delete': self.delete_event_confirm,
+            'confirm_delete': self.delete_event_execute,
+            'add_wish': self.add_wish_start,
+            'generate_wish': self.generate_wish_start,
+            'regenerate_wish': lambda call, event_type, event_id:
+                self.generate_wish_start(call, event_type, event_id, regenerate=True),
+            'use_wish': self.use_generated_wish,
+            'manual_wish': self.manual_wish_input,
+            'add_gift': self.add_gift_start,
+            'generate_gift': self.generate_gift_start,
+            'regenerate_gift': lambda call, event_type, event_id:
+                self.generate_gift_start(call, event_type, event_id, regenerate=True),
+            'use_gift': self.use_generated_gift,
+            'manual_gift': self.manual_gift_input,
+        }
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        """Отправляет ответ пользователю.
+
+        Ответы отправляются сразу, а не через очередь рассылки: иначе они могли бы
+        прийти не в том порядке относительно соседних edit_message_text и ждать
+        лимитов, рассчитанных на напоминания.
+        """
+        self.bot.send_message(chat_id, text, **kwargs)
+
+    def expect(self, user_id: int, chat_id: int, step: str, **data):
+        """Запоминает, что следующее сообщение пользователя в чате - ввод для шага step"""
+        self.states.set(user_id, {'step': step, 'chat_id': chat_id, **data})
+
+    def continue_step(self, message):
+        """Передаёт сообщение без маршрута ожидающему его шагу диалога"""
+        state = self.states.get(message.from_user.id)
+        if not state or state.get('chat_id') != message.chat.id or state.get('step') not in self.steps:
+            return
+        self.steps[state['step']](message, state)
+
+    def remember_generated(self, user_id: int, field: str, event_id: int, text: str):
+        """Сохраняет сгенерированный текст для события, не трогая шаг, начатый пользователем во время генерации.
+
+        Тексты хранятся по event_id (строкой, как после JSON), чтобы кнопка "Использовать"
+        сохранила текст именно своего события.
+        """
+        def change(state):
+            state[field] = {**(state.get(field) or {}), str(event_id): text}
+
+        self.states.modify(user_id, change)
 
     def escape_html(self, text: Optional[str]) -> str:
         """Экранирование HTML-символов для безопасного отображения"""
@@ -23,10 +106,10 @@ class Handlers:
 
     # Основной метод для настройки всех обработчиков
     def setup_handlers(self):
-        """Регистрация всех обработчиков команд и обратных запросов"""
+        """Регистрация всех обработчиков команд и обратных запросов в маршрутизаторе"""
 
         # Обработчик команды /start - главное меню
-        @self.bot.message_handler(commands=['start'])
+        @self.router.command('start')
         def send_welcome(message):
             """Показывает главное меню с основными кнопками"""
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -42,20 +125,39 @@ class Handlers:
                 reply_markup=markup
             )
 
+        if profiler.enabled:
+            @self.router.command('profile')
+            def start_profiling(message):
+                """Запускает профилирование бота на заданное число секунд (только для администраторов)"""
+                if message.from_user.id not in settings.PROFILE_ADMIN_IDS:
+                    return
+                parts = message.text.split()
+                seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+                chat_id = message.chat.id
+                session = profiler.start(seconds, lambda paths: self.bot.send_message(
+                    chat_id, "Профилирование завершено:\n" + '\n'.join(paths)))
+                if session is None:
+                    self.bot.send_message(chat_id, "Профилирование уже идёт")
+                else:
+                    self.bot.send_message(chat_id, f"Профилирование запущено на {session.seconds:g} с")
+
         # Обработчики меню "Дни рождения"
-        @self.bot.message_handler(func=lambda message: message.text == 'Дни рождения')
+        @self.router.message('Дни рождения')
         def show_birthdays_menu(message):
             """Показывает меню управления днями рождения"""
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             button1 = types.KeyboardButton("Добавить день рождения")
             button2 = types.KeyboardButton('Список дней рождения')
-            button3 = types.KeyboardButton('Назад')
+            button3 = types.KeyboardButton('Импорт контактов')
+            button4 = types.KeyboardButton('Экспорт контактов')
+            button5 = types.KeyboardButton('Назад')
             markup.row(button1, button2)
-            markup.row(button3)
+            markup.row(button3, button4)
+            markup.row(button5)
             self.bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
 
         # Обработчики меню "Праздники"
-        @self.bot.message_handler(func=lambda message: message.text == 'Праздники')
+        @self.router.message('Праздники')
         def show_holidays_menu(message):
             """Показывает меню управления праздниками"""
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -68,50 +170,83 @@ class Handlers:
             self.bot.send_message(message.chat.id, "Выберите действие:", reply_markup=markup)
 
         # Обработчики меню "Настройки уведомлений"
-        @self.bot.message_handler(func=lambda message: message.text == 'Настройка уведомлений')
+        @self.router.message('Настройка уведомлений')
         def show_settings_menu(message):
             """Показывает меню управления уведомлениями"""
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
             button1 = types.KeyboardButton('Уведомления о днях рождения')
             button2 = types.KeyboardButton('Уведомления о личных праздниках')
             button3 = types.KeyboardButton('Уведомления о глобальных праздниках')
-            button4 = types.KeyboardButton('Назад')
+            button4 = types.KeyboardButton('Время уведомлений')
+            button5 = types.KeyboardButton('Назад')
             markup.row(button1, button2)
             markup.row(button3, button4)
+            markup.row(button5)
             self.bot.send_message(message.chat.id, "Выберите событие для настройки уведомлений:", reply_markup=markup)
 
 
         # Обработчики списков событий
-        @self.bot.message_handler(func=lambda message: message.text == 'Список дней рождения')
+        @self.router.message('Список дней рождения')
         def show_birthdays_list(message):
             """Показывает список дней рождения"""
             self.show_event_list(message, 'birthday')
 
         # Обработчики добавления событий
-        @self.bot.message_handler(func=lambda message: message.text == 'Добавить день рождения')
+        @self.router.message('Добавить день рождения')
         def add_birthday_start(message):
             """Начинает процесс добавления дня рождения"""
-            msg = self.bot.send_message(
+            self.bot.send_message(
                 message.chat.id,
                 "Введите имя и дату рождения в формате: Имя ДД.ММ"
             )
-            self.bot.register_next_step_handler(msg, lambda m: self.process_add_event(m, 'birthday'))
+            self.expect(message.from_user.id, message.chat.id, 'add_event', event_type='birthday')
 
-        @self.bot.message_handler(func=lambda message: message.text == 'Добавить праздник')
+        @self.router.message('Добавить праздник')
         def add_holiday_start(message):
             """Начинает процесс добавления праздника"""
-            msg = self.bot.send_message(
+            self.bot.send_message(
                 message.chat.id,
                 "Введите название и дату праздника в формате: Название ДД.ММ"
             )
-            self.bot.register_next_step_handler(msg, lambda m: self.process_add_event(m, 'holiday'))
+            self.expect(message.from_user.id, message.chat.id, 'add_event', event_type='holiday')
 
-        @self.bot.message_handler(func=lambda message: message.text == 'Список личных праздников')
+        # Обработчики импорта и экспорта дней рождения
+        @self.router.message('Импорт контактов')
+        def import_events_start(message):
+            """Запрашивает файл с днями рождения"""
+            self.bot.send_message(
+                message.chat.id,
+                "Отправьте файл с днями рождения:\n"
+                "- CSV: имя, дата (ДД.ММ или ДД.ММ.ГГГГ) и необязательная заметка в каждой строке\n"
+                "- vCard (.vcf) - контакты из телефонной книги\n"
+                "- iCalendar (.ics) - события календаря"
+            )
+            self.expect(message.from_user.id, message.chat.id, 'import_events')
+
+        @self.router.message('Экспорт контактов')
+        def export_events_start(message):
+            """Предлагает выбрать формат выгрузки"""
+            markup = types.InlineKeyboardMarkup()
+            markup.row(
+                types.InlineKeyboardButton("CSV", callback_data="export_csv"),
+                types.InlineKeyboardButton("vCard", callback_data="export_vcard"),
+                types.InlineKeyboardButton("iCalendar", callback_data="export_ics"),
+            )
+            self.bot.send_message(message.chat.id, "Выберите формат файла:", reply_markup=markup)
+
+        @self.router.document
+        def receive_document(message):
+            """Передаёт файл шагу импорта, если пользователь его начал"""
+            state = self.states.get(message.from_user.id)
+            if state and state.get('step') == 'import_events' and state.get('chat_id') == message.chat.id:
+                self.process_import(message, state)
+
+        @self.router.message('Список личных праздников')
         def show_holidays_list(message):
             """Показывает список личных праздников"""
             self.show_event_list(message, 'holiday')
 
-        @self.bot.message_handler(func=lambda message: message.text == 'Список глобальных праздников')
+        @self.router.message('Список глобальных праздников')
         def show_global_holidays(message):
             """Показывает список глобальных праздников"""
             holidays = self.db.get_global_holidays()
@@ -131,7 +266,7 @@ class Handlers:
             self.bot.send_message(message.chat.id, text, parse_mode='HTML')
 
         # Обработчик информации о боте
-        @self.bot.message_handler(func=lambda message: message.text == 'Информация о боте')
+        @self.router.message('Информация о боте')
         def send_help(message):
             """Показывает информацию о возможностях бота"""
             help_text = """
@@ -164,25 +299,31 @@ https://t.me/holidaysarewaiting
 
 
         # Обработчик кнопки "Уведомления о днях рождения"
-        @self.bot.message_handler(func=lambda message: message.text == 'Уведомления о днях рождения')
+        @self.router.message('Уведомления о днях рождения')
         def show_settings_birthday_menu(message):
             """Показывает меню настроек уведомлений для дней рождения"""
             self.show_notification_settings_menu(message, 'birthday')
 
         # Обработчик кнопки "Уведомления о личных праздниках"
-        @self.bot.message_handler(func=lambda message: message.text == 'Уведомления о личных праздниках')
+        @self.router.message('Уведомления о личных праздниках')
         def show_settings_personal_holidays_menu(message):
             """Показывает меню настроек уведомлений для личных праздников"""
             self.show_notification_settings_menu(message, 'holiday')
 
         # Обработчик кнопки "Уведомления о глобальных праздниках"
-        @self.bot.message_handler(func=lambda message: message.text == 'Уведомления о глобальных праздниках')
+        @self.router.message('Уведомления о глобальных праздниках')
         def show_settings_global_holidays_menu(message):
             """Показывает меню настроек уведомлений для глобальных праздников"""
             self.show_notification_settings_menu(message, 'global_holiday')
 
+        # Обработчик кнопки "Время уведомлений"
+        @self.router.message('Время уведомлений')
+        def show_reminder_time(message):
+            """Показывает часовой пояс и час доставки напоминаний"""
+            self.show_reminder_time_menu(message.chat.id)
+
         # Обработчик кнопки "Назад"
-        @self.bot.message_handler(func=lambda message: message.text == 'Назад')
+        @self.router.message('Назад')
         def back_to_main(message):
             """Возвращает в главное меню"""
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -194,17 +335,17 @@ https://t.me/holidaysarewaiting
             markup.row(button3, button4)
             self.bot.send_message(message.chat.id, "Главное меню:", reply_markup=markup)
 
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('toggle_notification_'))
+        @self.router.callback_prefix('toggle_notification_')
         def toggle_notification(call):
             """Переключает статус уведомления (вкл/выкл) и обновляет существующее сообщение"""
             try:
-                print(f"Получены callback_data: {call.data}")
+                logging.debug("Получены callback_data: %s", call.data)
 
                 parts = call.data.split('_')
-                print(f"Разделенные части: {parts}")
+                logging.debug("Разделенные части: %s", parts)
 
                 if len(parts) < 4 or parts[0] != 'toggle' or parts[1] != 'notification':
-                    print(f"Неверный формат callback_data или префикс: {call.data}")
+                    logging.warning("Неверный формат callback_data или префикс: %s", call.data)
                     self.bot.answer_callback_query(call.id, "Ошибка в формате команды")
                     return
 
@@ -214,17 +355,17 @@ https://t.me/holidaysarewaiting
                 else:
                     event_type = parts[2]
                     setting = '_'.join(parts[3:])
-                print(f"event_type: {event_type}, setting: {setting}")
+                logging.debug("event_type: %s, setting: %s", event_type, setting)
 
                 # Проверка event_type и setting
                 valid_event_types = ['birthday', 'holiday', 'global_holiday']
                 valid_settings = ['notify_on_day', 'notify_one_day_before', 'notify_one_week_before']
                 if event_type not in valid_event_types:
-                    print(f"Недопустимый event_type: {event_type}, callback_data: {call.data}")
+                    logging.warning("Недопустимый event_type: %s, callback_data: %s", event_type, call.data)
                     self.bot.answer_callback_query(call.id, "Недопустимый тип события")
                     return
                 if setting not in valid_settings:
-                    print(f"Недопустимая настройка: {setting}, callback_data: {call.data}")
+                    logging.warning("Недопустимая настройка: %s, callback_data: %s", setting, call.data)
                     self.bot.answer_callback_query(call.id, "Недопустимая настройка")
                     return
 
@@ -235,7 +376,7 @@ https://t.me/holidaysarewaiting
                 if not settings:
                     settings = {'notify_on_day': 1, 'notify_one_day_before': 1, 'notify_one_week_before': 1}
                     self.db.update_notification_settings(chat_id, event_type, **settings)
-                print(f"Текущие настройки: {settings}")
+                logging.debug("Текущие настройки: %s", settings)
 
                 # Переключение настроек
                 new_value = 1 if settings.get(setting, 0) == 0 else 0
@@ -243,18 +384,18 @@ https://t.me/holidaysarewaiting
                 success = self.db.update_notification_settings(chat_id, event_type, **update_data)
 
                 if not success:
-                    print(
-                        f"Не удалось обновить настройки: chat_id={chat_id}, event_type={event_type}, setting={setting}")
+                    logging.error("Не удалось обновить настройки: chat_id=%s, event_type=%s, setting=%s",
+                                  chat_id, event_type, setting)
                     self.bot.answer_callback_query(call.id, "Ошибка при обновлении настроек")
                     return
 
                 # Получение обновленных настроек
                 updated_settings = self.db.get_notification_settings(chat_id, event_type)
                 if not updated_settings:
-                    print(f"Настройки не найдены после обновления: chat_id={chat_id}, event_type={event_type}")
+                    logging.error("Настройки не найдены после обновления: chat_id=%s, event_type=%s", chat_id, event_type)
                     self.bot.answer_callback_query(call.id, "Ошибка: настройки не найдены")
                     return
-                print(f"Обновленные настройки: {updated_settings}")
+                logging.debug("Обновленные настройки: %s", updated_settings)
 
                 # Создание нового меню
                 event_name = {
@@ -295,190 +436,81 @@ https://t.me/holidaysarewaiting
                     )
                     self.bot.answer_callback_query(call.id, "Настройка обновлена")
                 except Exception as e:
-                    print(f"Ошибка при редактировании сообщения: {e}, callback_data={call.data}")
+                    logging.error("Ошибка при редактировании сообщения: %s, callback_data=%s", e, call.data)
                     self.bot.answer_callback_query(call.id, "Ошибка при обновлении меню")
             except Exception as e:
-                print(f"Общая ошибка в toggle_notification: {e}, callback_data={call.data}")
+                logging.exception("Общая ошибка в toggle_notification, callback_data=%s", call.data)
                 self.bot.answer_callback_query(call.id, "Произошла ошибка")
 
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('birthday_'))
-        def show_birthday_profile(call):
-            """Показывает профиль дня рождения"""
-            self.show_event_profile(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('holiday_'))
-        def show_holiday_profile(call):
-            """Показывает профиль праздника"""
-            self.show_event_profile(call, 'holiday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data == 'back_to_birthday_list')
-        def back_to_birthday_list(call):
-            """Возвращает к списку дней рождения"""
-            self.back_to_event_list(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data == 'back_to_holiday_list')
-        def back_to_holiday_list(call):
-            """Возвращает к списку праздника"""
-            self.back_to_event_list(call, 'holiday')
-
-        # Обработчики редактирования событий
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('edit_birthday_'))
-        def edit_birthday_start(call):
-            """Начинает процесс редактирования дня рождения"""
-            self.edit_event_start(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('edit_holiday_'))
-        def edit_holiday_start(call):
-            """Начинает процесс редактирования праздника"""
-            self.edit_event_start(call, 'holiday')
-
-        # Обработчики добавления заметок
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('add_note_birthday_'))
-        def add_birthday_note_start(call):
-            """Начинает процесс добавления заметки к дню рождения"""
-            self.add_note_start(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('add_note_holiday_'))
-        def add_holiday_note_start(call):
-            """Начинает процесс добавления заметки к празднику"""
-            self.add_note_start(call, 'holiday')
-
-        # Обработчики работы с поздравлениями (только для дней рождения)
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('add_wish_birthday_'))
-        def add_wish_start(call):
-            """Начинает процесс добавления/генерации поздравления"""
-            self.add_wish_start(call)
-
-        # Обработчики работы с подарками (только для дней рождения)
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('add_gift_birthday_'))
-        def add_gift_start(call):
-            """Начинает процесс добавления/генерации идей подарков"""
-            self.add_gift_start(call)
-
-        # Обработчики удаления событий
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('delete_birthday_'))
-        def delete_birthday_confirm(call):
-            """Запрашивает подтверждение удаления дня рождения"""
-            self.delete_event_confirm(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('delete_holiday_'))
-        def delete_holiday_confirm(call):
-            """Запрашивает подтверждение удаления праздника"""
-            self.delete_event_confirm(call, 'holiday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_delete_birthday_'))
-        def delete_birthday_execute(call):
-            """Выполняет удаление дня рождения после подтверждения"""
-            self.delete_event_execute(call, 'birthday')
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_delete_holiday_'))
-        def delete_holiday_execute(call):
-            """Выполняет удаление праздника после подтверждения"""
-            self.delete_event_execute(call, 'holiday')
-
-        # Обработчики генерации идей подарков через AI
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('generate_gift_'))
-        def generate_gift(call):
-            """Запрашивает информацию для генерации идей подарков"""
-            name = call.data.replace('generate_gift_', '')
-            self.user_data[call.from_user.id] = {'action': 'generate_gift', 'name': name}
-
-            msg = self.bot.send_message(
-                call.message.chat.id,
-                f"Введите информацию о {name} (возраст, хобби, увлечения и т.д.), "
-                "чтобы я мог предложить персонализированные идеи подарков:"
-            )
-            self.bot.register_next_step_handler(msg, self.process_gift_info)
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('use_generated_gift_'))
-        def use_generated_gift(call):
-            """Сохраняет сгенерированные идеи подарков"""
-            name = call.data.replace('use_generated_gift_', '')
-            user_id = call.from_user.id
-            data = self.user_data.get(user_id, {})
-
-            if 'generated_gifts' in data:
-                if self.db.update_event(
-                    call.message.chat.id,
-                    data['name'],
-                    gifts=data['generated_gifts'],
-                    event_type='birthday'
-                ):
-                    self.bot.answer_callback_query(call.id, "Идеи подарков сохранены!")
-                    self.show_event_profile(call, 'birthday')
-                else:
-                    self.bot.answer_callback_query(call.id, "Ошибка при сохранении идей подарков")
-            else:
-                self.bot.answer_callback_query(call.id, "Идеи подарков не найдены")
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('manual_gift_'))
-        def manual_gift_input(call):
-            """Запрашивает ручной ввод идей подарков"""
-            name = call.data.replace('manual_gift_', '')
-            self.user_data[call.from_user.id] = {'action': 'add_gift_birthday', 'name': name}
-
-            msg = self.bot.send_message(
-                call.message.chat.id,
-                f"Введите ваши идеи подарков для {name}:"
-            )
-            self.bot.register_next_step_handler(msg, self.process_add_gift)
-
-        # Обработчики генерации поздравлений через AI
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('generate_wish_'))
-        def generate_wish(call):
-            """Запрашивает информацию для генерации поздравления"""
-            name = call.data.replace('generate_wish_', '')
-            self.user_data[call.from_user.id] = {'action': 'generate_wish', 'name': name}
-
-            msg = self.bot.send_message(
-                call.message.chat.id,
-                f"Введите информацию о {name} (возраст, хобби, увлечения и т.д.), "
-                "чтобы я мог создать персонализированное поздравление:"
-            )
-            self.bot.register_next_step_handler(msg, self.process_wish_info)
-
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('use_generated_wish_'))
-        def use_generated_wish(call):
-            """Сохраняет сгенерированное поздравление"""
-            name = call.data.replace('use_generated_wish_', '')
-            user_id = call.from_user.id
-            data = self.user_data.get(user_id, {})
-
-            if 'generated_wish' in data:
-                if self.db.update_event(
-                    call.message.chat.id,
-                    data['name'],
-                    wishes=data['generated_wish'],
-                    event_type='birthday'
-                ):
-                    self.bot.answer_callback_query(call.id, "Поздравление сохранено!")
-                    self.show_event_profile(call, 'birthday')
-                else:
-                    self.bot.answer_callback_query(call.id, "Ошибка при сохранении поздравления")
-            else:
-                self.bot.answer_callback_query(call.id, "Поздравление не найдено")
-
-        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('manual_wish_'))
-        def manual_wish_input(call):
-            """Запрашивает ручной ввод поздравления"""
-            name = call.data.replace('manual_wish_', '')
-            self.user_data[call.from_user.id] = {'action': 'add_wish_birthday', 'name': name}
-
-            msg = self.bot.send_message(
+        # Все кнопки событий кодируются encode_callback и разбираются одним обработчиком
+        @self.router.callback_prefix(CALLBACK_PREFIX)
+        def handle_event_callback(call):
+            """Передаёт нажатие кнопки события обработчику из таблицы event_callbacks"""
+            callback = decode_callback(call.data)
+            handler = self.event_callbacks.get(callback.action) if callback else None
+            if handler is None:
+                self.bot.answer_callback_query(call.id, "Кнопка устарела, откройте список заново")
+                return
+            handler(call, callback.event_type, callback.value)
+
+        @self.router.callback_prefix('reminder_hour_')
+        def set_reminder_hour(call):
+            """Сохраняет час доставки напоминаний"""
+            hour = int(call.data.replace('reminder_hour_', ''))
+            self.db.set_chat_preferences(call.message.chat.id, reminder_hour=hour)
+            self.bot.answer_callback_query(call.id, f"Напоминания будут приходить в {hour:02d}:00")
+            self.show_reminder_time_menu(call.message.chat.id, call.message.message_id)
+
+        @self.router.callback('reminder_timezone')
+        def set_reminder_timezone_start(call):
+            """Запрашивает часовой пояс"""
+            self.bot.answer_callback_query(call.id)
+            self.bot.send_message(
                 call.message.chat.id,
-                f"Введите ваше поздравление для {name}:"
+                "Введите часовой пояс, например Europe/Moscow, Asia/Yekaterinburg или UTC+5"
             )
-            self.bot.register_next_step_handler(msg, self.process_add_wish)
-
-            try:
-                self.bot.delete_message(call.message.chat.id, call.message.message_id)
-            except:
-                pass
+            self.expect(call.from_user.id, call.message.chat.id, 'timezone')
+
+        @self.router.callback_prefix('export_')
+        def export_events_file(call):
+            """Отправляет файл с днями рождения чата в выбранном формате"""
+            file_format = call.data[len('export_'):]
+            if file_format not in FORMATS:
+                self.bot.answer_callback_query(call.id, "Неизвестный формат")
+                return
+            self.bot.answer_callback_query(call.id)
+            self.send_export(call.message.chat.id, file_format)
+
+        @self.router.callback('cancel_generation')
+        def cancel_generation(call):
+            """Отменяет выполняющуюся генерацию пользователя"""
+            self.ai_jobs.cancel(call.from_user.id)
+            self.states.pop(call.from_user.id)
+            self.bot.answer_callback_query(call.id, "Генерация отменена")
+            self.bot.edit_message_text("Генерация отменена.", call.message.chat.id, call.message.message_id)
+
+        # Кнопки старого формата и неизвестные данные
+        @self.router.fallback
+        def unknown_callback(call):
+            """Отвечает на нажатие кнопки, для которой нет обработчика"""
+            self.bot.answer_callback_query(call.id, "Кнопка устарела, откройте список заново")
+
+        # Команда или кнопка меню отменяет ожидание ввода
+        @self.router.before_routed_message
+        def cancel_step(message):
+            state = self.states.get(message.from_user.id)
+            if state and 'step' in state:
+                self.states.pop(message.from_user.id)
+
+        # Остальные сообщения - ответы на вопросы бота
+        self.router.fallback_message(self.continue_step)
+
+        self.router.register(self.bot)
 
     # Основные методы обработки данных
-    def process_add_event(self, message, event_type='birthday'):
+    def process_add_event(self, message, state):
         """Обрабатывает добавление нового события (дня рождения/праздника)"""
+        event_type = state.get('event_type', 'birthday')
         try:
             parts = message.text.rsplit(' ', 1)
             if len(parts) != 2:
@@ -487,85 +519,127 @@ https://t.me/holidaysarewaiting
             name = parts[0]
             date = datetime.datetime.strptime(parts[1] + ".2000", "%d.%m.%Y").date()
 
+            self.states.pop(message.from_user.id)
             if self.db.add_event(message.chat.id, name, date, event_type=event_type):
                 event_name = "День рождения" if event_type == 'birthday' else "Праздник"
-                self.bot.send_message(message.chat.id, f"{event_name} {name} добавлен!")
+                self.send_message(message.chat.id, f"{event_name} {name} добавлен!")
                 self.db.init_notification_settings(message.chat.id)  # Инициализация настроек уведомлений
             else:
-                self.bot.send_message(message.chat.id, f"{name} уже существует в списке.")
+                self.send_message(message.chat.id, f"{name} уже существует в списке.")
         except ValueError:
             event_name = "день рождения" if event_type == 'birthday' else "праздник"
-            msg = self.bot.send_message(
+            # Шаг остаётся ожидающим: следующее сообщение - новая попытка
+            self.bot.send_message(
                 message.chat.id,
                 f"Неверный формат. Пожалуйста, используйте: Имя ДД.ММ для {event_name}"
             )
-            self.bot.register_next_step_handler(msg, lambda m: self.process_add_event(m, event_type))
 
-    def edit_event_start(self, call, event_type='birthday'):
-        name = call.data.replace(f'edit_{event_type}_', '')
-        self.user_data[call.from_user.id] = {'action': f'edit_{event_type}', 'name': name}
+    def process_import(self, message, state):
+        """Импортирует дни рождения из присланного файла и отправляет отчёт"""
+        chat_id = message.chat.id
+        if message.document is None:
+            self.bot.send_message(chat_id, "Отправьте файл CSV, vCard (.vcf) или iCalendar (.ics).")
+            return
+        file_format = detect_format(message.document.file_name)
+        if file_format is None:
+            self.bot.send_message(chat_id, "Неподдерживаемый формат файла. Поддерживаются .csv, .vcf и .ics")
+            return
+
+        self.states.pop(message.from_user.id)
+        try:
+            with download_document(self.bot, message.document.file_id) as file:
+                report = import_events(self.db, chat_id, file, file_format)
+        except FileTooLargeError:
+            self.send_message(
+                chat_id,
+                f"Файл слишком большой. Максимальный размер - {settings.IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ."
+            )
+            return
+        except Exception as e:
+            logging.error(f"Ошибка при импорте файла: {e}")
+            self.send_message(chat_id, "Произошла ошибка при импорте файла. Пожалуйста, попробуйте снова.")
+            return
+
+        text = f"Импорт завершён.\nДобавлено: {report.added}\nУже были в списке: {report.duplicates}"
+        if report.failed:
+            text += f"\nС ошибками: {report.failed}\n"
+            text += "\n".join(f"Строка {line}: {reason}" for line, reason in report.errors)
+            if report.failed > len(report.errors):
+                text += f"\n... и ещё {report.failed - len(report.errors)}"
+        self.send_message(chat_id, text[:4000])
 
-        msg = self.bot.send_message(
+    def send_export(self, chat_id: int, file_format: str):
+        """Отправляет файл с днями рождения чата"""
+        try:
+            file, count = export_events(self.db, chat_id, file_format)
+        except Exception as e:
+            logging.error(f"Ошибка при экспорте: {e}")
+            self.bot.send_message(chat_id, "Произошла ошибка при экспорте. Пожалуйста, попробуйте снова.")
+            return
+        with file:
+            if not count:
+                self.bot.send_message(chat_id, "Список дней рождения пуст.")
+                return
+            extension = FORMATS[file_format][0]
+            self.bot.send_document(chat_id, types.InputFile(file, file_name=f"birthdays.{extension}"),
+                                   caption=f"Дней рождения: {count}")
+
+    def edit_event_start(self, call, event_type='birthday', event_id=0):
+        self.bot.send_message(
             call.message.chat.id,
             f"Введите новую дату в формате ДД.ММ:"
         )
-        self.bot.register_next_step_handler(msg, lambda m: self.process_edit_event(m, event_type))
+        self.expect(call.from_user.id, call.message.chat.id, 'edit_event', event_type=event_type, event_id=event_id)
 
-    def process_edit_event(self, message, event_type='birthday'):
+    def process_edit_event(self, message, state):
         """Обрабатывает изменение даты события"""
         try:
             date = datetime.datetime.strptime(message.text + ".2000", "%d.%m.%Y").date()
-            user_id = message.from_user.id
-            data = self.user_data.get(user_id, {})
-
-            if self.db.update_event(message.chat.id, data['name'], date=date, event_type=event_type):
-                self.bot.send_message(message.chat.id, "Дата успешно обновлена!")
-            else:
-                self.bot.send_message(message.chat.id, "Ошибка при обновлении даты.")
-
-            if user_id in self.user_data:
-                del self.user_data[user_id]
         except ValueError:
-            msg = self.bot.send_message(message.chat.id, "Неверный формат даты. Попробуйте еще раз (ДД.ММ):")
-            self.bot.register_next_step_handler(msg, lambda m: self.process_edit_event(m, event_type))
+            self.bot.send_message(message.chat.id, "Неверный формат даты. Попробуйте еще раз (ДД.ММ):")
+            return
 
-    def add_note_start(self, call, event_type='birthday'):
-        name = call.data.replace(f'add_note_{event_type}_', '')
-        self.user_data[call.from_user.id] = {'action': f'add_note_{event_type}', 'name': name}
+        self.states.pop(message.from_user.id)
+        if self.db.update_event_by_id(message.chat.id, state['event_id'], date=date, event_type=state['event_type']):
+            self.send_message(message.chat.id, "Дата успешно обновлена!")
+        else:
+            self.send_message(message.chat.id, "Ошибка при обновлении даты.")
 
-        msg = self.bot.send_message(
+    def add_note_start(self, call, event_type='birthday', event_id=0):
+        self.bot.send_message(
             call.message.chat.id,
             f"Введите заметку:"
         )
-        self.bot.register_next_step_handler(msg, lambda m: self.process_add_note(m, event_type))
+        self.expect(call.from_user.id, call.message.chat.id, 'add_note', event_type=event_type, event_id=event_id)
 
-    def process_add_note(self, message, event_type='birthday'):
+    def process_add_note(self, message, state):
         """Обрабатывает добавление заметки к событию"""
-        user_id = message.from_user.id
-        data = self.user_data.get(user_id, {})
-
-        if self.db.update_event(message.chat.id, data['name'], notes=message.text, event_type=event_type):
-            self.bot.send_message(message.chat.id, "Заметка успешно добавлена!")
+        self.states.pop(message.from_user.id)
+        if self.db.update_event_by_id(message.chat.id, state['event_id'], notes=message.text,
+                                      event_type=state['event_type']):
+            self.send_message(message.chat.id, "Заметка успешно добавлена!")
         else:
-            self.bot.send_message(message.chat.id, "Ошибка при добавлении заметки.")
-
-        if user_id in self.user_data:
-            del self.user_data[user_id]
+            self.send_message(message.chat.id, "Ошибка при добавлении заметки.")
 
-    def add_wish_start(self, call):
+    def add_wish_start(self, call, event_type='birthday', event_id=0):
         """Показывает меню выбора способа добавления поздравления"""
-        name = call.data.replace('add_wish_birthday_', '')
-        self.user_data[call.from_user.id] = {'action': 'add_wish_birthday', 'name': name}
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
+        name = event['name']
+        self.states.set(call.from_user.id, {'event_id': event_id, 'name': name})
 
         markup = types.InlineKeyboardMarkup()
         markup.row(
-            types.InlineKeyboardButton("✨ Сгенерировать поздравление", callback_data=f"generate_wish_{name}"),
+            types.InlineKeyboardButton("✨ Сгенерировать поздравление",
+                                       callback_data=encode_callback('generate_wish', event_type, event_id)),
         )
         markup.row(
-            types.InlineKeyboardButton("📝 Ввести вручную", callback_data=f"manual_wish_{name}")
+            types.InlineKeyboardButton("📝 Ввести вручную",
+                                       callback_data=encode_callback('manual_wish', event_type, event_id))
         )
         markup.row(
-            types.InlineKeyboardButton("🔙 Назад", callback_data=f"birthday_{name}")
+            types.InlineKeyboardButton("🔙 Назад", callback_data=encode_callback('profile', event_type, event_id))
         )
 
         self.bot.edit_message_text(
@@ -575,6 +649,57 @@ https://t.me/holidaysarewaiting
             reply_markup=markup
         )
 
+    def generate_wish_start(self, call, event_type='birthday', event_id=0, regenerate=False):
+        """Запрашивает информацию для генерации поздравления"""
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
+        name = event['name']
+        self.bot.send_message(
+            call.message.chat.id,
+            f"Введите информацию о {name} (возраст, хобби, увлечения и т.д.), "
+            "чтобы я мог создать персонализированное поздравление:"
+        )
+        self.expect(call.from_user.id, call.message.chat.id, 'wish_info',
+                    event_id=event_id, name=name, regenerate=regenerate)
+
+    def use_generated_wish(self, call, event_type='birthday', event_id=0):
+        """Сохраняет сгенерированное поздравление"""
+        data = self.states.get(call.from_user.id) or {}
+        generated = (data.get('generated_wish') or {}).get(str(event_id))
+
+        if generated:
+            if self.db.update_event_by_id(
+                call.message.chat.id,
+                event_id,
+                wishes=generated,
+                event_type='birthday'
+            ):
+                self.bot.answer_callback_query(call.id, "Поздравление сохранено!")
+                self.show_event_profile(call, 'birthday', event_id)
+            else:
+                self.bot.answer_callback_query(call.id, "Ошибка при сохранении поздравления")
+        else:
+            self.bot.answer_callback_query(call.id, "Поздравление не найдено")
+
+    def manual_wish_input(self, call, event_type='birthday', event_id=0):
+        """Запрашивает ручной ввод поздравления"""
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
+        name = event['name']
+
+        self.bot.send_message(
+            call.message.chat.id,
+            f"Введите ваше поздравление для {name}:"
+        )
+        self.expect(call.from_user.id, call.message.chat.id, 'add_wish', event_id=event_id, name=name)
+
+        try:
+            self.bot.delete_message(call.message.chat.id, call.message.message_id)
+        except:
+            pass
+
     def show_notification_settings_menu(self, message, event_type, message_id=None):
         """Показывает меню настроек уведомлений для указанного типа событий"""
         chat_id = message.chat.id
@@ -622,23 +747,66 @@ https://t.me/holidaysarewaiting
             else:
                 self.bot.send_message(chat_id, text, reply_markup=markup)
         except Exception as e:
-            print(f"Error in show_notification_settings: {e}")
+            logging.error(f"Error in show_notification_settings: {e}")
+            self.bot.send_message(chat_id, text, reply_markup=markup)
+
+    def show_reminder_time_menu(self, chat_id: int, message_id: Optional[int] = None):
+        """Показывает меню выбора часа доставки напоминаний"""
+        preferences = self.db.get_chat_preferences(chat_id)
+        markup = types.InlineKeyboardMarkup()
+        for start in range(0, 24, 6):
+            markup.row(*[
+                types.InlineKeyboardButton(
+                    f"{'✅' if hour == preferences['reminder_hour'] else ''}{hour:02d}",
+                    callback_data=f"reminder_hour_{hour}"
+                )
+                for hour in range(start, start + 6)
+            ])
+        markup.row(types.InlineKeyboardButton("Изменить часовой пояс", callback_data="reminder_timezone"))
+
+        text = (f"Напоминания приходят в {preferences['reminder_hour']:02d}:00, "
+                f"часовой пояс: {preferences['timezone']}.\nВыберите час:")
+        if not message_id:
             self.bot.send_message(chat_id, text, reply_markup=markup)
+            return
+        try:
+            self.bot.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+        except Exception as e:
+            # Повторный выбор того же часа не меняет сообщение
+            logging.error(f"Ошибка при обновлении меню времени уведомлений: {e}")
+
+    def process_timezone(self, message, state):
+        """Сохраняет часовой пояс, введённый пользователем"""
+        timezone = parse_timezone(message.text or '')
+        if not timezone:
+            self.bot.send_message(
+                message.chat.id,
+                "Не удалось распознать часовой пояс. Введите, например, Europe/Moscow или UTC+5"
+            )
+            return
+        self.states.pop(message.from_user.id)
+        self.db.set_chat_preferences(message.chat.id, timezone=timezone)
+        self.show_reminder_time_menu(message.chat.id)
 
-    def add_gift_start(self, call):
+    def add_gift_start(self, call, event_type='birthday', event_id=0):
         """Показывает меню выбора способа добавления идей подарков"""
-        name = call.data.replace('add_gift_birthday_', '')
-        self.user_data[call.from_user.id] = {'action': 'add_gift_birthday', 'name': name}
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
+        name = event['name']
+        self.states.set(call.from_user.id, {'event_id': event_id, 'name': name})
 
         markup = types.InlineKeyboardMarkup()
         markup.row(
-            types.InlineKeyboardButton("✨ Сгенерировать идеи", callback_data=f"generate_gift_{name}"),
+            types.InlineKeyboardButton("✨ Сгенерировать идеи",
+                                       callback_data=encode_callback('generate_gift', event_type, event_id)),
         )
         markup.row(
-            types.InlineKeyboardButton("📝 Ввести вручную", callback_data=f"manual_gift_{name}")
+            types.InlineKeyboardButton("📝 Ввести вручную",
+                                       callback_data=encode_callback('manual_gift', event_type, event_id))
         )
         markup.row(
-            types.InlineKeyboardButton("🔙 Назад", callback_data=f"birthday_{name}")
+            types.InlineKeyboardButton("🔙 Назад", callback_data=encode_callback('profile', event_type, event_id))
         )
 
         self.bot.edit_message_text(
@@ -648,40 +816,94 @@ https://t.me/holidaysarewaiting
             reply_markup=markup
         )
 
-    def process_gift_info(self, message):
-        """Обрабатывает информацию для генерации идей подарков"""
-        user_id = message.from_user.id
-        if user_id not in self.user_data or self.user_data[user_id]['action'] != 'generate_gift':
-            self.bot.send_message(message.chat.id, "Что-то пошло не так. Пожалуйста, попробуйте снова.")
+    def generate_gift_start(self, call, event_type='birthday', event_id=0, regenerate=False):
+        """Запрашивает информацию для генерации идей подарков"""
+        event = self.find_event(call, event_type, event_id)
+        if not event:
             return
+        name = event['name']
+        self.bot.send_message(
+            call.message.chat.id,
+            f"Введите информацию о {name} (возраст, хобби, увлечения и т.д.), "
+            "чтобы я мог предложить персонализированные идеи подарков:"
+        )
+        self.expect(call.from_user.id, call.message.chat.id, 'gift_info',
+                    event_id=event_id, name=name, regenerate=regenerate)
 
-        name = self.user_data[user_id]['name']
-        info = message.text
+    def use_generated_gift(self, call, event_type='birthday', event_id=0):
+        """Сохраняет сгенерированные идеи подарков"""
+        data = self.states.get(call.from_user.id) or {}
+        generated = (data.get('generated_gifts') or {}).get(str(event_id))
 
-        self.bot.send_chat_action(message.chat.id, 'typing')
+        if generated:
+            if self.db.update_event_by_id(
+                call.message.chat.id,
+                event_id,
+                gifts=generated,
+                event_type='birthday'
+            ):
+                self.bot.answer_callback_query(call.id, "Идеи подарков сохранены!")
+                self.show_event_profile(call, 'birthday', event_id)
+            else:
+                self.bot.answer_callback_query(call.id, "Ошибка при сохранении идей подарков")
+        else:
+            self.bot.answer_callback_query(call.id, "Идеи подарков не найдены")
 
-        try:
-            gift_ideas = self.ai_service.generate_gift_ideas(name, info)
+    def manual_gift_input(self, call, event_type='birthday', event_id=0):
+        """Запрашивает ручной ввод идей подарков"""
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
+        name = event['name']
 
-            self.user_data[user_id] = {
-                'action': 'add_gift_birthday',
-                'name': name,
-                'generated_gifts': gift_ideas
-            }
+        self.bot.send_message(
+            call.message.chat.id,
+            f"Введите ваши идеи подарков для {name}:"
+        )
+        self.expect(call.from_user.id, call.message.chat.id, 'add_gift', event_id=event_id, name=name)
+
+    def process_gift_info(self, message, state):
+        """Обрабатывает информацию для генерации идей подарков"""
+        user_id = message.from_user.id
+        name = state['name']
+        event_id = state['event_id']
+        regenerate = state.get('regenerate', False)
+        info = message.text
+        # Ввод получен, дальше пользователь выбирает кнопками
+        self.states.set(user_id, {'event_id': event_id, 'name': name})
+
+        def generate(status_message_id, cancelled):
+            # При повторной генерации кэш не используется, чтобы получить новый вариант
+            if not settings.AI_STREAMING:
+                return self.ai_service.generate_gift_ideas(name, info, use_cache=not regenerate)
+            return self.stream_to_message(
+                message.chat.id,
+                status_message_id,
+                f"Идеи подарков для {name}:",
+                self.ai_service.stream_gift_ideas(name, info, use_cache=not regenerate),
+                cancelled
+            )
+
+        def on_result(gift_ideas, status_message_id):
+            self.remember_generated(user_id, 'generated_gifts', event_id, gift_ideas)
 
             markup = types.InlineKeyboardMarkup()
             markup.row(
-                types.InlineKeyboardButton("✅ Использовать эти идеи", callback_data=f"use_generated_gift_{name}"),
+                types.InlineKeyboardButton("✅ Использовать эти идеи",
+                                           callback_data=encode_callback('use_gift', 'birthday', event_id)),
             )
             markup.row(
-                types.InlineKeyboardButton("🔄 Сгенерировать другие", callback_data=f"generate_gift_{name}"),
-                types.InlineKeyboardButton("📝 Ввести вручную", callback_data=f"manual_gift_{name}")
+                types.InlineKeyboardButton("🔄 Сгенерировать другие",
+                                           callback_data=encode_callback('regenerate_gift', 'birthday', event_id)),
+                types.InlineKeyboardButton("📝 Ввести вручную",
+                                           callback_data=encode_callback('manual_gift', 'birthday', event_id))
             )
 
-            self.bot.send_message(
-                message.chat.id,
+            self.bot.edit_message_text(
                 f"Сгенерированные идеи подарков для {name}:\n\n{gift_ideas}\n\n"
                 "Хотите использовать их или сгенерировать другие?",
+                message.chat.id,
+                status_message_id,
                 reply_markup=markup
             )
 
@@ -690,48 +912,50 @@ https://t.me/holidaysarewaiting
             except:
                 pass
 
-        except Exception as e:
-            print(f"Ошибка при генерации идей подарков: {e}")
-            self.bot.send_message(
-                message.chat.id,
-                "Произошла ошибка при генерации идей подарков. Пожалуйста, попробуйте снова."
-            )
+        self.start_generation(message, "Генерирую идеи подарков...", generate, on_result,
+                              "Произошла ошибка при генерации идей подарков. Пожалуйста, попробуйте снова.")
 
-    def process_wish_info(self, message):
+    def process_wish_info(self, message, state):
         """Обрабатывает информацию для генерации поздравления"""
         user_id = message.from_user.id
-        if user_id not in self.user_data or self.user_data[user_id]['action'] != 'generate_wish':
-            self.bot.send_message(message.chat.id, "Что-то пошло не так. Пожалуйста, попробуйте снова.")
-            return
-
-        name = self.user_data[user_id]['name']
+        name = state['name']
+        event_id = state['event_id']
+        regenerate = state.get('regenerate', False)
         info = message.text
+        # Ввод получен, дальше пользователь выбирает кнопками
+        self.states.set(user_id, {'event_id': event_id, 'name': name})
 
-        self.bot.send_chat_action(message.chat.id, 'typing')
-
-        try:
-            congratulation = self.ai_service.generate_congratulation(name, info)
+        def generate(status_message_id, cancelled):
+            if not settings.AI_STREAMING:
+                return self.ai_service.generate_congratulation(name, info, use_cache=not regenerate)
+            return self.stream_to_message(
+                message.chat.id,
+                status_message_id,
+                f"Поздравление для {name}:",
+                self.ai_service.stream_congratulation(name, info, use_cache=not regenerate),
+                cancelled
+            )
 
-            self.user_data[user_id] = {
-                'action': 'add_wish_birthday',
-                'name': name,
-                'generated_wish': congratulation
-            }
+        def on_result(congratulation, status_message_id):
+            self.remember_generated(user_id, 'generated_wish', event_id, congratulation)
 
             markup = types.InlineKeyboardMarkup()
             markup.row(
                 types.InlineKeyboardButton("✅ Использовать это поздравление",
-                                           callback_data=f"use_generated_wish_{name}"),
+                                           callback_data=encode_callback('use_wish', 'birthday', event_id)),
             )
             markup.row(
-                types.InlineKeyboardButton("🔄 Сгенерировать другое", callback_data=f"generate_wish_{name}"),
-                types.InlineKeyboardButton("📝 Ввести вручную", callback_data=f"manual_wish_{name}")
+                types.InlineKeyboardButton("🔄 Сгенерировать другое",
+                                           callback_data=encode_callback('regenerate_wish', 'birthday', event_id)),
+                types.InlineKeyboardButton("📝 Ввести вручную",
+                                           callback_data=encode_callback('manual_wish', 'birthday', event_id))
             )
 
-            self.bot.send_message(
-                message.chat.id,
+            self.bot.edit_message_text(
                 f"Сгенерированное поздравление для {name}:\n\n{congratulation}\n\n"
                 "Хотите использовать его или сгенерировать другое?",
+                message.chat.id,
+                status_message_id,
                 reply_markup=markup
             )
 
@@ -740,147 +964,197 @@ https://t.me/holidaysarewaiting
             except:
                 pass
 
-        except Exception as e:
-            print(f"Ошибка при генерации поздравления: {e}")
-            self.bot.send_message(
-                message.chat.id,
-                "Произошла ошибка при генерации поздравления. Пожалуйста, попробуйте снова."
-            )
+        self.start_generation(message, "Генерирую поздравление...", generate, on_result,
+                              "Произошла ошибка при генерации поздравления. Пожалуйста, попробуйте снова.")
 
-    def process_add_gift(self, message):
-        """Обрабатывает ручной ввод идей подарков"""
-        user_id = message.from_user.id
-        data = self.user_data.get(user_id, {})
+    def start_generation(self, message, status_text: str, generate, on_result, error_text: str):
+        """Запускает генерацию в фоне и показывает сообщение о статусе с кнопкой отмены.
 
-        if self.db.update_event(message.chat.id, data['name'], gifts=message.text, event_type='birthday'):
-            self.bot.send_message(message.chat.id, "Идеи подарков успешно добавлены!")
-        else:
-            self.bot.send_message(message.chat.id, "Ошибка при добавлении идей подарков.")
+        generate получает id сообщения о статусе и событие отмены. Когда генерация
+        завершится, on_result получает текст и id сообщения о статусе, которое нужно
+        заменить результатом.
+        """
+        chat_id = message.chat.id
+        markup = types.InlineKeyboardMarkup()
+        markup.row(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel_generation"))
+        status = self.bot.send_message(chat_id, f"⏳ {status_text}", reply_markup=markup)
+
+        def on_error(e):
+            logging.error(f"Ошибка при генерации: {e}")
+            self.bot.edit_message_text(error_text, chat_id, status.message_id)
+
+        job = self.ai_jobs.submit(
+            message.from_user.id,
+            chat_id,
+            lambda job: generate(status.message_id, job.cancelled),
+            lambda result: on_result(result, status.message_id),
+            on_error
+        )
+        if job is None:
+            self.bot.edit_message_text(
+                "Слишком много запросов на генерацию. Дождитесь результата предыдущего или попробуйте позже.",
+                chat_id,
+                status.message_id
+            )
 
-        if user_id in self.user_data:
-            del self.user_data[user_id]
+    def stream_to_message(self, chat_id: int, message_id: int, header: str, chunks, cancelled) -> str:
+        """Собирает потоковый ответ модели, периодически показывая текст в сообщении о статусе.
 
-    def process_add_wish(self, message):
-        """Обрабатывает ручной ввод поздравления"""
-        user_id = message.from_user.id
-        data = self.user_data.get(user_id, {})
+        Сообщение редактируется не чаще раза в AI_STREAM_EDIT_INTERVAL секунд,
+        чтобы не упираться в лимиты Telegram на редактирование.
+        """
+        markup = types.InlineKeyboardMarkup()
+        markup.row(types.InlineKeyboardButton("❌ Отменить", callback_data="cancel_generation"))
+        text = ''
+        shown = ''
+        last_edit = time.monotonic()
+        for chunk in chunks:
+            if cancelled.is_set():
+                break
+            text += chunk
+            if time.monotonic() - last_edit < settings.AI_STREAM_EDIT_INTERVAL or text == shown:
+                continue
+            try:
+                self.bot.edit_message_text(f"{header}\n\n{text[-3900:]} ▌", chat_id, message_id, reply_markup=markup)
+                shown = text
+            except Exception as e:
+                logging.error(f"Ошибка при обновлении сообщения с генерацией: {e}")
+            last_edit = time.monotonic()
+        return text.strip()
 
-        if self.db.update_event(message.chat.id, data['name'], wishes=message.text, event_type='birthday'):
-            self.bot.send_message(message.chat.id, "Поздравление успешно добавлено!")
+    def process_add_gift(self, message, state):
+        """Обрабатывает ручной ввод идей подарков"""
+        self.states.pop(message.from_user.id)
+        if self.db.update_event_by_id(message.chat.id, state['event_id'], gifts=message.text, event_type='birthday'):
+            self.send_message(message.chat.id, "Идеи подарков успешно добавлены!")
         else:
-            self.bot.send_message(message.chat.id, "Ошибка при добавлении поздравления.")
+            self.send_message(message.chat.id, "Ошибка при добавлении идей подарков.")
 
-        if user_id in self.user_data:
-            del self.user_data[user_id]
+    def process_add_wish(self, message, state):
+        """Обрабатывает ручной ввод поздравления"""
+        self.states.pop(message.from_user.id)
+        if self.db.update_event_by_id(message.chat.id, state['event_id'], wishes=message.text, event_type='birthday'):
+            self.send_message(message.chat.id, "Поздравление успешно добавлено!")
+        else:
+            self.send_message(message.chat.id, "Ошибка при добавлении поздравления.")
 
-    def delete_event_confirm(self, call, event_type='birthday'):
+    def delete_event_confirm(self, call, event_type='birthday', event_id=0):
         """Показывает подтверждение удаления события"""
-        name = call.data.replace(f'delete_{event_type}_', '')
+        event = self.find_event(call, event_type, event_id)
+        if not event:
+            return
         event_name = "день рождения" if event_type == 'birthday' else "праздник"
 
         markup = types.InlineKeyboardMarkup()
         markup.row(
-            types.InlineKeyboardButton("✅ Да", callback_data=f"confirm_delete_{event_type}_{name}"),
-            types.InlineKeyboardButton("❌ Нет", callback_data=f"{event_type}_{name}")
+            types.InlineKeyboardButton("✅ Да", callback_data=encode_callback('confirm_delete', event_type, event_id)),
+            types.InlineKeyboardButton("❌ Нет", callback_data=encode_callback('profile', event_type, event_id))
         )
 
         self.bot.edit_message_text(
-            f"Вы уверены, что хотите удалить {event_name} {name}?",
+            f"Вы уверены, что хотите удалить {event_name} {event['name']}?",
             call.message.chat.id,
             call.message.message_id,
             reply_markup=markup
         )
 
-    def delete_event_execute(self, call, event_type='birthday'):
+    def delete_event_execute(self, call, event_type='birthday', event_id=0):
         """Выполняет удаление события"""
-        name = call.data.replace(f'confirm_delete_{event_type}_', '')
-        if self.db.delete_event(call.message.chat.id, name, event_type):
+        if self.db.delete_event_by_id(call.message.chat.id, event_id, event_type):
             self.bot.answer_callback_query(call.id, "Удалено")
             self.back_to_event_list(call, event_type)
         else:
             self.bot.answer_callback_query(call.id, "Ошибка при удалении")
 
+    def find_event(self, call, event_type: str, event_id: int) -> Optional[Dict]:
+        """Загружает событие по id из кнопки; если его уже нет, сообщает об этом пользователю"""
+        event = self.db.get_event_by_id(call.message.chat.id, event_id, event_type)
+        if not event:
+            self.bot.answer_callback_query(call.id, "Событие не найдено")
+        return event
+
     def back_to_event_list(self, call, event_type='birthday'):
         """Возвращает к списку событий"""
-        events = self.db.get_all_events(call.message.chat.id, event_type)
-        event_name = "дней рождения" if event_type == 'birthday' else "праздников"
-
-        if not events:
+        page = self.event_list_page(call.message.chat.id, event_type, 0)
+        if not page:
+            event_name = "дней рождения" if event_type == 'birthday' else "праздников"
             self.bot.answer_callback_query(call.id, f"Нет {event_name}")
             return
 
-        markup = types.InlineKeyboardMarkup()
-        for name in events.keys():
-            markup.add(types.InlineKeyboardButton(name, callback_data=f"{event_type}_{name}"))
-
+        text, markup = page
         try:
-            if event_name == "дней рождения":
-                self.bot.edit_message_text(
-                    f"Выберите день рождения:",
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=markup
-            )
-            else:
-                self.bot.edit_message_text(
-                    f"Выберите праздник:",
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=markup
-            )
+            self.bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
         except Exception as e:
-            print(f"Ошибка при редактировании сообщения: {e}")
+            logging.error(f"Ошибка при редактировании сообщения: {e}")
 
-    def show_event_list(self, message_or_call, event_type='birthday'):
-        """Показывает список событий (дней рождения/праздников)"""
+    def show_event_list(self, message_or_call, event_type='birthday', page_number=0):
+        """Показывает страницу списка событий (дней рождения/праздников)"""
         if isinstance(message_or_call, types.Message):
             chat_id = message_or_call.chat.id
         else:
             chat_id = message_or_call.message.chat.id
 
-        events = self.db.get_all_events(chat_id, event_type)
-        event_name = "дней рождения" if event_type == 'birthday' else "праздников"
-
-        if not events:
-            if isinstance(message_or_call, types.Message):
-                self.bot.send_message(chat_id, f"У вас пока нет добавленных {event_name}.")
-            else:
-                self.bot.edit_message_text(
-                    f"У вас пока нет добавленных {event_name}.",
-                    chat_id,
-                    message_or_call.message.message_id
-                )
-            return
-
-        markup = types.InlineKeyboardMarkup()
-        for name in events.keys():
-            markup.add(types.InlineKeyboardButton(name, callback_data=f"{event_type}_{name}"))
+        page = self.event_list_page(chat_id, event_type, page_number)
+        if page:
+            text, markup = page
+        else:
+            event_name = "дней рождения" if event_type == 'birthday' else "праздников"
+            text, markup = f"У вас пока нет добавленных {event_name}.", None
 
-        if event_type == 'birthday':
-            if isinstance(message_or_call, types.Message):
-                self.bot.send_message(chat_id, f"Выберите день рождения:", reply_markup=markup)
-            else:
-                self.bot.edit_message_text(
-                    f"Выберите день рождения:",
-                    chat_id,
-                    message_or_call.message.message_id,
-                    reply_markup=markup
-                )
+        if isinstance(message_or_call, types.Message):
+            self.bot.send_message(chat_id, text, reply_markup=markup)
         else:
-            if isinstance(message_or_call, types.Message):
-                self.bot.send_message(chat_id, f"Выберите праздник:", reply_markup=markup)
-            else:
-                self.bot.edit_message_text(
-                    f"Выберите праздник:",
-                    chat_id,
-                    message_or_call.message.message_id,
-                    reply_markup=markup
-                )
+            self.bot.edit_message_text(text, chat_id, message_or_call.message.message_id, reply_markup=markup)
+
+    def show_event_list_page(self, call, event_type: str, page_number: int):
+        """Переключает страницу списка событий"""
+        self.bot.answer_callback_query(call.id)
+        try:
+            self.show_event_list(call, event_type, page_number)
+        except Exception as e:
+            # Нажатие на номер текущей страницы не меняет сообщение
+            logging.error(f"Ошибка при переключении страницы: {e}")
+
+    def event_list_page(self, chat_id: int, event_type: str, page_number: int):
+        """Текст и клавиатура одной страницы списка событий; None, если событий нет.
+
+        Из базы загружается только видимая страница, дата для кнопки берётся из
+        ключа "ММ-ДД" без разбора полной даты.
+        """
+        page_size = settings.EVENTS_PAGE_SIZE
+        events, total = self.db.get_events_page(
+            chat_id, event_type, datetime.date.today(), page_number * page_size, page_size
+        )
+        if not total:
+            return None
+        pages = (total + page_size - 1) // page_size
+        if not events and page_number > 0:
+            return self.event_list_page(chat_id, event_type, pages - 1)
 
-    def show_event_profile(self, call, event_type='birthday'):
+        markup = types.InlineKeyboardMarkup()
+        for event_id, name, month_day in events:
+            month, day = month_day.split('-')
+            markup.add(types.InlineKeyboardButton(
+                f"{name} ({day}.{month})", callback_data=encode_callback('profile', event_type, event_id)))
+
+        if pages > 1:
+            navigation = []
+            if page_number > 0:
+                navigation.append(types.InlineKeyboardButton(
+                    "⬅️", callback_data=encode_callback('page', event_type, page_number - 1)))
+            navigation.append(types.InlineKeyboardButton(
+                f"{page_number + 1}/{pages}", callback_data=encode_callback('page', event_type, page_number)))
+            if page_number < pages - 1:
+                navigation.append(types.InlineKeyboardButton(
+                    "➡️", callback_data=encode_callback('page', event_type, page_number + 1)))
+            markup.row(*navigation)
+
+        text = "Выберите день рождения:" if event_type == 'birthday' else "Выберите праздник:"
+        return text, markup
+
+    def show_event_profile(self, call, event_type='birthday', event_id=0):
         """Показывает профиль события с детальной информацией"""
-        name = call.data.replace(f'{event_type}_', '')
-        profile = self.db.get_event(call.message.chat.id, name, event_type)
+        profile = self.db.get_event_by_id(call.message.chat.id, event_id, event_type)
         event_name = "дня рождения" if event_type == 'birthday' else "праздника"
 
         if not profile:
@@ -906,19 +1180,22 @@ https://t.me/holidaysarewaiting
 
         markup = types.InlineKeyboardMarkup()
         markup.row(
-            types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_{event_type}_{name}"),
-            types.InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_{event_type}_{name}")
+            types.InlineKeyboardButton("✏️ Редактировать", callback_data=encode_callback('edit', event_type, event_id)),
+            types.InlineKeyboardButton("🗑️ Удалить", callback_data=encode_callback('delete', event_type, event_id))
         )
         markup.row(
-            types.InlineKeyboardButton("📝 Добавить заметку", callback_data=f"add_note_{event_type}_{name}"),
+            types.InlineKeyboardButton("📝 Добавить заметку",
+                                       callback_data=encode_callback('add_note', event_type, event_id)),
         )
         if event_type == 'birthday':
             markup.row(
-                types.InlineKeyboardButton("💝 Добавить поздравление", callback_data=f"add_wish_{event_type}_{name}"),
-                types.InlineKeyboardButton("🎁 Добавить подарок", callback_data=f"add_gift_{event_type}_{name}")
+                types.InlineKeyboardButton("💝 Добавить поздравление",
+                                           callback_data=encode_callback('add_wish', event_type, event_id)),
+                types.InlineKeyboardButton("🎁 Добавить подарок",
+                                           callback_data=encode_callback('add_gift', event_type, event_id))
             )
 
-        markup.row(types.InlineKeyboardButton("🔙 Назад", callback_data=f"back_to_{event_type}_list"))
+        markup.row(types.InlineKeyboardButton("🔙 Назад", callback_data=encode_callback('list', event_type)))
 
         try:
             self.bot.edit_message_text(
@@ -929,7 +1206,7 @@ https://t.me/holidaysarewaiting
                 parse_mode='HTML'
             )
         except Exception as e:
-            print(f"Ошибка при отправке сообщения: {e}")
+            logging.error(f"Ошибка при отправке сообщения: {e}")
             plain_text = f"Профиль {event_name}\n\n"
             plain_text += f"Имя: {profile['name']}\n"
             plain_text += f"Дата: {profile['date'].strftime('%d.%m')}\n"
@@ -0,0 +1,149 @@
+import functools
+import time
+from typing import Callable, Dict, List, Optional
+from telebot import TeleBot, types
+from src.logging_config import correlation
+from src.services.metrics_services import HANDLER_ERRORS, HANDLER_SECONDS, metrics
+from src.services.profiling_services import profiler
+
+Handler = Callable[..., None]
+
+
+class Router:
+    """Маршрутизация сообщений и нажатий кнопок по таблицам вместо цепочки предикатов telebot.
+
+    Текст кнопок меню и команды ищутся в словаре за O(1). Для callback_data
+    сначала проверяется точное совпадение, затем самый длинный
+    зарегистрированный префикс, поэтому порядок регистрации не важен и
+    "birthday_" не перехватит "back_to_birthday_list". Сообщение без маршрута
+    (ответ на вопрос бота) передаётся обработчику fallback_message. В telebot
+    регистрируется по одному обработчику на сообщения и на callback-запросы.
+    """
+
+    def __init__(self):
+        self.commands: Dict[str, Handler] = {}
+        self.texts: Dict[str, Handler] = {}
+        self.callbacks: Dict[str, Handler] = {}
+        self.callback_prefixes: Dict[str, Handler] = {}
+        self.prefix_lengths: List[int] = []
+        self.fallback_callback: Optional[Handler] = None
+        self.unrouted_message: Optional[Handler] = None
+        self.before_message: Optional[Handler] = None
+        self.document_handler: Optional[Handler] = None
+
+    def command(self, name: str):
+        """Декоратор обработчика команды /name"""
+        def decorator(handler: Handler) -> Handler:
+            self.commands[name] = self.instrument(handler)
+            return handler
+        return decorator
+
+    def message(self, text: str):
+        """Декоратор обработчика сообщения с точным текстом (кнопки меню)"""
+        def decorator(handler: Handler) -> Handler:
+            self.texts[text] = self.instrument(handler)
+            return handler
+        return decorator
+
+    def callback(self, data: str):
+        """Декоратор обработчика callback_data, совпадающей с data"""
+        def decorator(handler: Handler) -> Handler:
+            self.callbacks[data] = self.instrument(handler)
+            return handler
+        return decorator
+
+    def callback_prefix(self, prefix: str):
+        """Декоратор обработчика callback_data, начинающейся с prefix"""
+        def decorator(handler: Handler) -> Handler:
+            self.callback_prefixes[prefix] = self.instrument(handler)
+            self.prefix_lengths = sorted({len(p) for p in self.callback_prefixes}, reverse=True)
+            return handler
+        return decorator
+
+    def fallback(self, handler: Handler) -> Handler:
+        """Декоратор обработчика callback_data, для которой нет маршрута"""
+        self.fallback_callback = self.instrument(handler)
+        return handler
+
+    def fallback_message(self, handler: Handler) -> Handler:
+        """Декоратор обработчика сообщения, для которого нет маршрута"""
+        self.unrouted_message = self.instrument(handler)
+        return handler
+
+    def before_routed_message(self, handler: Handler) -> Handler:
+        """Декоратор обработчика, вызываемого перед командой или кнопкой меню"""
+        self.before_message = handler
+        return handler
+
+    def document(self, handler: Handler) -> Handler:
+        """Декоратор обработчика присланных файлов"""
+        self.document_handler = self.instrument(handler)
+        return handler
+
+    @staticmethod
+    def instrument(handler: Handler) -> Handler:
+        """Учитывает время и ошибки обработчика в метриках и профилировщике; без них возвращает его как есть"""
+        handler = profiler.trace(handler)
+        if not metrics.enabled:
+            return handler
+        route = handler.__name__
+
+        @functools.wraps(handler)
+        def wrapper(update):
+            started = time.perf_counter()
+            try:
+                return handler(update)
+            except Exception:
+                HANDLER_ERRORS.inc(route=route)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, route=route)
+        return wrapper
+
+    def resolve_message(self, message: types.Message) -> Optional[Handler]:
+        text = message.text
+        if not text:
+            return None
+        if text.startswith('/'):
+            command = text.split(maxsplit=1)[0][1:].split('@', 1)[0]
+            return self.commands.get(command)
+        return self.texts.get(text)
+
+    def resolve_callback(self, call: types.CallbackQuery) -> Optional[Handler]:
+        data = call.data or ''
+        handler = self.callbacks.get(data)
+        if handler is not None:
+            return handler
+        for length in self.prefix_lengths:
+            handler = self.callback_prefixes.get(data[:length])
+            if handler is not None:
+                return handler
+        return self.fallback_callback
+
+    def dispatch_message(self, message: types.Message):
+        with correlation(message.chat.id, f"{message.chat.id}:{message.message_id}"):
+            handler = self.resolve_message(message)
+            if handler is None:
+                handler = self.unrouted_message
+            elif self.before_message is not None:
+                self.before_message(message)
+            if handler is not None:
+                handler(message)
+
+    def dispatch_callback(self, call: types.CallbackQuery):
+        chat_id = call.message.chat.id if call.message else None
+        with correlation(chat_id, f"{chat_id}:cb{call.id}"):
+            handler = self.resolve_callback(call)
+            if handler is not None:
+                handler(call)
+
+    def dispatch_document(self, message: types.Message):
+        with correlation(message.chat.id, f"{message.chat.id}:{message.message_id}"):
+            self.document_handler(message)
+
+    def register(self, bot: TeleBot):
+        """Регистрирует в боте единственные обработчики сообщений и callback-запросов"""
+        bot.register_message_handler(self.dispatch_message, func=lambda message: True)
+        bot.register_callback_query_handler(self.dispatch_callback, func=lambda call: True)
+        if self.document_handler is not None:
+            bot.register_message_handler(self.dispatch_document, content_types=['document'])
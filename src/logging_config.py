@@ -1,16 +1,174 @@
+import atexit
+import contextlib
+import contextvars
+import copy
+import datetime
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import threading
+from typing import Dict, Optional
 
 from src.config import settings
+from src.services.metrics_services import LOG_DROPPED
 
+# Контекст обновления, которое сейчас обрабатывается: chat_id и correlation_id
+log_context: contextvars.ContextVar[Dict] = contextvars.ContextVar('log_context', default={})
 
-def setup_logging():
-    """Настройка логирования."""
+# Стандартные атрибуты LogRecord; всё остальное - поля из extra
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+@contextlib.contextmanager
+def correlation(chat_id: Optional[int], correlation_id: str):
+    """Помечает записи журнала внутри блока чатом и идентификатором обновления"""
+    token = log_context.set({'chat_id': chat_id, 'correlation_id': correlation_id})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи chat_id и correlation_id из контекста и прореживает DEBUG.
+
+    Работает в потоке, который пишет в журнал, поэтому контекст ещё доступен.
+    Из записей уровня DEBUG остаётся доля sample_rate.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.INFO and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        context = log_context.get()
+        record.chat_id = context.get('chat_id')
+        record.correlation_id = context.get('correlation_id')
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не ждёт.
+
+    Отброшенные записи учитываются в метрике bot_log_dropped_total и в счётчике
+    dropped, о котором LogListener пишет в журнал, когда очередь освободится.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+            LOG_DROPPED.inc()
+
+    def take_dropped(self) -> int:
+        """Число отброшенных записей с прошлого вызова"""
+        with self.dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы и исключение превращаются в текст здесь: объекты могут измениться,
+        # пока запись ждёт в очереди. Форматирование строки - в потоке QueueListener.
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogListener(logging.handlers.QueueListener):
+    """QueueListener, который можно останавливать повторно (вручную и при выходе).
+
+    Перед очередной записью сообщает, сколько записей было отброшено с прошлого раза.
+    """
+
+    def __init__(self, log_queue: queue.Queue, queue_handler: Optional[NonBlockingQueueHandler], *handlers,
+                 respect_handler_level: bool = False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.queue_handler = queue_handler
+
+    def handle(self, record: logging.LogRecord):
+        dropped = self.queue_handler.take_dropped() if self.queue_handler is not None else 0
+        if dropped:
+            warning = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                        f"Очередь журнала была переполнена, отброшено записей: {dropped}", None, None)
+            super().handle(warning)
+        super().handle(record)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON с временем, уровнем, логгером, сообщением, контекстом и полями extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат с chat_id и correlation_id, если они есть"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, 'correlation_id', None):
+            text += f" [chat={record.chat_id} id={record.correlation_id}]"
+        return text
+
+
+def setup_logging() -> LogListener:
+    """Настройка логирования.
+
+    Обработчики потоков только кладут запись в ограниченную очередь; вывод
+    выполняет отдельный поток QueueListener. При переполнении очереди записи
+    отбрасываются, поэтому журнал не задерживает обработку обновлений.
+    """
     log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.StreamHandler(),
-        ],
-    )
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if settings.LOG_FORMAT == 'json' else TextFormatter())
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(settings.LOG_DEBUG_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(log_level)
+
+    listener = LogListener(log_queue, handler, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
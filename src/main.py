@@ -1,25 +1,50 @@
+import logging
+import signal
 from telebot import TeleBot
 from src.config import settings
 from src.database.database import Database
 from src.services.api_services import AIService
+from src.services.dispatcher_services import MessageDispatcher
+from src.services.job_services import AIJobExecutor
+from src.services.metrics_services import MetricsServer, metrics
+from src.services.profiling_services import profiler
 from src.services.reminder_services import ReminderService
+from src.services.webhook_services import WebhookServer
 from src.handlers.handlers import Handlers
 from src.logging_config import setup_logging
 
 
 class BirthdayBot:
     def __init__(self):
-        self.bot = TeleBot(settings.TELEGRAM_TOKEN)
+        # В режиме вебхука обработчики выполняются в воркерах WebhookServer
+        self.bot = TeleBot(settings.TELEGRAM_TOKEN, threaded=settings.BOT_MODE != 'webhook')
         self.db = Database()
         self.ai_service = AIService()
-        self.reminder_service = ReminderService(self.bot, self.db)
-        self.handlers = Handlers(self.bot, self.db, self.ai_service)
+        self.dispatcher = MessageDispatcher(self.bot)
+        self.ai_jobs = AIJobExecutor(self.bot)
+        self.reminder_service = ReminderService(self.bot, self.db, self.dispatcher, self.ai_service)
+        self.handlers = Handlers(self.bot, self.db, self.ai_service, self.ai_jobs)
 
     def run(self):
         self.handlers.setup_handlers()
+        if metrics.enabled:
+            MetricsServer().start()
+        if profiler.enabled and hasattr(signal, 'SIGUSR1'):
+            # kill -USR1 <pid> запускает профилирование на PROFILE_SECONDS
+            signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.start())
+        self.dispatcher.start()
         self.reminder_service.start()
-        print("Бот запущен...")
-        self.bot.polling(none_stop=True, interval=0)
+        logging.info("Бот запущен")
+        if settings.BOT_MODE == 'webhook':
+            self.run_webhook()
+        else:
+            self.bot.polling(none_stop=True, interval=0)
+
+    def run_webhook(self):
+        """Регистрирует вебхук в Telegram и запускает встроенный HTTP-сервер"""
+        self.bot.remove_webhook()
+        self.bot.set_webhook(url=settings.WEBHOOK_URL, secret_token=settings.WEBHOOK_SECRET or None)
+        WebhookServer(self.bot).serve_forever()
 
 def start():
     """Точка входа в приложение"""
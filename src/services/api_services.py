@@ -1,77 +1,448 @@
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 from src.config import settings
+from src.services.metrics_services import AI_CACHE, AI_FALLBACKS, AI_SECONDS, AI_TOKENS
+
+
+class CircuitOpenError(Exception):
+    """API модели недоступно, запрос не отправлялся"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после серии ошибок перестаёт пускать запросы на reset_timeout секунд.
+
+    По истечении таймаута пропускается один пробный запрос; успех замыкает цепь,
+    ошибка снова размыкает её.
+    """
+
+    def __init__(self, threshold: int = None, reset_timeout: float = None):
+        self.threshold = threshold or settings.AI_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout if reset_timeout is not None else settings.AI_BREAKER_RESET
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    logging.warning(f"API модели недоступно, запросы приостановлены на {self.reset_timeout} с")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+class ResponseCache:
+    """LRU-кэш ответов модели с TTL и необязательным постоянным уровнем в SQLite.
+
+    Сначала проверяется память, при промахе - SQLite (если задан path);
+    найденное в SQLite значение поднимается в память.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None, path: str = None):
+        self.max_size = max_size or settings.AI_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else settings.AI_CACHE_TTL
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'persistent_hits': 0}
+
+        path = path if path is not None else settings.AI_CACHE_PATH
+        self.conn = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS ai_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    created_at REAL
+                )''')
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, temperature: float) -> str:
+        """Ключ кэша: нормализованный промпт, модель и температура"""
+        normalized = ' '.join(prompt.lower().split())
+        raw = json.dumps([normalized, model, temperature], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            if entry:
+                del self.entries[key]
+
+            if self.conn:
+                row = self.conn.execute(
+                    'SELECT value, created_at FROM ai_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row and now - row[1] < self.ttl:
+                    self._remember(key, row[0], row[1])
+                    self.stats['hits'] += 1
+                    self.stats['persistent_hits'] += 1
+                    return row[0]
+
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self.lock:
+            self._remember(key, value, now)
+            if self.conn:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO ai_cache (key, value, created_at) VALUES (?, ?, ?)',
+                    (key, value, now)
+                )
+                self.conn.execute('DELETE FROM ai_cache WHERE created_at < ?', (now - self.ttl,))
+                self.conn.commit()
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.stats, size=len(self.entries))
+
+    def _remember(self, key: str, value: str, created_at: float):
+        self.entries[key] = (value, created_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class ThinkFilter:
+    """Отбрасывает блок рассуждений R1 из потока частей ответа.
+
+    Как и split('</think>')[-1] для полного ответа: всё до закрывающего тега
+    считается рассуждением. Если тега в ответе нет, текст отдаётся целиком
+    в конце потока.
+    """
+
+    TAG = '</think>'
+
+    def __init__(self):
+        self.buffer = ''
+        self.passed = False
+
+    def feed(self, chunk: str) -> str:
+        """Принимает очередную часть ответа и возвращает видимый пользователю текст"""
+        if self.passed:
+            return chunk
+        self.buffer += chunk
+        if self.TAG not in self.buffer:
+            return ''
+        self.passed = True
+        visible = self.buffer.split(self.TAG)[-1].lstrip()
+        self.buffer = ''
+        return visible
+
+    def flush(self) -> str:
+        """Возвращает остаток, если закрывающий тег так и не встретился"""
+        if self.passed:
+            return ''
+        visible = self.buffer.replace('<think>', '').strip()
+        self.buffer = ''
+        return visible
 
 
 class AIService:
     """Генерирует идеи подарков на основе имени и информации о человеке, используя API"""
+
+    MODEL = "deepseek-ai/DeepSeek-R1"
+    TEMPERATURE = 0.7
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, cache: Optional[ResponseCache] = None, session: Optional[requests.Session] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        """cache - любой объект с методами get/set; по умолчанию ResponseCache из настроек"""
+        self.cache = cache if cache is not None else ResponseCache()
+        self.breaker = breaker or CircuitBreaker()
+        self.session = session or self.make_session()
+
     @staticmethod
-    def generate_gift_ideas(name: str, info: str) -> str:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.API_KEY}"
-        }
+    def make_session() -> requests.Session:
+        """Общая сессия с пулом keep-alive соединений к API модели"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.AI_POOL_SIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
+    @staticmethod
+    def gift_prompt(name: str, info: str) -> Tuple[str, str]:
         prompt = f"Не задавай вопросов, выведи только идеи подарков. Придумай 5 оригинальных идей подарков на день рождения для {name}." \
                  f"Учти следующую информацию: {info}. " \
                  f"Сделай текст не слишком длинным, перечисли идеи списком."
+        return "Ты помогаешь с выбором подарков.", prompt
 
-        data = {
-            "model": "deepseek-ai/DeepSeek-R1",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "Ты помогаешь с выбором подарков."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
+    @staticmethod
+    def congratulation_prompt(name: str, info: str) -> Tuple[str, str]:
+        prompt = f"Не задавай вопросов, выведи только поздравление. Придумай оригинальное и теплое поздравление с днем рождения для {name}. Информация о человеке: {info}. " \
+                 f"Сделай текст не слишком длинным (4-5 предложений)."
+        return "Ты пишешь поздравления.", prompt
 
+    def generate_gift_ideas(self, name: str, info: str, use_cache: bool = True) -> str:
         try:
-            response = requests.post(settings.API_URL, headers=headers, json=data)
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].split('</think>')[-1].strip()
+            result = self.complete(*self.gift_prompt(name, info), use_cache)
+            if result is not None:
+                return result
+            AI_FALLBACKS.inc(reason='status')
             return f"Идеи подарков для {name}: книга, подарочный сертификат, цветы"
-        except Exception:
+        except Exception as e:
+            AI_FALLBACKS.inc(reason=self.fallback_reason(e))
             return f"Идеи подарков для {name}: парфюм, билеты на мероприятие, гаджет"
 
-    @staticmethod
-    def generate_congratulation(name: str, info: str) -> str:
+    def generate_congratulation(self, name: str, info: str, use_cache: bool = True) -> str:
         """Генерирует поздравление с днем рождения"""
-        headers = {
+        try:
+            result = self.complete(*self.congratulation_prompt(name, info), use_cache)
+            if result is not None:
+                return result
+            AI_FALLBACKS.inc(reason='status')
+            return f"Дорогой(ая) {name}! От всей души поздравляю с Днём рождения! 🎉"
+        except Exception as e:
+            AI_FALLBACKS.inc(reason=self.fallback_reason(e))
+            return f"Дорогой(ая) {name}! Сердечно поздравляю с Днём рождения! 🌟"
+
+    def stream_gift_ideas(self, name: str, info: str, use_cache: bool = True) -> Iterator[str]:
+        """Потоковый вариант generate_gift_ideas: отдаёт видимый текст частями"""
+        yield from self.stream_with_fallback(
+            *self.gift_prompt(name, info), use_cache,
+            f"Идеи подарков для {name}: книга, подарочный сертификат, цветы",
+            f"Идеи подарков для {name}: парфюм, билеты на мероприятие, гаджет"
+        )
+
+    def stream_congratulation(self, name: str, info: str, use_cache: bool = True) -> Iterator[str]:
+        """Потоковый вариант generate_congratulation"""
+        yield from self.stream_with_fallback(
+            *self.congratulation_prompt(name, info), use_cache,
+            f"Дорогой(ая) {name}! От всей души поздравляю с Днём рождения! 🎉",
+            f"Дорогой(ая) {name}! Сердечно поздравляю с Днём рождения! 🌟"
+        )
+
+    def stream_with_fallback(self, system: str, prompt: str, use_cache: bool,
+                             status_fallback: str, error_fallback: str) -> Iterator[str]:
+        """Отдаёт запасной текст, если модель не вернула ни одной видимой части"""
+        emitted = False
+        try:
+            for chunk in self.stream_complete(system, prompt, use_cache):
+                emitted = emitted or bool(chunk)
+                yield chunk
+            if not emitted:
+                AI_FALLBACKS.inc(reason='status')
+                yield status_fallback
+        except Exception as e:
+            if not emitted:
+                AI_FALLBACKS.inc(reason=self.fallback_reason(e))
+                yield error_fallback
+            else:
+                logging.error(f"Поток ответа модели прервался: {e}")
+
+    @staticmethod
+    def fallback_reason(error: Exception) -> str:
+        return 'circuit_open' if isinstance(error, CircuitOpenError) else 'error'
+
+    def complete(self, system: str, prompt: str, use_cache: bool = True) -> Optional[str]:
+        """Запрашивает ответ модели и возвращает текст без блока рассуждений.
+
+        При ошибочном статусе ответа возвращает None. use_cache=False пропускает
+        чтение из кэша (кнопка "Сгенерировать другие"), но свежий ответ всё равно
+        сохраняется в кэш.
+        """
+        key = ResponseCache.make_key(f"{system}\n{prompt}", self.MODEL, self.TEMPERATURE)
+        if use_cache:
+            cached = self.cache.get(key)
+            AI_CACHE.inc(result='miss' if cached is None else 'hit')
+            if cached is not None:
+                return cached
+
+        response = self.timed_post('complete', self.make_headers(), self.make_request(system, prompt))
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        self.count_tokens(result.get('usage'))
+        text = result['choices'][0]['message']['content'].split('</think>')[-1].strip()
+        self.cache.set(key, text)
+        return text
+
+    def stream_complete(self, system: str, prompt: str, use_cache: bool = True) -> Iterator[str]:
+        """Запрашивает ответ модели в режиме stream и отдаёт видимый текст по мере поступления.
+
+        Ответ разбирается как server-sent events в формате OpenAI; блок рассуждений
+        отбрасывается ThinkFilter, а вместо него отдаются пустые строки. Полный
+        текст по окончании сохраняется в кэш.
+        """
+        key = ResponseCache.make_key(f"{system}\n{prompt}", self.MODEL, self.TEMPERATURE)
+        if use_cache:
+            cached = self.cache.get(key)
+            AI_CACHE.inc(result='miss' if cached is None else 'hit')
+            if cached is not None:
+                yield cached
+                return
+
+        response = self.timed_post('stream', self.make_headers(), self.make_request(system, prompt, stream=True),
+                                   stream=True)
+        if response.status_code != 200:
+            response.close()
+            if response.status_code not in self.RETRY_STATUSES:
+                self.breaker.record_success()
+            return
+
+        think_filter = ThinkFilter()
+        parts = []
+        # Исход запроса для размыкателя известен только после чтения всего потока
+        try:
+            with response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    chunk = json.loads(payload)
+                    # Последний фрагмент может содержать только расход токенов
+                    self.count_tokens(chunk.get('usage'))
+                    if not chunk.get('choices'):
+                        continue
+                    delta = chunk['choices'][0].get('delta', {})
+                    if delta.get('reasoning_content'):
+                        # Провайдер отдаёт рассуждения отдельным полем, content уже чистый
+                        think_filter.passed = True
+                    visible = think_filter.feed(delta.get('content') or '')
+                    if visible:
+                        parts.append(visible)
+                    # Пока модель рассуждает, отдаётся пустая строка: получатель проверяет отмену
+                    # и может закрыть поток, не дожидаясь видимого текста
+                    yield visible
+            rest = think_filter.flush()
+            if rest:
+                parts.append(rest)
+                yield rest
+        except GeneratorExit:
+            # Чтение прекратил получатель (отмена генерации), а не API
+            self.breaker.record_success()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+        text = ''.join(parts).strip()
+        if text:
+            self.cache.set(key, text)
+
+    @staticmethod
+    def count_tokens(usage: Optional[Dict]):
+        if usage:
+            AI_TOKENS.inc(usage.get('prompt_tokens') or 0, kind='prompt')
+            AI_TOKENS.inc(usage.get('completion_tokens') or 0, kind='completion')
+
+    def timed_post(self, mode: str, headers: Dict[str, str], data: Dict, stream: bool = False) -> requests.Response:
+        """post с учётом времени до ответа (для потока - до заголовков) в метриках"""
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.post(headers, data, stream=stream)
+            status = str(response.status_code)
+            return response
+        finally:
+            AI_SECONDS.observe(time.perf_counter() - started, mode=mode, status=status)
+
+    @staticmethod
+    def make_headers() -> Dict[str, str]:
+        return {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {settings.API_KEY}"
         }
 
-        prompt = f"Не задавай вопросов, выведи только поздравление. Придумай оригинальное и теплое поздравление с днем рождения для {name}. Информация о человеке: {info}. " \
-                 f"Сделай текст не слишком длинным (4-5 предложений)."
-
+    def make_request(self, system: str, prompt: str, stream: bool = False) -> Dict:
         data = {
-            "model": "deepseek-ai/DeepSeek-R1",
+            "model": self.MODEL,
             "messages": [
                 {
                     "role": "system",
-                    "content": "Ты пишешь поздравления."
+                    "content": system
                 },
                 {
                     "role": "user",
                     "content": prompt
                 }
             ],
-            "temperature": 0.7,
+            "temperature": self.TEMPERATURE,
             "max_tokens": 1000
         }
+        if stream:
+            data["stream"] = True
+        return data
+
+    def post(self, headers: Dict[str, str], data: Dict, stream: bool = False) -> requests.Response:
+        """Отправляет запрос с таймаутами и повторами при 429/5xx и сетевых ошибках.
+
+        Если размыкатель цепи открыт, сразу выбрасывает CircuitOpenError.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("API модели временно недоступно")
 
+        timeout = (settings.AI_CONNECT_TIMEOUT, settings.AI_READ_TIMEOUT)
         try:
-            response = requests.post(settings.API_URL, headers=headers, json=data)
-            if response.status_code == 200:
-                result = response.json()
-                return result['choices'][0]['message']['content'].split('</think>')[-1].strip()
-            return f"Дорогой(ая) {name}! От всей души поздравляю с Днём рождения! 🎉"
+            for attempt in range(settings.AI_MAX_RETRIES + 1):
+                last_attempt = attempt == settings.AI_MAX_RETRIES
+                try:
+                    response = self.session.post(settings.API_URL, headers=headers, json=data,
+                                                 timeout=timeout, stream=stream)
+                except (requests.ConnectionError, requests.Timeout):
+                    if last_attempt:
+                        raise
+                    time.sleep(self.backoff(attempt))
+                    continue
+
+                if response.status_code in self.RETRY_STATUSES and not last_attempt:
+                    response.close()
+                    time.sleep(self.backoff(attempt, response.headers.get('Retry-After')))
+                    continue
+                break
         except Exception:
-            return f"Дорогой(ая) {name}! Сердечно поздравляю с Днём рождения! 🌟"
\ No newline at end of file
+            # Любая ошибка, в том числе пробного запроса, должна быть учтена, иначе цепь не замкнётся
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code in self.RETRY_STATUSES:
+            self.breaker.record_failure()
+        elif not stream:
+            # Успех потокового запроса отмечает stream_complete, дочитав ответ
+            self.breaker.record_success()
+        return response
+
+    @staticmethod
+    def backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+        """Экспоненциальная задержка с полным джиттером, не больше AI_BACKOFF_MAX"""
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), settings.AI_BACKOFF_MAX)
+        return random.uniform(0, min(settings.AI_BACKOFF_MAX, settings.AI_BACKOFF_BASE * 2 ** attempt))
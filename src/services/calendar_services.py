@@ -0,0 +1,39 @@
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+from src.database.database import Database
+
+
+class HolidayCalendar:
+    """Календарь глобальных праздников, общий для всех чатов.
+
+    Какие праздники выпадают на нужные даты, вычисляется один раз на набор дат
+    (то есть раз в сутки), а не для каждого чата отдельно. Сравниваются только
+    месяц и день, поэтому праздники на стыке годов тоже находятся.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock = threading.Lock()
+        self.key: Optional[Tuple[Tuple[int, datetime.date], ...]] = None
+        self.due: List[Dict] = []
+
+    def get_due(self, dates: Dict[int, datetime.date]) -> List[Dict]:
+        """Возвращает праздники на переданные даты: смещение в днях, название и описание"""
+        key = tuple(sorted(dates.items()))
+        with self.lock:
+            if key != self.key:
+                self.due = self.compute(dates)
+                self.key = key
+            return list(self.due)
+
+    def compute(self, dates: Dict[int, datetime.date]) -> List[Dict]:
+        by_month_day: Dict[Tuple[int, int], List[Tuple[str, str]]] = {}
+        for name, date, desc in self.db.get_global_holidays():
+            by_month_day.setdefault((date.month, date.day), []).append((name, desc))
+
+        due = []
+        for offset, date in sorted(dates.items()):
+            for name, desc in by_month_day.get((date.month, date.day), []):
+                due.append({"offset": offset, "name": name, "description": desc})
+        return due
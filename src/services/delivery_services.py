@@ -0,0 +1,158 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from src.config import settings
+from src.database.database import Database
+from src.services.dispatcher_services import MessageDispatcher
+from src.services.metrics_services import REMINDER_RUN_SECONDS, REMINDER_SENDS
+
+# (chat_id, event_type, event_name, offset)
+DeliveryKey = Tuple[int, str, str, int]
+
+
+class DeliveryIncompleteError(Exception):
+    """Часть напоминаний не отправлена из-за временных ошибок; день нужно повторить"""
+
+
+class DeliveryRun:
+    """Одна рассылка напоминаний за местный день по шарду и слоту чатов.
+
+    Перед отправкой загружает из reminder_deliveries уже доставленные напоминания
+    и пропускает их, поэтому повторный запуск после сбоя продолжает рассылку с
+    места остановки. Результаты отправки копятся и сохраняются пакетами по
+    DELIVERY_BATCH_SIZE строк; статистика запуска пишется в reminder_runs.
+
+    Отказ Telegram, который не исправится повтором (бот заблокирован, чат
+    удалён), записывается как rejected и тоже пропускается. Напоминания с
+    временной ошибкой (failed: сеть, 5xx, 429 после всех повторов очереди)
+    отправятся при повторном запуске за тот же день.
+    """
+
+    def __init__(self, db: Database, day: datetime.date, shard: Optional[Tuple[int, int]] = None,
+                 slot: Optional[Tuple[str, int]] = None, batch_size: int = None):
+        self.db = db
+        self.day = day
+        self.shard = shard
+        self.slot = slot
+        self.batch_size = batch_size or settings.DELIVERY_BATCH_SIZE
+        self.occurrences: Dict[int, datetime.date] = {}
+        self.delivered: set = set()
+        self.rows: List[Tuple] = []
+        self.stats = {'candidates': 0, 'skipped': 0, 'sent': 0, 'failed': 0}
+        self.pending = 0
+        self.retryable = 0
+        self.closed = False
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.started = time.monotonic()
+        self.run_id = db.start_reminder_run(
+            day, f"{shard[0]}/{shard[1]}" if shard else '', f"{slot[0]} {slot[1]:02d}:00" if slot else ''
+        )
+
+    def load(self, offsets: List[int]):
+        """Загружает доставленные напоминания для событий через offsets дней от дня рассылки"""
+        occurrences = {offset: self.day + datetime.timedelta(days=offset)
+                       for offset in offsets if offset not in self.occurrences}
+        if occurrences:
+            self.occurrences.update(occurrences)
+            self.delivered |= self.db.get_delivered(occurrences, self.shard, self.slot)
+
+    def should_send(self, key: DeliveryKey) -> bool:
+        """Учитывает напоминание и сообщает, нужно ли его отправлять"""
+        with self.lock:
+            self.stats['candidates'] += 1
+            if key in self.delivered:
+                self.stats['skipped'] += 1
+                return False
+            self.pending += 1
+        return True
+
+    def track(self, key: DeliveryKey, future: Future):
+        """Записывает результат отправки, когда он станет известен"""
+        future.add_done_callback(lambda done: self.complete(key, self.status(done.exception())))
+
+    def fail(self, key: DeliveryKey):
+        """Отмечает напоминание, которое не удалось даже поставить в очередь"""
+        self.complete(key, 'failed')
+
+    @staticmethod
+    def status(error: Optional[BaseException]) -> str:
+        if error is None:
+            return 'sent'
+        return 'failed' if MessageDispatcher.is_transient(error) else 'rejected'
+
+    def complete(self, key: DeliveryKey, status: str):
+        chat_id, event_type, event_name, offset = key
+        occurrence = self.occurrences.get(offset, self.day + datetime.timedelta(days=offset))
+        row = (occurrence.strftime('%Y-%m-%d'), offset, chat_id, event_type, event_name,
+               status, self.run_id, time.time())
+        with self.lock:
+            self.stats['sent' if status == 'sent' else 'failed'] += 1
+            if status == 'failed':
+                self.retryable += 1
+            else:
+                self.delivered.add(key)
+            self.rows.append(row)
+            self.pending -= 1
+            batch = self.take_rows(len(self.rows) >= self.batch_size)
+            done = self.closed and self.pending == 0
+        self.save(batch)
+        if done:
+            self.finish()
+
+    def take_rows(self, condition: bool) -> List[Tuple]:
+        if not condition:
+            return []
+        rows, self.rows = self.rows, []
+        return rows
+
+    def save(self, rows: List[Tuple]):
+        try:
+            self.db.record_deliveries(rows)
+        except Exception as e:
+            logging.error(f"Не удалось сохранить журнал отправки напоминаний: {e}")
+
+    def close(self, error: Optional[str] = None):
+        """Завершает постановку в очередь; статистика сохранится после последней отправки"""
+        with self.lock:
+            self.closed = True
+            self.error = error
+            done = self.pending == 0
+        if done:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            self.finished.set()
+            batch = self.take_rows(True)
+            stats = dict(self.stats)
+        self.save(batch)
+        status = 'failed' if self.error else 'done'
+        REMINDER_RUN_SECONDS.observe(time.monotonic() - self.started)
+        for result in ('sent', 'failed', 'skipped'):
+            REMINDER_SENDS.inc(stats[result], result=result)
+        try:
+            self.db.finish_reminder_run(self.run_id, status, stats, self.error)
+        except Exception as e:
+            logging.error(f"Не удалось сохранить статистику рассылки {self.run_id}: {e}")
+        logging.info(f"Рассылка {self.run_id} за {self.day}: {status}, {stats}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.finished.wait(timeout)
+
+    def check_complete(self, timeout: float = None):
+        """Ждёт результатов всех отправок и выбрасывает DeliveryIncompleteError, если есть временные ошибки
+        или результаты не пришли за timeout секунд"""
+        timeout = settings.DELIVERY_WAIT_TIMEOUT if timeout is None else timeout
+        if not self.wait(timeout):
+            with self.lock:
+                pending = self.pending
+            raise DeliveryIncompleteError(f"нет результата отправки за {timeout:.0f} с: {pending}")
+        if self.retryable:
+            raise DeliveryIncompleteError(f"не отправлено из-за временных ошибок: {self.retryable}")
@@ -0,0 +1,259 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from src.config import settings
+
+
+class TokenBucket:
+    """Ограничитель скорости "ведро с токенами" с резервированием слотов"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать до его использования"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        """Ведро полностью восстановилось и его можно удалить"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class OutgoingMessage:
+    """Сообщение в очереди на отправку"""
+
+    def __init__(self, chat_id: int, text: str, kwargs: Dict[str, Any], priority: int):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.slot_reserved = False
+        self.future: Future = Future()
+
+
+class MessageDispatcher:
+    """Очередь исходящих сообщений с пулом потоков и соблюдением лимитов Telegram.
+
+    Общий лимит бота и лимит на чат реализованы через TokenBucket. Ответ 429
+    откладывает сообщение на retry_after секунд, временные ошибки повторяются
+    с экспоненциальной задержкой не более max_retries раз.
+    """
+
+    PRIORITY_HIGH = 0
+    PRIORITY_LOW = 1
+
+    # Порог, после которого из памяти удаляются восстановившиеся лимиты чатов
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, bot: TeleBot, workers: int = None, global_rate: float = None,
+                 per_chat_rate: float = None, max_retries: int = None, max_queue: int = None):
+        self.bot = bot
+        self.workers = workers or settings.DISPATCHER_WORKERS
+        self.per_chat_rate = per_chat_rate or settings.DISPATCHER_PER_CHAT_RATE
+        self.max_retries = max_retries if max_retries is not None else settings.DISPATCHER_MAX_RETRIES
+        self.max_queue = max_queue or settings.DISPATCHER_QUEUE_SIZE
+        self.global_bucket = TokenBucket(global_rate or settings.DISPATCHER_GLOBAL_RATE)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+        self.condition = threading.Condition()
+        self.ready: Dict[int, Deque[OutgoingMessage]] = {
+            self.PRIORITY_HIGH: deque(),
+            self.PRIORITY_LOW: deque()
+        }
+        self.delayed: List[Tuple[float, int, OutgoingMessage]] = []
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.running = False
+        self.stopped = False
+        self.threads: List[threading.Thread] = []
+
+        self.stats_lock = threading.Lock()
+        self.stats = {'submitted': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'rate_limited': 0}
+        self.started_at = time.monotonic()
+
+    def start(self):
+        self.running = True
+        self.started_at = time.monotonic()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker, name=f"dispatcher-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Останавливает потоки; Future неотправленных сообщений завершаются ошибкой"""
+        with self.condition:
+            self.running = False
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+        with self.condition:
+            unsent = [message for priority in self.ready for message in self.ready[priority]]
+            unsent += [message for _, _, message in self.delayed]
+            for queue in self.ready.values():
+                queue.clear()
+            self.delayed = []
+            # Сообщения, которые ещё отправляет не успевший остановиться поток, учтёт его _done
+            self.pending -= len(unsent)
+            self.condition.notify_all()
+        for message in unsent:
+            self._count('failed')
+            message.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_LOW, **kwargs) -> Future:
+        """Ставит сообщение в очередь и возвращает Future с результатом отправки.
+
+        Сообщения с низким приоритетом ждут свободного места в очереди, ответы
+        пользователям (PRIORITY_HIGH) принимаются всегда.
+        """
+        message = OutgoingMessage(chat_id, text, kwargs, priority)
+        with self.condition:
+            while priority != self.PRIORITY_HIGH and self.pending >= self.max_queue and self.running:
+                self.condition.wait()
+            if self.stopped:
+                message.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+                return message.future
+            self.ready[priority].append(message)
+            self.pending += 1
+            self.condition.notify_all()
+        self._count('submitted')
+        return message.future
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Ожидает отправки всех сообщений в очереди"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def get_stats(self) -> Dict[str, float]:
+        """Возвращает счётчики, глубину очереди и пропускную способность"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        with self.condition:
+            stats['queue_depth'] = self.pending
+            stats['delayed'] = len(self.delayed)
+        elapsed = time.monotonic() - self.started_at
+        stats['throughput'] = round(stats['sent'] / elapsed, 2) if elapsed > 0 else 0.0
+        return stats
+
+    def worker(self):
+        while True:
+            message = self._take()
+            if message is None:
+                return
+
+            if not message.slot_reserved:
+                delay = self._chat_bucket(message.chat_id).reserve()
+                if delay > 0:
+                    message.slot_reserved = True
+                    self._delay(message, delay)
+                    continue
+            message.slot_reserved = False
+
+            time.sleep(self.global_bucket.reserve())
+            self._send(message)
+
+    def _take(self) -> Optional[OutgoingMessage]:
+        """Забирает следующее готовое к отправке сообщение"""
+        with self.condition:
+            while True:
+                if not self.running:
+                    return None
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, _, message = heapq.heappop(self.delayed)
+                    self.ready[message.priority].append(message)
+                for priority in (self.PRIORITY_HIGH, self.PRIORITY_LOW):
+                    if self.ready[priority]:
+                        return self.ready[priority].popleft()
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                self.condition.wait(timeout)
+
+    def _delay(self, message: OutgoingMessage, delay: float):
+        with self.condition:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.sequence), message))
+            self.condition.notify_all()
+
+    def _done(self):
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify_all()
+
+    def _send(self, message: OutgoingMessage):
+        try:
+            result = self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+        except Exception as e:
+            retry_after = self._retry_after(e)
+            if retry_after is not None:
+                self._count('rate_limited')
+            if message.attempts < self.max_retries and (retry_after is not None or self.is_transient(e)):
+                message.attempts += 1
+                self._count('retried')
+                self._delay(message, retry_after if retry_after is not None else 2 ** message.attempts)
+                return
+            logging.error(f"Не удалось отправить сообщение в чат {message.chat_id}: {e}")
+            self._count('failed')
+            message.future.set_exception(e)
+            self._done()
+            return
+
+        self._count('sent')
+        message.future.set_result(result)
+        self._done()
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        if isinstance(error, ApiTelegramException) and error.error_code == 429:
+            parameters = (error.result_json or {}).get('parameters', {})
+            return float(parameters.get('retry_after', 1))
+        return None
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """Ошибки сети, 429 и 5xx имеет смысл повторить, остальные ответы API - нет"""
+        if isinstance(error, ApiTelegramException):
+            return error.error_code == 429 or error.error_code >= 500
+        return True
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                for idle_chat_id in [c for c, b in list(self.chat_buckets.items()) if b.is_idle()]:
+                    self.chat_buckets.pop(idle_chat_id, None)
+            bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.per_chat_rate))
+        return bucket
+
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.stats[key] += 1
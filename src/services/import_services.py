@@ -0,0 +1,321 @@
+import csv
+import datetime
+import io
+import re
+import tempfile
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+import requests
+from telebot import TeleBot, apihelper
+from src.config import settings
+from src.database.database import Database
+
+# Формат файла -> (расширение, MIME-тип)
+FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'vcard': ('vcf', 'text/vcard'),
+    'ics': ('ics', 'text/calendar'),
+}
+EXTENSIONS = {'csv': 'csv', 'vcf': 'vcard', 'vcard': 'vcard', 'ics': 'ics', 'ical': 'ics'}
+
+# Дата: ДД.ММ[.ГГГГ], ГГГГ-ММ-ДД или ГГГГММДД (с временем iCalendar), --ММДД или --ММ-ДД (vCard без года)
+DAY_FIRST = re.compile(r'(\d{1,2})[./](\d{1,2})(?:[./](\d{4}))?$')
+YEAR_FIRST = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})(?:T[\dZ]*)?$')
+NO_YEAR = re.compile(r'--(\d{2})-?(\d{2})$')
+
+# Файл держится в памяти до этого размера, дальше - во временном файле на диске
+SPOOL_SIZE = 1024 * 1024
+
+
+class FileTooLargeError(Exception):
+    """Присланный файл больше IMPORT_MAX_FILE_SIZE"""
+
+
+class ImportRow(NamedTuple):
+    """Проверенная строка импорта: номер строки в файле, имя, дата и заметка"""
+    line: int
+    name: str
+    date: datetime.date
+    notes: str
+
+
+class ImportReport:
+    """Итог импорта: сколько добавлено, сколько уже было и ошибки по строкам"""
+
+    def __init__(self, max_errors: int = None):
+        self.max_errors = max_errors or settings.IMPORT_MAX_ERRORS
+        self.added = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors: List[Tuple[int, str]] = []
+
+    def error(self, line: int, reason: str):
+        # В отчёт попадают первые max_errors ошибок, остальные только считаются
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, reason))
+
+
+def detect_format(file_name: Optional[str]) -> Optional[str]:
+    """Формат файла по расширению имени; None, если формат не поддерживается"""
+    if not file_name or '.' not in file_name:
+        return None
+    return EXTENSIONS.get(file_name.rsplit('.', 1)[1].lower())
+
+
+def parse_date(text: str) -> datetime.date:
+    """Дата из "ДД.ММ", "ДД.ММ.ГГГГ", "ГГГГ-ММ-ДД", "ГГГГММДД" или "--ММДД" (vCard без года).
+
+    Без года подставляется 2000, как при добавлении события вручную.
+    """
+    # Регулярные выражения вместо strptime: на десятках тысяч строк разница в разы
+    text = text.strip()
+    match = DAY_FIRST.match(text)
+    if match:
+        day, month, year = match.groups()
+        return datetime.date(int(year or 2000), int(month), int(day))
+    match = YEAR_FIRST.match(text)
+    if match:
+        year, month, day = match.groups()
+        return datetime.date(int(year), int(month), int(day))
+    match = NO_YEAR.match(text)
+    if match:
+        month, day = match.groups()
+        return datetime.date(2000, int(month), int(day))
+    raise ValueError(text)
+
+
+def validate(line: int, name: str, date: str, notes: str, report: ImportReport) -> Optional[ImportRow]:
+    name = ' '.join(name.split())
+    if not name:
+        report.error(line, "не указано имя")
+        return None
+    if len(name) > settings.IMPORT_MAX_NAME_LENGTH:
+        report.error(line, "слишком длинное имя")
+        return None
+    if not date.strip():
+        report.error(line, f"не указана дата для {name}")
+        return None
+    try:
+        parsed = parse_date(date)
+    except ValueError:
+        report.error(line, f"неверная дата {date.strip()!r} для {name}")
+        return None
+    return ImportRow(line, name, parsed, notes.strip())
+
+
+def parse_csv(lines: Iterable[str], report: ImportReport) -> Iterator[ImportRow]:
+    """Строки "имя,дата[,заметка]"; строка заголовка с "name"/"имя" пропускается.
+
+    Разделитель (запятая, точка с запятой или табуляция) определяется по первой строке.
+    """
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    delimiter = max(',;\t', key=first.count)
+    reader = csv.reader(_chain(first, lines), delimiter=delimiter)
+    for row in reader:
+        line = reader.line_num
+        if not any(cell.strip() for cell in row):
+            continue
+        if line == 1 and row[0].strip().lower() in ('name', 'имя'):
+            continue
+        if len(row) < 2:
+            report.error(line, "ожидается имя и дата через разделитель")
+            continue
+        parsed = validate(line, row[0], row[1], row[2] if len(row) > 2 else '', report)
+        if parsed:
+            yield parsed
+
+
+def unfold(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Склеивает перенесённые строки vCard/iCalendar (продолжение начинается с пробела).
+
+    Возвращает номер первой строки и логическую строку.
+    """
+    current, start = None, 0
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+
+def unescape(value: str) -> str:
+    return (value.replace('\\n', '\n').replace('\\N', '\n')
+            .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\'))
+
+
+def parse_properties(lines: Iterable[str], begin: str, report: ImportReport,
+                     name_keys: Tuple[str, ...], date_key: str, notes_key: str) -> Iterator[ImportRow]:
+    """Общий разбор vCard и iCalendar: блоки BEGIN:begin ... END:begin со свойствами"""
+    record = None
+    for line, text in unfold(lines):
+        key, _, value = text.partition(':')
+        # Параметры свойства (BDAY;VALUE=DATE) не важны
+        key = key.split(';', 1)[0].upper()
+        if key == 'BEGIN' and value.upper() == begin:
+            record = {'line': line}
+        elif key == 'END' and value.upper() == begin and record is not None:
+            name = next((record[k] for k in name_keys if record.get(k)), '')
+            parsed = validate(record['line'], name, record.get(date_key, ''), record.get(notes_key, ''), report)
+            if parsed:
+                yield parsed
+            record = None
+        elif record is not None and key not in record:
+            record[key] = unescape(value)
+
+
+def parse_vcard(lines: Iterable[str], report: ImportReport) -> Iterator[ImportRow]:
+    """Контакты vCard: имя из FN (или N), дата из BDAY, заметка из NOTE; контакты без BDAY пропускаются"""
+    for row in parse_properties(_skip_without(lines, 'BDAY', 'VCARD'), 'VCARD', report, ('FN', 'N'), 'BDAY', 'NOTE'):
+        yield row._replace(name=' '.join(part for part in row.name.split(';') if part).strip() or row.name)
+
+
+def parse_ics(lines: Iterable[str], report: ImportReport) -> Iterator[ImportRow]:
+    """События iCalendar: название из SUMMARY, дата из DTSTART, заметка из DESCRIPTION"""
+    return parse_properties(lines, 'VEVENT', report, ('SUMMARY',), 'DTSTART', 'DESCRIPTION')
+
+
+PARSERS = {'csv': parse_csv, 'vcard': parse_vcard, 'ics': parse_ics}
+
+
+def download_document(bot: TeleBot, file_id: str) -> IO[bytes]:
+    """Скачивает файл из Telegram по частям; FileTooLargeError, если файл больше IMPORT_MAX_FILE_SIZE"""
+    file_info = bot.get_file(file_id)
+    if (file_info.file_size or 0) > settings.IMPORT_MAX_FILE_SIZE:
+        raise FileTooLargeError("файл слишком большой")
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(bot.token, file_info.file_path)
+
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with requests.get(url, stream=True, proxies=apihelper.proxy, timeout=apihelper.READ_TIMEOUT) as response:
+        response.raise_for_status()
+        size = 0
+        for chunk in response.iter_content(64 * 1024):
+            size += len(chunk)
+            if size > settings.IMPORT_MAX_FILE_SIZE:
+                file.close()
+                raise FileTooLargeError("файл слишком большой")
+            file.write(chunk)
+    file.seek(0)
+    return file
+
+
+def import_events(db: Database, chat_id: int, file: IO[bytes], file_format: str,
+                  event_type: str = 'birthday') -> ImportReport:
+    """Разбирает файл потоково и добавляет события одной транзакцией.
+
+    Строки читаются по одной и сразу уходят в executemany, поэтому в памяти
+    не держится ни весь файл, ни список событий. Уже существующие имена
+    не перезаписываются и считаются дубликатами.
+    """
+    report = ImportReport()
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+    rows = _limit(PARSERS[file_format](text, report), report)
+    try:
+        report.added, total = db.add_events(chat_id, rows, event_type=event_type)
+    finally:
+        text.detach()
+    report.duplicates = total - report.added
+    return report
+
+
+def export_events(db: Database, chat_id: int, file_format: str,
+                  event_type: str = 'birthday') -> Tuple[IO[bytes], int]:
+    """Выгружает события чата в файл; возвращает файл и число событий.
+
+    События читаются из базы курсором по одному, а файл уходит из памяти
+    на диск, когда становится больше SPOOL_SIZE.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    writer = {'csv': _write_csv, 'vcard': _write_vcard, 'ics': _write_ics}[file_format]
+    count = 0
+
+    def events():
+        nonlocal count
+        for event in db.iter_events(chat_id, event_type):
+            count += 1
+            yield event
+
+    writer(text, events())
+    text.flush()
+    text.detach()
+    file.seek(0)
+    return file, count
+
+
+def _write_csv(out: IO[str], events: Iterable[Tuple[str, datetime.date, str]]):
+    writer = csv.writer(out)
+    writer.writerow(('name', 'date', 'notes'))
+    for name, date, notes in events:
+        writer.writerow((name, f"{date.day:02d}.{date.month:02d}.{date.year}", notes or ''))
+
+
+def _escape(value: str) -> str:
+    return (value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _write_vcard(out: IO[str], events: Iterable[Tuple[str, datetime.date, str]]):
+    for name, date, notes in events:
+        out.write(f"BEGIN:VCARD\r\nVERSION:3.0\r\nFN:{_escape(name)}\r\nN:{_escape(name)};;;;\r\n")
+        out.write(f"BDAY:{date.strftime('%Y-%m-%d')}\r\n")
+        if notes:
+            out.write(f"NOTE:{_escape(notes)}\r\n")
+        out.write("END:VCARD\r\n")
+
+
+def _write_ics(out: IO[str], events: Iterable[Tuple[str, datetime.date, str]]):
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Birthday Bot//RU\r\n")
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    for number, (name, date, notes) in enumerate(events, 1):
+        out.write(f"BEGIN:VEVENT\r\nUID:{number}-{date.strftime('%Y%m%d')}@birthday-bot\r\nDTSTAMP:{stamp}\r\n")
+        out.write(f"DTSTART;VALUE=DATE:{date.strftime('%Y%m%d')}\r\nRRULE:FREQ=YEARLY\r\n")
+        out.write(f"SUMMARY:{_escape(name)}\r\n")
+        if notes:
+            out.write(f"DESCRIPTION:{_escape(notes)}\r\n")
+        out.write("END:VEVENT\r\n")
+    out.write("END:VCALENDAR\r\n")
+
+
+def _chain(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def _skip_without(lines: Iterable[str], key: str, begin: str) -> Iterator[str]:
+    """Отбрасывает блоки begin без свойства key (контакты без дня рождения - не ошибка).
+
+    Держит в памяти только один текущий блок.
+    """
+    block: Optional[List[str]] = None
+    for line in lines:
+        upper = line.upper()
+        if upper.startswith('BEGIN:' + begin):
+            block = [line]
+        elif block is not None:
+            block.append(line)
+            if upper.startswith('END:' + begin):
+                if any(item.upper().startswith((key + ':', key + ';')) for item in block):
+                    yield from block
+                else:
+                    # Пустые строки сохраняют нумерацию строк в отчёте об ошибках
+                    yield from ('' for _ in block)
+                block = None
+        else:
+            yield line
+
+
+def _limit(rows: Iterable[ImportRow], report: ImportReport) -> Iterator[ImportRow]:
+    """Останавливает импорт после IMPORT_MAX_ROWS строк"""
+    for count, row in enumerate(rows):
+        if count >= settings.IMPORT_MAX_ROWS:
+            report.error(row.line, f"превышен лимит в {settings.IMPORT_MAX_ROWS} строк, остальные не загружены")
+            return
+        yield row
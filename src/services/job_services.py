@@ -0,0 +1,123 @@
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from telebot import TeleBot
+from src.config import settings
+
+
+class AIJob:
+    """Задача генерации текста для одного пользователя.
+
+    generate вызывается с самой задачей, чтобы долгая генерация могла
+    проверять job.cancelled и прерываться.
+    """
+
+    def __init__(self, user_id: int, chat_id: int, generate: Callable[['AIJob'], str],
+                 on_result: Callable[[str], None], on_error: Optional[Callable[[Exception], None]]):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.generate = generate
+        self.on_result = on_result
+        self.on_error = on_error
+        self.running = False
+        self.cancelled = threading.Event()
+
+
+class AIJobExecutor:
+    """Выполняет генерации AI в фоновом пуле, не занимая потоки обработчиков.
+
+    Очередь ограничена max_queue задачами, у одного пользователя одновременно
+    может быть не больше per_user задач. Пока задача выполняется, в чат
+    периодически отправляется действие "typing".
+    """
+
+    TYPING_INTERVAL = 4.0
+
+    def __init__(self, bot: TeleBot, workers: int = None, max_queue: int = None, per_user: int = None):
+        self.bot = bot
+        self.max_queue = max_queue or settings.AI_JOB_QUEUE_SIZE
+        self.per_user = per_user or settings.AI_JOB_PER_USER
+        self.executor = ThreadPoolExecutor(max_workers=workers or settings.AI_JOB_WORKERS,
+                                           thread_name_prefix="ai-job")
+        self.jobs: Dict[int, List[AIJob]] = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        threading.Thread(target=self.keep_typing, name="ai-job-typing", daemon=True).start()
+
+    def submit(self, user_id: int, chat_id: int, generate: Callable[[AIJob], str],
+               on_result: Callable[[str], None],
+               on_error: Optional[Callable[[Exception], None]] = None) -> Optional[AIJob]:
+        """Ставит генерацию в очередь. Возвращает None, если очередь или лимит пользователя заполнены"""
+        job = AIJob(user_id, chat_id, generate, on_result, on_error)
+        with self.lock:
+            if sum(len(jobs) for jobs in self.jobs.values()) >= self.max_queue:
+                return None
+            if len(self.jobs.get(user_id, [])) >= self.per_user:
+                return None
+            self.jobs.setdefault(user_id, []).append(job)
+        # Записи журнала генерации сохраняют chat_id и correlation_id обновления
+        self.executor.submit(contextvars.copy_context().run, self.run, job)
+        return job
+
+    def cancel(self, user_id: int) -> int:
+        """Отменяет задачи пользователя; результат уже запущенных генераций не будет отправлен.
+
+        Задачи остаются в self.jobs до завершения run, поэтому отменённая, но ещё
+        выполняющаяся генерация продолжает занимать лимит пользователя.
+        """
+        with self.lock:
+            jobs = [job for job in self.jobs.get(user_id, []) if not job.cancelled.is_set()]
+            for job in jobs:
+                job.cancelled.set()
+        return len(jobs)
+
+    def pending(self) -> int:
+        with self.lock:
+            return sum(len(jobs) for jobs in self.jobs.values())
+
+    def shutdown(self):
+        self.stopped.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, job: AIJob):
+        if job.cancelled.is_set():
+            self.finish(job)
+            return
+        job.running = True
+        self.send_typing(job.chat_id)
+        try:
+            result = job.generate(job)
+            if not job.cancelled.is_set():
+                job.on_result(result)
+        except Exception as e:
+            logging.error(f"Ошибка в задаче генерации для пользователя {job.user_id}: {e}")
+            if job.on_error and not job.cancelled.is_set():
+                job.on_error(e)
+        finally:
+            job.running = False
+            self.finish(job)
+
+    def finish(self, job: AIJob):
+        with self.lock:
+            jobs = self.jobs.get(job.user_id)
+            if jobs and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del self.jobs[job.user_id]
+
+    def keep_typing(self):
+        """Поддерживает индикатор набора текста в чатах с выполняющимися задачами"""
+        while not self.stopped.wait(self.TYPING_INTERVAL):
+            with self.lock:
+                chat_ids = {job.chat_id for jobs in self.jobs.values() for job in jobs
+                            if job.running and not job.cancelled.is_set()}
+            for chat_id in chat_ids:
+                self.send_typing(chat_id)
+
+    def send_typing(self, chat_id: int):
+        try:
+            self.bot.send_chat_action(chat_id, 'typing')
+        except Exception as e:
+            logging.debug(f"Не удалось отправить действие typing в чат {chat_id}: {e}")
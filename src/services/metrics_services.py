@@ -0,0 +1,201 @@
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from src.config import settings
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{format_labels(self.labels, key)} {value:g}" for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Распределение значений по корзинам с суммой и числом наблюдений"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счётчики корзин..., сумма, число наблюдений]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = {key: list(state) for key, state in self.values.items()}
+        lines = []
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += state[index]
+                labels = format_labels(self.labels, key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative:g}")
+            labels = format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]:g}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {state[-2]:.6f}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {state[-1]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса в текстовом формате Prometheus.
+
+    При выключенных метриках inc и observe сразу возвращаются, а timed и
+    instrument возвращают функции без обёрток, поэтому горячие пути (маршрутизация
+    обновлений и запросы к базе) не платят ничего. Включение читается при старте.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(self, name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(self, name, help_text, labels, buckets))
+
+    def timed(self, histogram: Histogram, function: Callable, **labels) -> Callable:
+        """Обёртка, записывающая время вызова function в histogram; без метрик - сама function"""
+        if not self.enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+        return wrapper
+
+    def instrument(self, obj: object, histogram: Histogram, label: str, names: Sequence[str]):
+        """Заменяет методы names объекта obj обёртками timed с меткой label=имя метода"""
+        if not self.enabled:
+            return
+        for name in names:
+            setattr(obj, name, self.timed(histogram, getattr(obj, name), **{label: name}))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry(settings.METRICS_ENABLED)
+
+HANDLER_SECONDS = metrics.histogram('bot_handler_seconds', "Время обработки обновления", ('route',))
+HANDLER_ERRORS = metrics.counter('bot_handler_errors_total', "Исключения в обработчиках", ('route',))
+DB_SECONDS = metrics.histogram('bot_db_query_seconds', "Время метода базы данных", ('method',))
+AI_SECONDS = metrics.histogram('bot_ai_request_seconds', "Время запроса к API модели", ('mode', 'status'))
+AI_TOKENS = metrics.counter('bot_ai_tokens_total', "Токены по данным API модели", ('kind',))
+AI_CACHE = metrics.counter('bot_ai_cache_total', "Обращения к кэшу ответов модели", ('result',))
+AI_FALLBACKS = metrics.counter('bot_ai_fallbacks_total', "Ответы запасным текстом", ('reason',))
+REMINDER_RUN_SECONDS = metrics.histogram('bot_reminder_run_seconds', "Длительность рассылки за день",
+                                         buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+REMINDER_SENDS = metrics.counter('bot_reminder_messages_total', "Напоминания по результату", ('result',))
+LOG_DROPPED = metrics.counter('bot_log_dropped_total', "Записи журнала, отброшенные при переполненной очереди")
+
+
+class MetricsServer:
+    """HTTP-сервер, отдающий метрики по GET /metrics"""
+
+    def __init__(self, registry: MetricsRegistry = metrics, host: str = None, port: int = None):
+        self.registry = registry
+        self.host = host or settings.METRICS_HOST
+        self.port = port if port is not None else settings.METRICS_PORT
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.make_request_handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Метрики доступны на http://{self.host}:{self.httpd.server_address[1]}/metrics")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def make_request_handler(self):
+        registry = self.registry
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler
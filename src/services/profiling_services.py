@@ -0,0 +1,195 @@
+import cProfile
+import collections
+import datetime
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+from src.config import settings
+
+
+def collapse_stack(thread_name: str, frame) -> str:
+    """Стек потока в свёрнутом виде: поток;внешний вызов;...;текущая функция"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ';'.join(reversed(names))
+
+
+class ProfileSession:
+    """Один сеанс профилирования ограниченной длительности.
+
+    Отдельный поток раз в interval снимает стеки всех потоков процесса
+    (получение обновлений, обработчики, рассылка, очередь сообщений) и считает
+    одинаковые стеки. Обработчики, вызванные во время сеанса, дополнительно
+    выполняются под cProfile, и их статистика складывается в общий pstats.
+    """
+
+    def __init__(self, seconds: float, interval: float, directory: str,
+                 on_finish: Optional[Callable[[List[str]], None]] = None):
+        self.seconds = seconds
+        self.interval = interval
+        self.directory = directory
+        self.on_finish = on_finish
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self.stats: Optional[pstats.Stats] = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def add(self, profile: cProfile.Profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id != own:
+                self.stacks[collapse_stack(names.get(thread_id, str(thread_id)), frame)] += 1
+        self.samples += 1
+
+    def run(self):
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not self.stopped.wait(self.interval):
+            self.sample()
+        paths = self.dump()
+        logging.info("Профилирование завершено: %s срезов, файлы %s", self.samples, ', '.join(paths))
+        if self.on_finish is not None:
+            try:
+                self.on_finish(paths)
+            except Exception as e:
+                logging.error(f"Ошибка при отправке результатов профилирования: {e}")
+
+    def dump(self) -> List[str]:
+        """Записывает свёрнутые стеки (формат flamegraph.pl и speedscope) и pstats обработчиков"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        paths = []
+        folded = os.path.join(self.directory, f"profile-{stamp}.folded")
+        with open(folded, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+        paths.append(folded)
+        with self.lock:
+            if self.stats is not None:
+                handlers = os.path.join(self.directory, f"profile-{stamp}-handlers.pstats")
+                self.stats.dump_stats(handlers)
+                paths.append(handlers)
+        return paths
+
+
+class Profiler:
+    """Профилирование работающего бота по запросу и поиск медленных обработчиков.
+
+    При выключенном профилировании trace возвращает обработчик без обёртки,
+    поэтому маршрутизация ничего не платит. Включённый trace отмечает начало
+    каждого вызова; поток-наблюдатель сразу пишет в журнал стек и время
+    обработчика, который выполняется дольше порога, так что зависший обработчик
+    тоже виден. По завершении такого вызова в журнал пишется полное время.
+    Одновременно идёт не больше одного сеанса профилирования.
+    """
+
+    def __init__(self, enabled: bool = False, slow_threshold: float = 0.0):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.session: Optional[ProfileSession] = None
+        # Поток -> [маршрут, начало вызова, замечен ли наблюдателем]
+        self.running: Dict[int, list] = {}
+        self.lock = threading.Lock()
+        self.watchdog: Optional[threading.Thread] = None
+
+    def start(self, seconds: float = None,
+              on_finish: Optional[Callable[[List[str]], None]] = None) -> Optional[ProfileSession]:
+        """Запускает сеанс на seconds секунд; None, если профилирование выключено или уже идёт"""
+        if not self.enabled:
+            return None
+        seconds = min(seconds or settings.PROFILE_SECONDS, settings.PROFILE_MAX_SECONDS)
+        with self.lock:
+            if self.session is not None and self.session.thread.is_alive():
+                return None
+            self.session = ProfileSession(seconds, settings.PROFILE_SAMPLE_INTERVAL, settings.PROFILE_DIR,
+                                          on_finish)
+            self.session.thread.start()
+        logging.info("Профилирование запущено на %s с", seconds)
+        return self.session
+
+    def trace(self, handler: Callable) -> Callable:
+        """Обёртка обработчика для поиска медленных вызовов и профилирования; без профилирования - сам handler"""
+        if not self.enabled:
+            return handler
+        if self.slow_threshold > 0:
+            self.start_watchdog()
+        route = handler.__name__
+
+        @functools.wraps(handler)
+        def wrapper(update):
+            thread_id = threading.get_ident()
+            call = [route, time.perf_counter(), False]
+            previous = self.running.get(thread_id)
+            self.running[thread_id] = call
+            session = self.session
+            profile = None
+            if session is not None and session.thread.is_alive():
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # В этом потоке уже работает профилировщик (вложенный вызов)
+                    profile = None
+            try:
+                return handler(update)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    session.add(profile)
+                elapsed = time.perf_counter() - call[1]
+                if previous is None:
+                    self.running.pop(thread_id, None)
+                else:
+                    self.running[thread_id] = previous
+                if 0 < self.slow_threshold <= elapsed:
+                    logging.warning("Медленный обработчик %s завершился за %.0f мс", route, elapsed * 1000,
+                                    extra={'route': route, 'elapsed_ms': round(elapsed * 1000)})
+        return wrapper
+
+    def start_watchdog(self):
+        with self.lock:
+            if self.watchdog is not None:
+                return
+            self.watchdog = threading.Thread(target=self.watch, name="slow-handler-watchdog", daemon=True)
+            self.watchdog.start()
+
+    def watch(self):
+        """Пишет в журнал стек каждого обработчика, который выполняется дольше порога"""
+        interval = max(self.slow_threshold / 2, 0.05)
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter()
+            slow = [(thread_id, call) for thread_id, call in list(self.running.items())
+                    if not call[2] and now - call[1] >= self.slow_threshold]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, call in slow:
+                call[2] = True
+                frame = frames.get(thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else "стек не снят"
+                elapsed = now - call[1]
+                logging.warning("Обработчик %s выполняется дольше %.0f мс:\n%s", call[0], elapsed * 1000, stack,
+                                extra={'route': call[0], 'elapsed_ms': round(elapsed * 1000)})
+
+
+profiler = Profiler(settings.PROFILE_ENABLED, settings.PROFILE_SLOW_HANDLER_MS / 1000)
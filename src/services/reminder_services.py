@@ -1,21 +1,42 @@
 import datetime
-import time
 import threading
 import logging
-from typing import Dict, List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from telebot import TeleBot
+from src.config import settings
 from src.database.database import Database
+from src.services.api_services import AIService
+from src.services.calendar_services import HolidayCalendar
+from src.services.delivery_services import DeliveryKey, DeliveryRun
+from src.services.dispatcher_services import MessageDispatcher
+from src.services.scheduler_services import ReminderScheduler
 
 
 class ReminderService:
     """Сервис для отправки напоминаний о событиях"""
 
-    def __init__(self, bot: TeleBot, db: Database):
-        """Инициализация с ботом и базой данных"""
+    # Смещение в днях -> настройка уведомления, которая его разрешает
+    OFFSET_SETTINGS = {
+        0: 'notify_on_day',
+        1: 'notify_one_day_before',
+        7: 'notify_one_week_before'
+    }
+
+    def __init__(self, bot: TeleBot, db: Database, dispatcher: Optional[MessageDispatcher] = None,
+                 ai_service: Optional[AIService] = None):
+        """Инициализация с ботом, базой данных, очередью отправки сообщений и сервисом AI
+        (нужен только для заблаговременной генерации поздравлений)"""
         self.bot = bot
         self.db = db
+        self.dispatcher = dispatcher
+        self.ai_service = ai_service
+        self.calendar = HolidayCalendar(db)
+        self.scheduler = ReminderScheduler(db, self.run_day)
+        self.pruned_on: Optional[datetime.date] = None
         self.running = True
-        self.thread = threading.Thread(target=self.check_reminders)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.check_reminders, name="reminders")
         self.thread.daemon = True
 
     def start(self):
@@ -23,109 +44,204 @@ class ReminderService:
 
     def stop(self):
         self.running = False
+        self.stopped.set()
+        self.scheduler.release()
 
     def check_reminders(self):
-        """Основной цикл проверки событий"""
+        """Основной цикл: просыпается к ближайшему слоту доставки и продлевает аренду шардов"""
         while self.running:
-            now = datetime.datetime.now()
-
-            # Вычисление времени до следующей полночи
-            next_midnight = (now + datetime.timedelta(days=1)).replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-            seconds_until_midnight = (next_midnight - now).total_seconds()
-
-            # Уход в сон до следующей полночи
-            time.sleep(seconds_until_midnight)
-
-            # Получение текущей даты после пробуждения
-            today = datetime.date.today()
-            tomorrow = today + datetime.timedelta(days=1)
-            week_later = today + datetime.timedelta(days=7)
-
             try:
-                self.check_global_holidays(today, tomorrow, week_later)
-                self.check_personal_events(today, tomorrow, week_later)
+                self.scheduler.run_pending()
             except Exception as e:
-                logging.error(f"Ошибка при проверке напоминаний: {e}")
-
-    def check_global_holidays(self, today: datetime.date, tomorrow: datetime.date, week_later: datetime.date):
+                logging.error(f"Ошибка планировщика напоминаний: {e}")
+
+            # Сон до ближайшего слота, но не дольше интервала продления аренды
+            timeout = self.scheduler.seconds_until_next()
+            if timeout is None or timeout > settings.SCHEDULER_POLL_INTERVAL:
+                timeout = settings.SCHEDULER_POLL_INTERVAL
+            self.stopped.wait(timeout)
+
+    def run_day(self, today: datetime.date, shard: Optional[Tuple[int, int]] = None,
+                slot: Optional[Tuple[str, int]] = None, catching_up: bool = False):
+        """Рассылка напоминаний за один местный день по одному шарду и слоту чатов"""
+        tomorrow = today + datetime.timedelta(days=1)
+        week_later = today + datetime.timedelta(days=7)
+
+        self.prune_deliveries(today)
+        delivery = DeliveryRun(self.db, today, shard, slot)
+        try:
+            self.check_global_holidays(today, tomorrow, week_later, shard, slot, delivery)
+            self.check_personal_events(today, tomorrow, week_later, shard, slot, delivery)
+        except Exception as e:
+            # Незавершённый день будет повторён планировщиком; отправленное пропустится по журналу
+            delivery.close(str(e))
+            raise
+        delivery.close()
+        # Пока есть неотправленные из-за временных ошибок напоминания, день не считается выполненным:
+        # планировщик повторит его, и журнал пропустит уже доставленное
+        delivery.check_complete()
+        self.clear_past_drafts(today, shard, slot)
+
+        if self.dispatcher:
+            logging.info(f"Очередь отправки после проверки напоминаний: {self.dispatcher.get_stats()}")
+
+        # Поздравления готовятся только в штатный запуск, а не при догоняющем
+        if not catching_up:
+            try:
+                self.pregenerate_congratulations(today, shard, slot)
+            except Exception as e:
+                logging.error(f"Ошибка при подготовке поздравлений: {e}")
+
+    def pregenerate_congratulations(self, today: datetime.date, shard: Optional[Tuple[int, int]] = None,
+                                    slot: Optional[Tuple[str, int]] = None) -> int:
+        """Заранее генерирует поздравления для дней рождения в ближайшие PREGENERATE_DAYS дней.
+
+        Выполняется после ночной рассылки, когда нагрузка минимальна. Обрабатываются
+        только дни рождения без поздравления; результат сохраняется в draft_wishes
+        и попадает в напоминание в день события. Сохраняется только ответ модели:
+        при ошибке запасной текст не пишется, и день рождения попадёт в следующую
+        подготовку.
+        """
+        if not self.ai_service or settings.PREGENERATE_DAYS <= 0:
+            return 0
+
+        dates = [today + datetime.timedelta(days=days) for days in range(1, settings.PREGENERATE_DAYS + 1)]
+        birthdays = self.db.get_birthdays_without_wishes(dates, shard, slot)
+        if not birthdays:
+            return 0
+
+        def generate(birthday: Dict) -> Tuple[Dict, Optional[str]]:
+            prompt = AIService.congratulation_prompt(birthday['name'], birthday['notes'] or '')
+            try:
+                return birthday, self.ai_service.complete(*prompt)
+            except Exception as e:
+                logging.error(f"Ошибка при подготовке поздравления для чата {birthday['chat_id']}: {e}")
+                return birthday, None
+
+        saved = 0
+        with ThreadPoolExecutor(max_workers=settings.PREGENERATE_CONCURRENCY) as pool:
+            for birthday, draft in pool.map(generate, birthdays):
+                if draft and self.db.save_draft_wishes(birthday['chat_id'], birthday['name'], draft):
+                    saved += 1
+        logging.info(f"Подготовлено поздравлений: {saved} из {len(birthdays)}")
+        return saved
+
+    def clear_past_drafts(self, today: datetime.date, shard: Optional[Tuple[int, int]] = None,
+                          slot: Optional[Tuple[str, int]] = None):
+        """Удаляет черновики поздравлений с прошедшим вчера днём рождения, чтобы через год подготовить новые"""
+        try:
+            self.db.clear_draft_wishes([today - datetime.timedelta(days=1)], shard, slot)
+        except Exception as e:
+            logging.error(f"Ошибка при удалении прошедших черновиков поздравлений: {e}")
+
+    def prune_deliveries(self, today: datetime.date):
+        """Раз в день удаляет устаревшие записи журнала отправок"""
+        if self.pruned_on == today:
+            return
+        self.pruned_on = today
+        try:
+            self.db.prune_deliveries(today - datetime.timedelta(days=settings.DELIVERY_RETENTION_DAYS))
+        except Exception as e:
+            logging.error(f"Ошибка при очистке журнала отправок: {e}")
+
+    def send_message(self, chat_id: int, text: str) -> Future:
+        """Отправляет напоминание через очередь, если она подключена; Future завершится после отправки"""
+        if self.dispatcher:
+            return self.dispatcher.submit(chat_id, text)
+        future = Future()
+        try:
+            future.set_result(self.bot.send_message(chat_id, text))
+        except Exception as e:
+            logging.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
+            future.set_exception(e)
+        return future
+
+    def deliver(self, delivery: Optional[DeliveryRun], key: DeliveryKey, text: str):
+        """Отправляет напоминание, если оно ещё не было доставлено, и учитывает результат в журнале"""
+        self.scheduler.check_lease()
+        if delivery and not delivery.should_send(key):
+            return
+        try:
+            future = self.send_message(key[0], text)
+        except Exception as e:
+            logging.error(f"Ошибка при постановке напоминания в очередь для чата {key[0]}: {e}")
+            if delivery:
+                delivery.fail(key)
+            return
+        if delivery:
+            delivery.track(key, future)
+
+    def check_global_holidays(self, today: datetime.date, tomorrow: datetime.date, week_later: datetime.date,
+                              shard: Optional[Tuple[int, int]] = None, slot: Optional[Tuple[str, int]] = None,
+                              delivery: Optional[DeliveryRun] = None):
         """Проверяет и отправляет уведомления о глобальных праздниках"""
-        holidays = self.db.get_global_holidays()
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT DISTINCT chat_id FROM birthdays UNION SELECT DISTINCT chat_id FROM holidays')
-        chat_ids = [row[0] for row in cursor.fetchall()]
-
-        for chat_id in chat_ids:
-            settings = self.db.get_notification_settings(chat_id, 'global_holiday')
-            if not settings:
-                continue
+        due_holidays = self.calendar.get_due({0: today, 1: tomorrow, 7: week_later})
+        if not due_holidays:
+            return
+        if delivery:
+            delivery.load([holiday['offset'] for holiday in due_holidays])
+
+        chat_ids = self.db.get_chat_ids(shard, slot)
+        settings_by_chat = self.db.get_all_notification_settings('global_holiday', shard, slot)
+
+        for holiday in due_holidays:
+            name = holiday['name']
+            if holiday['offset'] == 0:
+                message = f"🎉 Сегодня праздник: {name}!\n\n{holiday['description']}"
+            elif holiday['offset'] == 1:
+                message = f"Напоминание: завтра праздник - {name}! 🎉"
+            else:
+                message = f"Напоминание: через 7 дней праздник - {name}! 🎉"
+
+            setting = self.OFFSET_SETTINGS[holiday['offset']]
+            for chat_id in chat_ids:
+                settings = settings_by_chat.get(chat_id)
+                if settings and settings[setting]:
+                    self.deliver(delivery, (chat_id, 'global_holiday', name, holiday['offset']), message)
 
-            for name, date, desc in holidays:
-                holiday_date = datetime.date(today.year, date.month, date.day)
-
-                if holiday_date == today and settings['notify_on_day']:
-                    try:
-                        self.bot.send_message(chat_id, f"🎉 Сегодня праздник: {name}!\n\n{desc}")
-                    except Exception as e:
-                        logging.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
-                elif holiday_date == tomorrow and settings['notify_one_day_before']:
-                    try:
-                        self.bot.send_message(chat_id, f"Напоминание: завтра праздник - {name}! 🎉")
-                    except Exception as e:
-                        logging.error(f"Ошибка при отправке напоминания в чат {chat_id}: {e}")
-                elif holiday_date == week_later and settings['notify_one_week_before']:
-                    try:
-                        self.bot.send_message(chat_id, f"Напоминание: через 7 дней праздник - {name}! 🎉")
-                    except Exception as e:
-                        logging.error(f"Ошибка при отправке напоминания в чат {chat_id}: {e}")
-
-    def check_personal_events(self, today: datetime.date, tomorrow: datetime.date, week_later: datetime.date):
+    def check_personal_events(self, today: datetime.date, tomorrow: datetime.date, week_later: datetime.date,
+                              shard: Optional[Tuple[int, int]] = None, slot: Optional[Tuple[str, int]] = None,
+                              delivery: Optional[DeliveryRun] = None):
         """Проверяет и отправляет уведомления о личных событиях"""
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT DISTINCT chat_id FROM birthdays UNION SELECT DISTINCT chat_id FROM holidays')
-        chat_ids = [row[0] for row in cursor.fetchall()]
+        due_events = self.db.get_due_events({0: today, 1: tomorrow, 7: week_later}, shard, slot)
+        if not due_events:
+            return
+        if delivery:
+            delivery.load(list(self.OFFSET_SETTINGS))
+        settings_by_type = {
+            event_type: self.db.get_all_notification_settings(event_type, shard, slot)
+            for event_type in ('birthday', 'holiday')
+        }
+
+        for event in due_events:
+            chat_id = event['chat_id']
+            event_type = event['event_type']
+            settings = settings_by_type[event_type].get(chat_id)
+            if not settings or not settings[self.OFFSET_SETTINGS[event['offset']]]:
+                continue
 
-        for event_type in ['birthday', 'holiday']:
-            for chat_id in chat_ids:
-                settings = self.db.get_notification_settings(chat_id, event_type)
-                if not settings:
-                    continue
-
-                if event_type == 'birthday':
-                    cursor.execute('SELECT name, date, wishes, notes FROM birthdays WHERE chat_id = ?', (chat_id,))
-                else:
-                    cursor.execute('SELECT name, date, notes FROM holidays WHERE chat_id = ?', (chat_id,))
-
-                for row in cursor.fetchall():
-                    if event_type == 'birthday':
-                        name, date_str, wishes, notes = row
-                    else:
-                        name, date_str, notes = row
-                        wishes = ''
-
-                    event_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                    event_date_by_year = datetime.date(today.year, event_date.month, event_date.day)
-
-                    if event_date_by_year == today and settings['notify_on_day']:
-                        message = f"🎉 Сегодня {'день рождения у' if event_type == 'birthday' else 'праздник:'} {name}!\n"
-                        if wishes:
-                            message += f"\nПоздравление: {wishes}\n"
-                        if notes:
-                            message += f"\nЗаметка: {notes}"
-                        try:
-                            self.bot.send_message(chat_id, message)
-                        except Exception as e:
-                            logging.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
-                    elif event_date_by_year == tomorrow and settings['notify_one_day_before']:
-                        try:
-                            self.bot.send_message(chat_id,
-                                                  f"Напоминание: завтра {'день рождения у' if event_type == 'birthday' else 'праздник'} {name}! 🎉")
-                        except Exception as e:
-                            logging.error(f"Ошибка при отправке напоминания в чат {chat_id}: {e}")
-                    elif event_date_by_year == week_later and settings['notify_one_week_before']:
-                        try:
-                            self.bot.send_message(chat_id,
-                                                  f"Напоминание: через 7 дней {'день рождения у' if event_type == 'birthday' else 'праздник'} {name}! 🎉")
-                        except Exception as e:
-                            logging.error(f"Ошибка при отправке напоминания в чат {chat_id}: {e}")
\ No newline at end of file
+            # Ошибка в одном событии не должна останавливать рассылку остальным чатам
+            try:
+                message = self.format_personal_event(event)
+            except Exception as e:
+                logging.error(f"Ошибка при подготовке напоминания для чата {chat_id}: {e}")
+                continue
+            self.deliver(delivery, (chat_id, event_type, event['name'], event['offset']), message)
+
+    def format_personal_event(self, event: Dict) -> str:
+        """Текст напоминания о личном событии"""
+        event_type = event['event_type']
+        name = event['name']
+        if event['offset'] == 0:
+            message = f"🎉 Сегодня {'день рождения у' if event_type == 'birthday' else 'праздник:'} {name}!\n"
+            if event['wishes']:
+                message += f"\nПоздравление: {event['wishes']}\n"
+            elif event.get('draft_wishes'):
+                message += f"\nГотовое поздравление: {event['draft_wishes']}\n"
+            if event['notes']:
+                message += f"\nЗаметка: {event['notes']}"
+        elif event['offset'] == 1:
+            message = f"Напоминание: завтра {'день рождения у' if event_type == 'birthday' else 'праздник'} {name}! 🎉"
+        else:
+            message = f"Напоминание: через 7 дней {'день рождения у' if event_type == 'birthday' else 'праздник'} {name}! 🎉"
+        return message
@@ -0,0 +1,256 @@
+import datetime
+import heapq
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+from typing import Callable, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from src.config import settings
+from src.database.database import Database
+
+Shard = Optional[Tuple[int, int]]
+Slot = Tuple[str, int]
+
+
+class LeaseLostError(Exception):
+    """Аренда шарда перешла к другой реплике во время рассылки"""
+
+
+def get_zone(name: str) -> datetime.tzinfo:
+    """Часовой пояс по имени; неизвестное имя заменяется на UTC"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logging.warning(f"Неизвестный часовой пояс {name}, используется UTC")
+        return datetime.timezone.utc
+
+
+def parse_timezone(text: str) -> Optional[str]:
+    """Имя часового пояса из ввода пользователя: "Europe/Moscow", "UTC+5" или "+5"; None, если не распознано"""
+    text = text.strip()
+    offset = text[3:] if text.upper().startswith(('UTC', 'GMT')) else text
+    if offset[:1] in ('+', '-') and offset[1:].isdigit():
+        hours = int(offset)
+        # Целые смещения зон Etc/GMT: от UTC-12 до UTC+14
+        if not -12 <= hours <= 14:
+            return None
+        # В базе IANA знак у зон Etc/GMT обратный: Etc/GMT-5 - это UTC+5
+        return 'UTC' if hours == 0 else f"Etc/GMT{-hours:+d}"
+    try:
+        ZoneInfo(text)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+    return text
+
+
+def latest_date(slot: Slot, now: datetime.datetime) -> datetime.date:
+    """Местная дата последнего наступившего часа доставки слота"""
+    timezone, hour = slot
+    local = now.astimezone(get_zone(timezone))
+    if local.hour >= hour:
+        return local.date()
+    return local.date() - datetime.timedelta(days=1)
+
+
+def next_occurrence(slot: Slot, now: datetime.datetime) -> datetime.datetime:
+    """Ближайший после now момент доставки слота (UTC); учитывает переход на летнее время"""
+    timezone, hour = slot
+    day = latest_date(slot, now) + datetime.timedelta(days=1)
+    moment = datetime.datetime.combine(day, datetime.time(hour), tzinfo=get_zone(timezone))
+    moment = moment.astimezone(datetime.timezone.utc)
+    # Несуществующий из-за перевода часов час не должен давать момент в прошлом
+    return max(moment, now + datetime.timedelta(minutes=1))
+
+
+class ReminderScheduler:
+    """Распределяет рассылку напоминаний между репликами бота и по времени суток.
+
+    Чаты делятся на SCHEDULER_SHARDS шардов. Реплика берёт шард в аренду через
+    таблицу scheduler_leases и продлевает её при каждом опросе; шард без продления
+    после SCHEDULER_LEASE_TTL забирает другая реплика.
+
+    Внутри шарда чаты разбиты на слоты (часовой пояс, час доставки). Для каждого
+    слота в куче хранится ближайший момент доставки, и при пробуждении
+    обрабатываются только наступившие слоты. Для пары (шард, слот) хранится
+    последний обработанный местный день, поэтому после простоя пропущенные дни
+    догоняются, а два процесса не отправят одно и то же напоминание. День,
+    рассылка которого завершилась ошибкой, повторяется при следующем опросе.
+
+    Пока идёт рассылка за день, аренда продлевается отдельным потоком: run_day
+    может ждать места в очереди отправки дольше SCHEDULER_LEASE_TTL. Если
+    продлить аренду не удалось, check_lease прерывает рассылку, чтобы две
+    реплики не отправляли один и тот же день.
+    """
+
+    LEASE_PREFIX = 'reminders'
+
+    def __init__(self, db: Database, run_day: Callable[..., None], shards: int = None,
+                 lease_ttl: float = None, max_catchup_days: int = None):
+        """run_day(day, shard, slot, catching_up) выполняет рассылку за один местный день"""
+        self.db = db
+        self.run_day = run_day
+        self.shards = max(shards or settings.SCHEDULER_SHARDS, 1)
+        self.lease_ttl = lease_ttl or settings.SCHEDULER_LEASE_TTL
+        self.max_catchup_days = max(max_catchup_days or settings.SCHEDULER_MAX_CATCHUP_DAYS, 1)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.owned: List[int] = []
+        self.slots: Set[Slot] = set()
+        self.wakeups: List[Tuple[datetime.datetime, Slot]] = []
+        self.retry: Set[Tuple[int, Slot]] = set()
+        self.lease_lost = threading.Event()
+
+    def lease_name(self, index: int) -> str:
+        return f"{self.LEASE_PREFIX}:{index}"
+
+    def watermark_name(self, index: int, slot: Slot) -> str:
+        return f"{self.LEASE_PREFIX}:{index}:{slot[0]}:{slot[1]}"
+
+    def shard(self, index: int) -> Shard:
+        return (index, self.shards) if self.shards > 1 else None
+
+    def rebalance(self) -> List[int]:
+        """Продлевает свои аренды и захватывает свободные шарды до справедливой доли"""
+        members = max(self.db.heartbeat(self.owner, self.lease_ttl), 1)
+        target = math.ceil(self.shards / members)
+
+        owned = [index for index in self.owned
+                 if self.db.acquire_lease(self.lease_name(index), self.owner, self.lease_ttl)]
+        # Начинаем поиск с разных шардов, чтобы реплики не конкурировали за первые
+        start = hash(self.owner) % self.shards
+        for step in range(self.shards):
+            if len(owned) >= target:
+                break
+            index = (start + step) % self.shards
+            if index not in owned and self.db.acquire_lease(self.lease_name(index), self.owner, self.lease_ttl):
+                owned.append(index)
+
+        for index in owned[target:]:
+            self.db.release_lease(self.lease_name(index), self.owner)
+        self.owned = sorted(owned[:target])
+        return self.owned
+
+    def refresh_slots(self, now: datetime.datetime):
+        """Добавляет в кучу новые слоты; исчезнувшие отбрасываются при извлечении.
+
+        Новый слот отмечается выполненным по последний уже наступивший час во
+        всех шардах, поэтому первой будет ближайшая доставка после появления
+        слота: чат, перешедший в 08:00 на доставку в 20:00, получит напоминания
+        в 20:00 того же дня. Существующие отметки не меняются.
+        """
+        slots = set(self.db.get_reminder_slots())
+        for slot in slots - self.slots:
+            heapq.heappush(self.wakeups, (next_occurrence(slot, now), slot))
+            self.db.init_watermarks([self.watermark_name(index, slot) for index in range(self.shards)],
+                                    latest_date(slot, now))
+        self.slots = slots
+
+    def pop_due_slots(self, now: datetime.datetime) -> Set[Slot]:
+        """Извлекает из кучи наступившие слоты и планирует их следующее пробуждение"""
+        due = set()
+        while self.wakeups and self.wakeups[0][0] <= now:
+            _, slot = heapq.heappop(self.wakeups)
+            if slot in self.slots and slot not in due:
+                due.add(slot)
+                heapq.heappush(self.wakeups, (next_occurrence(slot, now), slot))
+        return due
+
+    def seconds_until_next(self, now: Optional[datetime.datetime] = None) -> Optional[float]:
+        """Время до ближайшего слота или None, если слотов нет"""
+        if not self.wakeups:
+            return None
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return max((self.wakeups[0][0] - now).total_seconds(), 0.0)
+
+    def run_pending(self, now: Optional[datetime.datetime] = None) -> int:
+        """Выполняет наступившие слоты по своим шардам; возвращает число выполненных запусков"""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        previously_owned = set(self.owned)
+        self.rebalance()
+        self.refresh_slots(now)
+        due = self.pop_due_slots(now)
+
+        runs = 0
+        for index in list(self.owned):
+            # У только что полученного шарда проверяются все слоты: прежний владелец мог не успеть
+            if index in previously_owned:
+                slots = due | {slot for retry_index, slot in self.retry if retry_index == index}
+            else:
+                slots = self.slots
+            for slot in sorted(slots):
+                if index not in self.owned:
+                    break
+                runs += self.run_slot(index, slot, now)
+        return runs
+
+    def run_slot(self, index: int, slot: Slot, now: datetime.datetime) -> int:
+        """Догоняет необработанные местные дни одного слота в шарде"""
+        name = self.watermark_name(index, slot)
+        latest = latest_date(slot, now)
+        watermark = self.db.get_watermark(name)
+        if watermark is None:
+            # Отметку ставит refresh_slots; без неё (например, удалена вручную) догонять нечего
+            self.db.set_watermark(name, latest)
+            return 0
+
+        runs = 0
+        day = max(watermark + datetime.timedelta(days=1),
+                  latest - datetime.timedelta(days=self.max_catchup_days - 1))
+        while day <= latest:
+            if not self.db.acquire_lease(self.lease_name(index), self.owner, self.lease_ttl):
+                logging.warning(f"Аренда шарда {index} потеряна, рассылка за {day} остановлена")
+                self.owned.remove(index)
+                break
+            try:
+                self.run_day_with_heartbeat(index, day, slot, day != latest)
+            except LeaseLostError:
+                logging.warning(f"Аренда шарда {index} потеряна во время рассылки за {day}")
+                self.owned.remove(index)
+                break
+            except Exception as e:
+                # День не отмечается выполненным и повторяется при следующем опросе
+                logging.error(f"Ошибка рассылки за {day} в шарде {index}, слот {slot}: {e}")
+                self.retry.add((index, slot))
+                break
+            self.retry.discard((index, slot))
+            self.db.set_watermark(name, day)
+            runs += 1
+            if self.lease_lost.is_set():
+                # День поставлен в очередь целиком, но дальше шард обслуживает другая реплика
+                self.owned.remove(index)
+                break
+            day += datetime.timedelta(days=1)
+        return runs
+
+    def run_day_with_heartbeat(self, index: int, day: datetime.date, slot: Slot, catching_up: bool):
+        """Выполняет run_day, продлевая аренду шарда каждую треть SCHEDULER_LEASE_TTL"""
+        self.lease_lost.clear()
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease_ttl / 3):
+                if not self.db.acquire_lease(self.lease_name(index), self.owner, self.lease_ttl):
+                    self.lease_lost.set()
+                    return
+
+        thread = threading.Thread(target=heartbeat, name=f"lease-heartbeat-{index}", daemon=True)
+        thread.start()
+        try:
+            self.run_day(day, self.shard(index), slot, catching_up)
+        finally:
+            done.set()
+            thread.join()
+
+    def check_lease(self):
+        """Вызывается из run_day перед каждой отправкой; прерывает рассылку, если аренда потеряна"""
+        if self.lease_lost.is_set():
+            raise LeaseLostError("Аренда шарда потеряна")
+
+    def release(self):
+        """Освобождает аренды при остановке, чтобы другие реплики забрали шарды сразу"""
+        for index in self.owned:
+            self.db.release_lease(self.lease_name(index), self.owner)
+        self.owned = []
+        self.db.remove_member(self.owner)
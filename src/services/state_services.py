@@ -0,0 +1,114 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from src.config import settings
+from src.database.database import Database
+
+
+class ConversationStore:
+    """Состояние диалогов пользователей: ожидаемый шаг ввода и промежуточные данные.
+
+    Без db состояния хранятся в памяти: не больше max_size, давно не
+    использованные вытесняются первыми. С db состояния хранятся в таблице
+    conversation_state в формате JSON, поэтому переживают перезапуск и доступны
+    всем репликам. В обоих режимах состояние истекает через ttl секунд после
+    последней записи.
+    """
+
+    PRUNE_INTERVAL = 300.0
+
+    def __init__(self, db: Optional[Database] = None, max_size: int = None, ttl: float = None):
+        self.db = db
+        self.max_size = max_size or settings.STATE_MAX_SIZE
+        self.ttl = ttl if ttl is not None else settings.STATE_TTL
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.pruned_at = time.monotonic()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        if self.db is not None:
+            state = self.db.get_conversation_state(user_id)
+            return json.loads(state) if state else None
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return dict(entry[0])
+
+    def set(self, user_id: int, state: Dict[str, Any]):
+        expires_at = time.time() + self.ttl
+        if self.db is not None:
+            self.db.set_conversation_state(user_id, json.dumps(state, ensure_ascii=False), expires_at)
+            self.prune()
+            return
+
+        with self.lock:
+            self.entries[user_id] = (dict(state), expires_at)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def update(self, user_id: int, **values) -> Dict[str, Any]:
+        """Дополняет состояние пользователя и возвращает его"""
+        return self.modify(user_id, lambda state: state.update(values))
+
+    def modify(self, user_id: int, change: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """Атомарно изменяет состояние пользователя: change получает текущее состояние
+        (пустое, если его нет) и меняет его на месте. Возвращает новое состояние."""
+        expires_at = time.time() + self.ttl
+        if self.db is not None:
+            def replace(current: Optional[str]) -> str:
+                state = json.loads(current) if current else {}
+                change(state)
+                return json.dumps(state, ensure_ascii=False)
+
+            state = json.loads(self.db.update_conversation_state(user_id, replace, expires_at))
+            self.prune()
+            return state
+
+        with self.lock:
+            entry = self.entries.get(user_id)
+            state = dict(entry[0]) if entry is not None and entry[1] > time.time() else {}
+            change(state)
+            self.entries[user_id] = (dict(state), expires_at)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return state
+
+    def pop(self, user_id: int) -> Optional[Dict[str, Any]]:
+        state = self.get(user_id)
+        if state is None:
+            return None
+        if self.db is not None:
+            self.db.delete_conversation_state(user_id)
+        else:
+            with self.lock:
+                self.entries.pop(user_id, None)
+        return state
+
+    def prune(self):
+        """Не чаще раза в PRUNE_INTERVAL удаляет из базы истёкшие и лишние состояния"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.pruned_at < self.PRUNE_INTERVAL:
+                return
+            self.pruned_at = now
+        try:
+            self.db.prune_conversation_states(self.max_size)
+        except Exception as e:
+            logging.error(f"Ошибка при очистке состояний диалогов: {e}")
+
+    def __len__(self) -> int:
+        if self.db is not None:
+            return self.db.read_conn.execute('SELECT COUNT(*) FROM conversation_state').fetchone()[0]
+        with self.lock:
+            return len(self.entries)
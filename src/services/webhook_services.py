@@ -0,0 +1,123 @@
+import hmac
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from telebot import TeleBot, types
+from src.config import settings
+
+
+class WebhookServer:
+    """HTTP-сервер для приёма обновлений Telegram через вебхук.
+
+    Обновления раскладываются по очередям воркеров по chat_id, поэтому
+    сообщения одного чата обрабатываются строго по порядку, а разные чаты -
+    параллельно. Боту стоит передавать threaded=False, чтобы обработчики
+    выполнялись в потоках воркеров, а не в собственном пуле telebot.
+    """
+
+    def __init__(self, bot: TeleBot, host: str = None, port: int = None, path: str = None,
+                 secret: str = None, workers: int = None, queue_size: int = None):
+        self.bot = bot
+        self.host = host or settings.WEBHOOK_HOST
+        self.port = port if port is not None else settings.WEBHOOK_PORT
+        self.path = path or settings.WEBHOOK_PATH
+        self.secret = secret if secret is not None else settings.WEBHOOK_SECRET
+        self.workers = workers or settings.WEBHOOK_WORKERS
+        queue_size = queue_size or settings.WEBHOOK_QUEUE_SIZE
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self.threads: List[threading.Thread] = []
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def start(self):
+        """Запускает воркеры и HTTP-сервер в фоновых потоках"""
+        for i, updates in enumerate(self.queues):
+            thread = threading.Thread(target=self.worker, args=(updates,), name=f"webhook-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self.make_request_handler())
+        self.httpd.daemon_threads = True
+        thread = threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        logging.info(f"Вебхук слушает {self.host}:{self.port}{self.path}")
+
+    def serve_forever(self):
+        """Запускает сервер и блокирует текущий поток до остановки"""
+        self.start()
+        for thread in self.threads:
+            thread.join()
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        for updates in self.queues:
+            updates.put(None)
+
+    @property
+    def server_port(self) -> int:
+        """Фактический порт сервера (полезно при port=0)"""
+        return self.httpd.server_address[1] if self.httpd else self.port
+
+    def dispatch(self, update: types.Update):
+        """Ставит обновление в очередь воркера, закреплённого за чатом"""
+        key = self.chat_key(update)
+        self.queues[key % self.workers].put(update)
+
+    def worker(self, updates: queue.Queue):
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                logging.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+
+    @staticmethod
+    def chat_key(update: types.Update) -> int:
+        """Определяет чат обновления, чтобы сохранить порядок обработки внутри чата"""
+        for attr in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+            message = getattr(update, attr, None)
+            if message is not None:
+                return message.chat.id
+        call = update.callback_query
+        if call is not None:
+            return call.message.chat.id if call.message else call.from_user.id
+        return update.update_id
+
+    def make_request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if server.secret and not hmac.compare_digest(token, server.secret):
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    update = types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+                except Exception as e:
+                    logging.error(f"Не удалось разобрать обновление вебхука: {e}")
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                server.dispatch(update)
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(f"Вебхук: {format % args}")
+
+        return RequestHandler
@@ -0,0 +1,54 @@
+import datetime
+from concurrent.futures import Future
+
+import pytest
+from telebot.apihelper import ApiTelegramException
+
+from src.config import settings
+from src.database.database import Database
+from src.services.delivery_services import DeliveryIncompleteError, DeliveryRun
+
+
+def telegram_error(code: int) -> ApiTelegramException:
+    return ApiTelegramException('sendMessage', None, {'error_code': code, 'description': 'error'})
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_PATH', str(tmp_path / 'bot.db'))
+    database = Database()
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize('code, status', [(429, 'failed'), (502, 'failed'), (403, 'rejected'), (400, 'rejected')])
+def test_status_of_telegram_errors(code, status):
+    assert DeliveryRun.status(telegram_error(code)) == status
+
+
+def test_rate_limited_reminder_is_retried(db):
+    day = datetime.date(2024, 5, 10)
+    key = (1, 'birthday', 'Иван', 0)
+    delivery = DeliveryRun(db, day)
+    delivery.load([0])
+    assert delivery.should_send(key)
+    future = Future()
+    delivery.track(key, future)
+    future.set_exception(telegram_error(429))
+    delivery.close()
+
+    with pytest.raises(DeliveryIncompleteError):
+        delivery.check_complete()
+    assert key not in db.get_delivered({0: day})
+
+
+def test_check_complete_gives_up_on_unresolved_sends(db):
+    delivery = DeliveryRun(db, datetime.date(2024, 5, 10))
+    key = (1, 'birthday', 'Иван', 0)
+    delivery.load([0])
+    delivery.should_send(key)
+    delivery.track(key, Future())
+    delivery.close()
+
+    with pytest.raises(DeliveryIncompleteError):
+        delivery.check_complete(timeout=0.05)
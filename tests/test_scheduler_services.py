@@ -0,0 +1,105 @@
+import datetime
+import time
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from src.config import settings
+from src.database.database import Database
+from src.services.scheduler_services import ReminderScheduler, parse_timezone
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+
+
+def moscow(day: datetime.date, hour: int, minute: int = 0) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=MOSCOW)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'DATABASE_PATH', str(tmp_path / 'bot.db'))
+    monkeypatch.setattr(settings, 'DEFAULT_TIMEZONE', 'Europe/Moscow')
+    monkeypatch.setattr(settings, 'DEFAULT_REMINDER_HOUR', 9)
+    database = Database()
+    yield database
+    database.close()
+
+
+def test_slot_created_mid_day_runs_the_same_day(db):
+    runs = []
+    scheduler = ReminderScheduler(db, lambda day, shard, slot, catching_up: runs.append((day, slot)),
+                                  shards=1)
+    day = datetime.date(2024, 5, 10)
+
+    scheduler.run_pending(moscow(day, 7))
+    # В 08:00, до рассылки слота по умолчанию, чат переходит на доставку в 20:00
+    db.set_chat_preferences(1, 'Europe/Moscow', 20)
+    scheduler.run_pending(moscow(day, 8))
+    scheduler.run_pending(moscow(day, 9, 1))
+    scheduler.run_pending(moscow(day, 20, 6))
+
+    assert runs == [(day, ('Europe/Moscow', 9)), (day, ('Europe/Moscow', 20))]
+
+
+def test_slot_created_after_its_hour_starts_next_day(db):
+    runs = []
+    scheduler = ReminderScheduler(db, lambda day, shard, slot, catching_up: runs.append((day, slot)),
+                                  shards=1)
+    day = datetime.date(2024, 5, 10)
+
+    scheduler.run_pending(moscow(day, 21))
+    db.set_chat_preferences(1, 'Europe/Moscow', 20)
+    scheduler.run_pending(moscow(day, 21, 30))
+    scheduler.run_pending(moscow(day + datetime.timedelta(days=1), 20, 6))
+
+    assert (day, ('Europe/Moscow', 20)) not in runs
+    assert (day + datetime.timedelta(days=1), ('Europe/Moscow', 20)) in runs
+
+
+def test_lease_is_renewed_while_day_runs(db):
+    day = datetime.date(2024, 5, 10)
+    other = ReminderScheduler(db, lambda *args: None, shards=1, lease_ttl=0.3)
+    stolen = []
+
+    def run_day(day, shard, slot, catching_up):
+        time.sleep(0.5)
+        # Аренда истекла бы без продления, и другая реплика забрала бы шард
+        stolen.append(other.rebalance())
+        scheduler.check_lease()
+
+    scheduler = ReminderScheduler(db, run_day, shards=1, lease_ttl=0.3)
+    scheduler.run_pending(moscow(day, 7))
+    scheduler.run_pending(moscow(day, 9, 1))
+
+    assert stolen == [[]]
+    assert scheduler.owned == [0]
+
+
+def test_run_stops_when_lease_is_lost(db):
+    day = datetime.date(2024, 5, 10)
+    sent = []
+
+    def run_day(day, shard, slot, catching_up):
+        db.write(lambda conn: conn.execute("UPDATE scheduler_leases SET owner = 'other', expires_at = ?",
+                                           (time.time() + 60,)))
+        time.sleep(0.2)
+        scheduler.check_lease()
+        sent.append(day)
+
+    scheduler = ReminderScheduler(db, run_day, shards=1, lease_ttl=0.3)
+    scheduler.run_pending(moscow(day, 7))
+    scheduler.run_pending(moscow(day, 9, 1))
+
+    assert sent == []
+    assert scheduler.owned == []
+    assert db.get_watermark(scheduler.watermark_name(0, ('Europe/Moscow', 9))) < day
+
+
+@pytest.mark.parametrize('text, zone', [
+    ('UTC+14', 'Etc/GMT-14'), ('UTC+13', 'Etc/GMT-13'), ('+5', 'Etc/GMT-5'), ('UTC-12', 'Etc/GMT+12'),
+    ('GMT+0', 'UTC'), ('UTC+15', None), ('UTC-13', None), ('Europe/Moscow', 'Europe/Moscow'),
+])
+def test_parse_timezone(text, zone):
+    assert parse_timezone(text) == zone
+    if zone is not None:
+        ZoneInfo(zone)
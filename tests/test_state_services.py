@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+from src.config import settings
+from src.database.database import Database
+from src.services.state_services import ConversationStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def states(request, tmp_path, monkeypatch):
+    if request.param == 'memory':
+        yield ConversationStore()
+        return
+    monkeypatch.setattr(settings, 'DATABASE_PATH', str(tmp_path / 'bot.db'))
+    database = Database()
+    yield ConversationStore(database)
+    database.close()
+
+
+def test_concurrent_updates_are_not_lost(states):
+    states.set(1, {'step': 'wish_info'})
+
+    def add(number):
+        states.modify(1, lambda state: state.setdefault('generated', {}).update({str(number): number}))
+
+    threads = [threading.Thread(target=add, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    state = states.get(1)
+    assert state['step'] == 'wish_info'
+    assert len(state['generated']) == 20